@@ -4,9 +4,22 @@ import json
 import logging
 import base64
 import csv
+import time
+import hashlib
+from io import BytesIO
+import threading
+from itertools import islice, repeat
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait, as_completed
+from requests.adapters import HTTPAdapter
+from PIL import Image, ImageOps
 from dotenv import load_dotenv
 from flask import Flask, request, jsonify
 
+import metrics
+from http_client import RateLimiter
+from bulk_journal import BulkJournal
+from job_queue import DurableQueue
+
 # Настройка логирования
 logging.basicConfig(
     filename='/mike/bots/gorodbot/app.log',
@@ -20,112 +33,474 @@ load_dotenv()
 BUBBLE_API_URL = os.getenv('BUBBLE_API_URL')
 BUBBLE_API_KEY = os.getenv('BUBBLE_API_KEY')
 
+# Пакетная загрузка спинов: записей в одном запросе spin/bulk, одновременных запросов
+# и предел частоты запросов к Bubble Data API (в секунду, 0 - без ограничения)
+SPINS_BULK_SIZE = int(os.getenv('SPINS_BULK_SIZE', '1000'))
+SPINS_UPLOAD_PARALLELISM = int(os.getenv('SPINS_UPLOAD_PARALLELISM', '4'))
+BUBBLE_RATE_LIMIT = float(os.getenv('BUBBLE_RATE_LIMIT', '5'))
+# Загрузка спинов с фото: одновременные загрузки, максимальная сторона фото при пережатии (0 - отправлять
+# оригинал), целевой размер файла в КБ и начальное качество JPEG
+SPINS_IMAGE_PARALLELISM = int(os.getenv('SPINS_IMAGE_PARALLELISM', '4'))
+SPINS_IMAGE_MAX_SIDE = int(os.getenv('SPINS_IMAGE_MAX_SIDE', '0'))
+SPINS_IMAGE_TARGET_KB = int(os.getenv('SPINS_IMAGE_TARGET_KB', '300'))
+SPINS_IMAGE_QUALITY = int(os.getenv('SPINS_IMAGE_QUALITY', '85'))
+# Повторы не созданных строк пакета и каталог журналов загрузки по призам
+SPINS_BULK_RETRIES = int(os.getenv('SPINS_BULK_RETRIES', '3'))
+SPINS_JOURNAL_DIR = os.getenv('SPINS_JOURNAL_DIR', 'spin_journals')
+# Фоновые задачи /getspins: файл очереди, одновременно выполняемые задачи, предел ожидающих задач,
+# число попыток и время хранения завершенных задач (в течение него повторный сигнал не создает новую задачу)
+SPINS_QUEUE_PATH = os.getenv('SPINS_QUEUE_PATH', 'spins_queue.sqlite3')
+SPINS_JOB_WORKERS = int(os.getenv('SPINS_JOB_WORKERS', '2'))
+SPINS_JOB_LIMIT = int(os.getenv('SPINS_JOB_LIMIT', '100'))
+SPINS_JOB_ATTEMPTS = int(os.getenv('SPINS_JOB_ATTEMPTS', '3'))
+SPINS_JOB_KEEP = int(os.getenv('SPINS_JOB_KEEP', '86400'))
+
 app = Flask(__name__)
+metrics.install(app)
+
+# Запросы к Bubble Data API и созданные спины
+BUBBLE_SECONDS = metrics.Histogram('bubble_request_seconds', 'Длительность запроса к Bubble Data API', ['endpoint', 'status'])
+SPINS_CREATED = metrics.Counter('spins_created_total', 'Созданные спины', ['mode'])
+
+
+# Общая сессия Bubble с keep-alive пулом на все параллельные загрузки и общий предел частоты запросов
+bubble_session = requests.Session()
+bubble_adapter = HTTPAdapter(pool_connections=1, pool_maxsize=max(SPINS_UPLOAD_PARALLELISM, SPINS_IMAGE_PARALLELISM))
+bubble_session.mount('https://', bubble_adapter)
+bubble_session.mount('http://', bubble_adapter)
+bubble_rate_limiter = RateLimiter(BUBBLE_RATE_LIMIT, burst=SPINS_UPLOAD_PARALLELISM)
+
+
+# Запрос к Bubble с замером длительности
+def bubble_request(method, endpoint, **kwargs):
+    bubble_rate_limiter.acquire()
+    started = time.perf_counter()
+    response = bubble_session.request(method, f"{BUBBLE_API_URL}{endpoint}", **kwargs)
+    # id записи в метку не попадает, иначе каждый приз и спин порождал бы новую серию метрики
+    if endpoint.startswith('prize/'):
+        label = 'prize'
+    elif endpoint.startswith('spin/') and endpoint != 'spin/bulk':
+        label = 'spin_by_id'
+    else:
+        label = endpoint
+    BUBBLE_SECONDS.observe(time.perf_counter() - started, label, response.status_code)
+    return response
+
+# Тело запроса spin/bulk: по одной JSON-записи на строку. Собирается из итератора записей
+# непосредственно перед отправкой, поэтому в памяти одновременно только отправляемые пакеты
+def ndjson_body(rows):
+    return '\n'.join(json.dumps(row, ensure_ascii=False) for row in rows).encode('utf-8')
+
 
-def create_spins_bulk(amount, prize_id, sector, participate, prize_type, prize_name=None, photo_url=None):
-    bulk_size = 1000  # Максимальное количество записей за один запрос
-    used = "no"
+# Ленивое разбиение потока записей на пакеты по size штук
+def iter_chunks(rows, size):
+    rows = iter(rows)
+    while True:
+        chunk = list(islice(rows, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def post_bulk_chunk(rows):
     headers = {
         'Content-Type': 'text/plain',
         'Authorization': f'Bearer {BUBBLE_API_KEY}'
     }
+    return bubble_request('POST', 'spin/bulk', headers=headers, data=ndjson_body(rows))
 
-    logging.info(f"Начало создания спинов: amount={amount}, prize_id={prize_id}, sector={sector}, participate={participate}, prize_name={prize_name}, prize_type={prize_type}")
 
-    for i in range(0, amount, bulk_size):
-        current_amount = min(bulk_size, amount - i)
-        
-        spins = [{
-            'prize_id': prize_id,
-            'participate': participate,
-            'sector': sector,
-            'used': used,
-            'prize_type': prize_type,
-            'prize_name': prize_name,
-            'photo': photo_url
-        } for _ in range(current_amount)]
-
-        data = "\n".join([json.dumps(spin) for spin in spins])
-
-        logging.info(f'Bubble API URL: {BUBBLE_API_URL}spin/bulk')
-        logging.info(f'Заголовки запроса: {headers}')
-        logging.info(f'Отправка данных в Bubble API:\n{data}')
-
-        response = requests.post(f"{BUBBLE_API_URL}spin/bulk", headers=headers, data=data)
+# Ответ spin/bulk: по строке на каждую отправленную запись, {"status": "success", "id": ...} или
+# {"status": "error", "message": ...}. Возвращает признак успеха для каждой записи пакета;
+# записи без строки ответа считаются не созданными
+def parse_bulk_response(text, count):
+    results = []
+    for line in text.splitlines():
+        if not line.strip():
+            continue
+        try:
+            results.append(json.loads(line).get('status') == 'success')
+        except (ValueError, AttributeError):
+            results.append(False)
+    if len(results) != count:
+        logging.warning(f"Ответ spin/bulk содержит {len(results)} строк на {count} записей")
+    return (results + [False] * count)[:count]
+
+
+# Отправка одного пакета с повтором только не созданных строк. on_created(rows) вызывается после каждой
+# попытки с записями, созданными в ней. Возвращает созданные и не созданные записи
+def send_bulk_chunk(index, chunk, label, on_created=None):
+    rows = chunk
+    created_rows = []
+    for attempt in range(SPINS_BULK_RETRIES + 1):
+        if attempt:
+            time.sleep(min(2 ** attempt, 30))
+            logging.warning(f"{label}: пакет {index + 1}, повтор {attempt}/{SPINS_BULK_RETRIES} для {len(rows)} записей")
+        try:
+            response = post_bulk_chunk(rows)
+        except requests.exceptions.RequestException as e:
+            logging.error(f"{label}: ошибка соединения при отправке пакета {index + 1}: {str(e)}")
+            continue
+        if response.status_code != 200:
+            logging.error(f"{label}: ошибка при создании пакета {index + 1}: {response.status_code} - {response.text[:500]}")
+            continue
+        results = parse_bulk_response(response.text, len(rows))
+        created_now = [row for row, ok in zip(rows, results) if ok]
+        created_rows.extend(created_now)
+        if on_created and created_now:
+            on_created(created_now)
+        rows = [row for row, ok in zip(rows, results) if not ok]
+        if not rows:
+            break
+    return created_rows, rows
+
+
+# Параллельная загрузка потока записей через spin/bulk. В работе не больше SPINS_UPLOAD_PARALLELISM пакетов,
+# следующий пакет берется из генератора, только когда освобождается место. Каждый пакет фиксируется в журнале
+# (key(row) - ключ записи для продолжения загрузки), progress(chunk_index, created, failed) вызывается после
+# каждого пакета, mode - метка сценария в метрике созданных спинов. Возвращает число созданных и не созданных записей
+def upload_bulk(rows, total, label, progress=None, journal=None, key=None, mode='bulk'):
+    counters = {'created': 0, 'failed': 0, 'chunks': 0}
+    counters_lock = threading.Lock()
+    started = time.perf_counter()
+
+    def send(index, chunk):
+        chunk_started = time.perf_counter()
+        on_created = None
+        if journal is not None:
+            on_created = lambda rows: journal.record(index, len(rows), [key(row) for row in rows] if key else ())
+        created_rows, failed_rows = send_bulk_chunk(index, chunk, label, on_created)
+        with counters_lock:
+            counters['created'] += len(created_rows)
+            counters['failed'] += len(failed_rows)
+            counters['chunks'] += 1
+            done = counters['created'] + counters['failed']
+        SPINS_CREATED.inc(mode, amount=len(created_rows))
+        if failed_rows:
+            logging.error(f"{label}: пакет {index + 1}: не созданы {len(failed_rows)} из {len(chunk)} записей")
+        logging.info(
+            f"{label}: пакет {index + 1} ({len(created_rows)}/{len(chunk)} спинов) за {time.perf_counter() - chunk_started:.2f} с, "
+            f"обработано {done}/{total}"
+        )
+        if progress:
+            progress(index, len(created_rows), len(failed_rows))
+
+    with ThreadPoolExecutor(max_workers=SPINS_UPLOAD_PARALLELISM, thread_name_prefix='spins-bulk') as executor:
+        pending = set()
+        for index, chunk in enumerate(iter_chunks(rows, SPINS_BULK_SIZE)):
+            if len(pending) >= SPINS_UPLOAD_PARALLELISM:
+                done, pending = wait(pending, return_when=FIRST_COMPLETED)
+                for future in done:
+                    future.result()
+            pending.add(executor.submit(send, index, chunk))
+        for future in pending:
+            future.result()
+
+    elapsed = time.perf_counter() - started
+    logging.info(
+        f"{label}: создано {counters['created']}, ошибок {counters['failed']}, пакетов {counters['chunks']} "
+        f"за {elapsed:.1f} с ({counters['created'] / elapsed if elapsed else 0:.0f} спинов/с)"
+    )
+    return counters['created'], counters['failed']
+
+
+# Число спинов приза в Bubble (count + remaining ответа Data API); None, если запрос не удался
+def count_prize_spins(prize_id):
+    params = {
+        'constraints': json.dumps([{'key': 'prize_id', 'constraint_type': 'equals', 'value': prize_id}]),
+        'limit': 1
+    }
+    try:
+        response = bubble_request('GET', 'spin', headers={'Authorization': f'Bearer {BUBBLE_API_KEY}'}, params=params)
         if response.status_code == 200:
-            logging.info(f"Успешно создано {current_amount} спинов")
-        else:
-            logging.error(f"Ошибка при создании спинов: {response.status_code} - {response.text}")
+            result = response.json()['response']
+            return result.get('count', 0) + result.get('remaining', 0)
+        logging.error(f"Ошибка при подсчете спинов приза {prize_id}: {response.status_code} - {response.text[:500]}")
+    except (requests.exceptions.RequestException, ValueError, KeyError) as e:
+        logging.error(f"Ошибка при подсчете спинов приза {prize_id}: {str(e)}")
+    return None
+
+
+# Загрузка через журнал приза: прерванная загрузка с теми же параметрами продолжается, по завершении
+# число спинов приза в Bubble сверяется с ожидаемым. Возвращает (создано, не создано, сверка пройдена,
+# ключи созданных записей)
+def run_journaled_upload(prize_id, params, label, make_rows, total, progress=None, key=None):
+    journal = BulkJournal(SPINS_JOURNAL_DIR, prize_id, params)
+    if not journal.resumed:
+        journal.start(count_prize_spins(prize_id))
+    already_created = journal.created
+    if progress and already_created:
+        progress(None, already_created, 0)
+    created, failed = upload_bulk(
+        make_rows(journal), total - already_created, label, progress, journal, key, mode=params['scenario']
+    )
+    verified = verify_prize_spins(prize_id, journal, label)
+    # Журнал нужен только для досылки не созданных строк. Когда их нет, он закрывается и при
+    # неподтвержденной сверке (ошибка подсчета, отставание счетчика Bubble): иначе следующая загрузка
+    # с теми же параметрами продолжила бы этот журнал и ничего не создала
+    if not failed:
+        journal.finish()
+    return already_created + created, failed, verified, journal.keys
+
+
+# Сверка числа спинов приза в Bubble с базой журнала и созданными по нему записями
+def verify_prize_spins(prize_id, journal, label):
+    expected = journal.baseline + journal.created if journal.baseline is not None else None
+    actual = count_prize_spins(prize_id) if expected is not None else None
+    verified = actual is not None and actual == expected
+    if actual is None:
+        logging.warning(f"{label}: сверка количества спинов не выполнена")
+    elif not verified:
+        logging.error(f"{label}: в Bubble {actual} спинов приза, ожидалось {expected}")
+    else:
+        logging.info(f"{label}: сверка пройдена, спинов приза в Bubble: {actual}")
+    return verified
+
 
-def create_spins_one_by_one(folder, prize_id, sector, participate, prize_name, prize_type):
-    used = "no"
+# Запись количества созданных спинов в приз. Вызывается после загрузки, когда журнал уже может быть
+# удален, поэтому ошибка только логируется: повтор задачи из-за нее создал бы спины заново
+def update_prize_amount(prize_id, amount, label):
     headers = {
         'Content-Type': 'application/json',
         'Authorization': f'Bearer {BUBBLE_API_KEY}'
     }
+    try:
+        response = bubble_request('PATCH', f"prize/{prize_id}", headers=headers, json={"amount": amount})
+    except requests.exceptions.RequestException as e:
+        logging.error(f"{label}: ошибка при обновлении количества записей приза: {str(e)}")
+        return False
+    if response.status_code in (200, 204):  # Data API отвечает на PATCH 204 No Content
+        logging.info(f"{label}: количество созданных записей приза обновлено: {amount}")
+        return True
+    logging.error(f"{label}: ошибка при обновлении количества записей приза: {response.status_code} - {response.text}")
+    return False
+
+
+def create_spins_bulk(amount, prize_id, sector, participate, prize_type, prize_name=None, photo_url=None, progress=None):
+    spin = {
+        'prize_id': prize_id,
+        'participate': participate,
+        'sector': sector,
+        'used': "no",
+        'prize_type': prize_type,
+        'prize_name': prize_name,
+        'photo': photo_url
+    }
 
-    logging.info(f"Начало создания спинов поштучно: folder={folder}, prize_id={prize_id}, sector={sector}, participate={participate}, prize_name={prize_name}, prize_type={prize_type}")
+    logging.info(f"Начало создания спинов: amount={amount}, prize_id={prize_id}, sector={sector}, participate={participate}, prize_name={prize_name}, prize_type={prize_type}")
 
-    files = os.listdir(folder)
-    total_created = 0
+    # Все записи сценария одинаковы: поток строится без копирования записи amount раз,
+    # при продолжении загрузки отправляется только недостающее количество
+    created, failed, verified, _ = run_journaled_upload(
+        prize_id, {'scenario': 'bulk', 'amount': amount, 'spin': spin}, f"Приз {prize_id}",
+        lambda journal: repeat(spin, amount - journal.created), amount, progress
+    )
+    return created, failed, verified
+
+# Хеш содержимого файла: одинаковые фото загружаются в Bubble один раз
+def file_hash(file_path):
+    digest = hashlib.sha256()
+    with open(file_path, 'rb') as image_file:
+        for block in iter(lambda: image_file.read(1 << 20), b''):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+# Уменьшение и пережатие фото перед отправкой. Качество JPEG снижается ступенями, пока файл
+# не уложится в SPINS_IMAGE_TARGET_KB; если результат не меньше оригинала, отправляется оригинал.
+# Возвращает (имя файла, байты)
+def compress_image(file_name, data):
+    if SPINS_IMAGE_MAX_SIDE <= 0:
+        return file_name, data
+    try:
+        # Поворот по EXIF применяется к пикселям: при пересохранении тег ориентации теряется
+        image = ImageOps.exif_transpose(Image.open(BytesIO(data)))
+        image.thumbnail((SPINS_IMAGE_MAX_SIDE, SPINS_IMAGE_MAX_SIDE))
+        if image.mode in ('RGBA', 'LA') or 'transparency' in image.info:
+            # Прозрачность JPEG не поддерживает: такие фото только уменьшаются и сохраняются в PNG
+            buffer = BytesIO()
+            image.save(buffer, format='PNG', optimize=True)
+            result, extension = buffer.getvalue(), '.png'
+        else:
+            image = image.convert('RGB')
+            for quality in range(SPINS_IMAGE_QUALITY, 39, -10):
+                buffer = BytesIO()
+                image.save(buffer, format='JPEG', quality=quality, optimize=True, progressive=True)
+                if buffer.tell() <= SPINS_IMAGE_TARGET_KB * 1024:
+                    break
+            result, extension = buffer.getvalue(), '.jpg'
+    except Exception as e:
+        logging.warning(f"Не удалось пережать {file_name}, отправляется оригинал: {str(e)}")
+        return file_name, data
+    if len(result) >= len(data):
+        return file_name, data
+    return os.path.splitext(file_name)[0] + extension, result
+
+
+# URL файла фото созданного спина, чтобы остальные спины с тем же фото ссылались на уже загруженный файл
+def spin_photo_url(spin_id):
+    response = bubble_request('GET', f"spin/{spin_id}", headers={'Authorization': f'Bearer {BUBBLE_API_KEY}'})
+    if response.status_code != 200:
+        logging.error(f"Ошибка при получении спина {spin_id}: {response.status_code} - {response.text[:500]}")
+        return None
+    return response.json().get('response', {}).get('photo')
+
+
+# Спины одной группы одинаковых фото: первый спин создается с содержимым файла,
+# остальные - пакетом spin/bulk со ссылкой на загруженный файл. on_created(file_names) получает
+# файлы, спины которых созданы. Возвращает (создано, не создано)
+def upload_image_group(file_names, folder, spin, label, on_created=None):
+    headers = {
+        'Content-Type': 'application/json',
+        'Authorization': f'Bearer {BUBBLE_API_KEY}'
+    }
+    file_name = file_names[0]
+    with open(os.path.join(folder, file_name), 'rb') as image_file:
+        upload_name, data = compress_image(file_name, image_file.read())
+    spin_data = {
+        **spin,
+        'photo': {
+            'filename': upload_name,
+            'contents': base64.b64encode(data).decode('utf-8'),
+            'private': False,
+            'attach_to': None
+        }
+    }
+    logging.info(f"{label}: отправка {file_name} ({len(data) // 1024} КБ), одинаковых файлов: {len(file_names)}")
+    response = bubble_request('POST', 'spin', headers=headers, json=spin_data)
+    if response.status_code != 200:
+        logging.error(f"Ошибка при создании спина для файла {file_name}: {response.status_code} - {response.text[:500]}")
+        return 0, len(file_names)
+    SPINS_CREATED.inc('photo')
+    logging.info(f"Успешно создан спин для файла {file_name}")
+    if on_created:
+        on_created([file_name])
+    if len(file_names) == 1:
+        return 1, 0
+
+    photo_url = spin_photo_url(response.json().get('id'))
+    if not photo_url:
+        return 1, len(file_names) - 1
+    # Отдельная запись на каждую копию: созданные строки сопоставляются с файлами по самой записи
+    rows = [{**spin, 'photo': photo_url} for _ in file_names[1:]]
+    row_files = {id(row): name for row, name in zip(rows, file_names[1:])}
+    on_rows_created = (lambda created_rows: on_created([row_files[id(row)] for row in created_rows])) if on_created else None
+    created, failed = 1, 0
+    for index, chunk in enumerate(iter_chunks(rows, SPINS_BULK_SIZE)):
+        created_rows, failed_rows = send_bulk_chunk(index, chunk, f"{label}, копии {file_name}", on_rows_created)
+        created += len(created_rows)
+        failed += len(failed_rows)
+    SPINS_CREATED.inc('photo', amount=created - 1)
+    return created, failed
+
+
+def create_spins_one_by_one(folder, prize_id, sector, participate, prize_name, prize_type, progress=None):
+    spin = {
+        'prize_id': prize_id,
+        'participate': participate,
+        'sector': sector,
+        'used': "no",
+        'prize_type': prize_type,
+        'prize_name': prize_name
+    }
+    label = f"Приз {prize_id}"
 
-    for file_name in files:
-        file_path = os.path.join(folder, file_name)
+    logging.info(f"Начало создания спинов поштучно: folder={folder}, prize_id={prize_id}, sector={sector}, participate={participate}, prize_name={prize_name}, prize_type={prize_type}")
 
-        # Закодируем изображение в Base64
+    # Файлы группируются по содержимому: каждая группа - одна загрузка файла
+    groups = {}
+    for file_name in sorted(os.listdir(folder)):
+        file_path = os.path.join(folder, file_name)
+        if not os.path.isfile(file_path):
+            continue
         try:
-            with open(file_path, 'rb') as image_file:
-                encoded_image = base64.b64encode(image_file.read()).decode('utf-8')
-
-            spin_data = {
-                'prize_id': prize_id,
-                'participate': participate,
-                'sector': sector,
-                'used': used,
-                'prize_type': prize_type,
-                'prize_name': prize_name,  # Добавили поле prize_name
-                'photo': {
-                    'filename': file_name,
-                    'contents': encoded_image,
-                    'private': False,
-                    'attach_to': None
-                }
-            }
-
-            # Отправляем запрос на создание одного спина
-            logging.info(f'Отправка данных в Bubble API для файла {file_name}')
-            response = requests.post(f"{BUBBLE_API_URL}spin", headers=headers, json=spin_data)
-            if response.status_code == 200:
-                logging.info(f"Успешно создан спин для файла {file_name}")
-                total_created += 1
-            else:
-                logging.error(f"Ошибка при создании спина для файла {file_name}: {response.status_code} - {response.text}")
-
-        except Exception as e:
+            groups.setdefault(file_hash(file_path), []).append(file_name)
+        except OSError as e:
             logging.error(f"Ошибка при обработке файла {file_name}: {str(e)}")
+    files_count = sum(len(file_names) for file_names in groups.values())
+    logging.info(f"{label}: файлов {files_count}, различных фото {len(groups)}")
+
+    # Журнал приза с именами файлов, по которым спины уже созданы: повтор задачи или прерванная
+    # загрузка той же папки отправляет только оставшиеся файлы
+    journal = BulkJournal(SPINS_JOURNAL_DIR, prize_id, {'scenario': 'images', 'folder': os.path.abspath(folder), 'spin': spin})
+    if not journal.resumed:
+        journal.start(count_prize_spins(prize_id))
+    elif progress and journal.created:
+        progress(None, journal.created, 0)
+    pending_groups = []
+    for file_names in groups.values():
+        remaining = [file_name for file_name in file_names if file_name not in journal.keys]
+        if remaining:
+            pending_groups.append(remaining)
+    if journal.resumed:
+        logging.info(f"{label}: продолжение загрузки, уже создано {journal.created}, осталось групп {len(pending_groups)}")
 
-    # Делаем Patch запрос с обновлением количества созданных записей
-    patch_url = f"{BUBBLE_API_URL}prize/{prize_id}"
-    patch_data = {
-        "amount": total_created
-    }
+    total_created = 0
+    total_failed = 0
+    started = time.perf_counter()
+    with ThreadPoolExecutor(max_workers=SPINS_IMAGE_PARALLELISM, thread_name_prefix='spins-images') as executor:
+        futures = {
+            executor.submit(
+                upload_image_group, file_names, folder, spin, label,
+                lambda names, index=index: journal.record(index, len(names), names)
+            ): file_names
+            for index, file_names in enumerate(pending_groups)
+        }
+        for index, future in enumerate(as_completed(futures)):
+            try:
+                created, failed = future.result()
+            except Exception as e:
+                logging.error(f"Ошибка при обработке файла {futures[future][0]}: {str(e)}")
+                created, failed = 0, len(futures[future])
+            total_created += created
+            total_failed += failed
+            if progress:
+                progress(index, created, failed)
+    logging.info(f"{label}: создано {total_created} спинов с фото из {files_count} за {time.perf_counter() - started:.1f} с")
+
+    verified = verify_prize_spins(prize_id, journal, label)
+    if not total_failed:
+        journal.finish()
 
-    response = requests.patch(patch_url, headers=headers, json=patch_data)
-    if response.status_code == 200:
-        logging.info(f"Успешно обновлено количество созданных записей для приза {prize_id}")
-    else:
-        logging.error(f"Ошибка при обновлении количества записей для приза {prize_id}: {response.status_code} - {response.text}")
+    # Делаем Patch запрос с обновлением количества созданных записей
+    update_prize_amount(prize_id, journal.created, label)
+    return journal.created, total_failed, verified
 
-def create_spins_one_by_one_with_csv(folder, prize_id, sector, participate, prize_type, prize_name=None, photo_url=None):
-    # Split folder to get the directory, file, and column name
+# Parse "dir/file.csv?column" into the CSV path and the promocode column name
+def promocode_source(folder):
     try:
         folder_parts = folder.split('/')
         directory = '/'.join(folder_parts[:-1])
-        file_info = folder_parts[-1]
-        csv_filename, column_name = file_info.split('?')
-        csv_filename = os.path.join(directory, csv_filename)
-    except ValueError:
+        csv_filename, column_name = folder_parts[-1].split('?')
+        return os.path.join(directory, csv_filename), column_name
+    except (ValueError, AttributeError):
         logging.error(f"Invalid folder parameter format: {folder}")
+        return None, None
+
+
+# Stream promocodes from the CSV file: (code, status) per row, status is None for a new code,
+# 'empty' or 'duplicate' for rows that are skipped
+def iter_promocodes(csv_filename, column_name):
+    seen = set()
+    with open(csv_filename, newline='', encoding='utf-8') as csvfile:
+        for row in csv.DictReader(csvfile):
+            promocode = (row.get(column_name) or '').strip()
+            if not promocode:
+                yield promocode, 'empty'
+            elif promocode in seen:
+                yield promocode, 'duplicate'
+            else:
+                seen.add(promocode)
+                yield promocode, None
+
+
+def count_promocodes(csv_filename, column_name):
+    return sum(1 for _, status in iter_promocodes(csv_filename, column_name) if status is None)
+
+
+def create_spins_one_by_one_with_csv(folder, prize_id, sector, participate, prize_type, prize_name=None, photo_url=None, progress=None):
+    csv_filename, column_name = promocode_source(folder)
+    if csv_filename is None:
         return
 
     # Check if CSV file exists
@@ -133,62 +508,156 @@ def create_spins_one_by_one_with_csv(folder, prize_id, sector, participate, priz
         logging.error(f"CSV file does not exist: {csv_filename}")
         return
 
-    used = "no"
-    headers = {
-        'Content-Type': 'application/json',
-        'Authorization': f'Bearer {BUBBLE_API_KEY}'
+    with open(csv_filename, newline='', encoding='utf-8') as csvfile:
+        fieldnames = csv.DictReader(csvfile).fieldnames or []
+    if column_name not in fieldnames:
+        logging.error(f"Column '{column_name}' not found in CSV file {csv_filename}")
+        return
+
+    spin = {
+        'prize_id': prize_id,
+        'participate': participate,
+        'sector': sector,
+        'used': "no",
+        'prize_type': prize_type,
+        'prize_name': prize_name,
+        'photo': photo_url  # Use photo URL directly from bubble request
     }
 
     logging.info(f"Processing spins with CSV: {csv_filename}, prize_id={prize_id}, sector={sector}, participate={participate}, prize_name={prize_name}, prize_type={prize_type}")
 
-    # Read CSV and get the column with promocodes
-    total_created = 0
+    # Rows are streamed from the file in spin/bulk chunks; duplicate codes and codes already
+    # created by an interrupted run of the same file (journal) are not sent again
+    def make_rows(journal):
+        for promocode, status in iter_promocodes(csv_filename, column_name):
+            if status is None and promocode not in journal.keys:
+                yield {**spin, 'promocode': promocode}
+
+    file_stat = os.stat(csv_filename)
+    params = {
+        'scenario': 'promocodes', 'file': os.path.abspath(csv_filename), 'column': column_name,
+        'size': file_stat.st_size, 'mtime': int(file_stat.st_mtime), 'spin': spin
+    }
+    total_created, failed, verified, created_codes = run_journaled_upload(
+        prize_id, params, f"Prize {prize_id} ({os.path.basename(csv_filename)})", make_rows,
+        count_promocodes(csv_filename, column_name), progress, key=lambda row: row['promocode']
+    )
+
+    # Per-code result file next to the source CSV: created, failed, duplicate or empty.
+    # The upload is already done here, so failures are logged instead of failing (and re-running) the job
+    result_filename = f"{os.path.splitext(csv_filename)[0]}.result.csv"
     try:
-        with open(csv_filename, newline='', encoding='utf-8') as csvfile:
-            reader = csv.DictReader(csvfile)
-            if column_name not in reader.fieldnames:
-                logging.error(f"Column '{column_name}' not found in CSV file {csv_filename}")
-                return
-
-            for row in reader:
-                promocode = row.get(column_name)
-                if not promocode:
-                    logging.warning(f"Missing promocode in row: {row}")
-                    continue
-
-                spin_data = {
-                    'prize_id': prize_id,
-                    'participate': participate,
-                    'sector': sector,
-                    'used': used,
-                    'prize_type': prize_type,
-                    'prize_name': prize_name,
-                    'photo': photo_url,  # Use photo URL directly from bubble request
-                    'promocode': promocode
-                }
-
-                # Send the request to create one spin entry
-                logging.info(f'Creating spin with promocode {promocode}')
-                response = requests.post(f"{BUBBLE_API_URL}spin", headers=headers, json=spin_data)
-                if response.status_code == 200:
-                    logging.info(f"Successfully created spin for promocode {promocode}")
-                    total_created += 1
-                else:
-                    logging.error(f"Error creating spin for promocode {promocode}: {response.status_code} - {response.text}")
-    except Exception as e:
-        logging.error(f"Error processing CSV file: {str(e)}")
+        with open(result_filename, 'w', newline='', encoding='utf-8') as result_file:
+            writer = csv.writer(result_file)
+            writer.writerow(['promocode', 'status'])
+            for promocode, status in iter_promocodes(csv_filename, column_name):
+                writer.writerow([promocode, status or ('created' if promocode in created_codes else 'failed')])
+        logging.info(f"Promocode results for prize {prize_id} written to {result_filename}: created {total_created}, failed {failed}")
+    except OSError as e:
+        logging.error(f"Error writing promocode results {result_filename}: {str(e)}")
+        result_filename = None
 
     # Update the amount created in Bubble
-    patch_url = f"{BUBBLE_API_URL}prize/{prize_id}"
-    patch_data = {
-        "amount": total_created
-    }
+    update_prize_amount(prize_id, total_created, f"Prize {prize_id}")
+    return total_created, failed, verified, result_filename
+
+# Сценарии загрузки спинов, выполняемые в фоновых задачах
+SCENARIOS = {
+    'bulk': create_spins_bulk,
+    'images': create_spins_one_by_one,
+    'promocodes': create_spins_one_by_one_with_csv,
+}
 
-    response = requests.patch(patch_url, headers=headers, json=patch_data)
-    if response.status_code == 200:
-        logging.info(f"Successfully updated the amount of created spins for prize {prize_id}")
-    else:
-        logging.error(f"Error updating the amount for prize {prize_id}: {response.status_code} - {response.text}")
+
+# Ожидаемое число записей задачи для расчета остатка; None, если заранее неизвестно
+def scenario_total(scenario, args):
+    try:
+        if scenario == 'bulk':
+            return args['amount']
+        if scenario == 'images':
+            return len(os.listdir(args['folder']))
+        if scenario == 'promocodes':
+            csv_filename, column_name = promocode_source(args['folder'])
+            return count_promocodes(csv_filename, column_name) if csv_filename else None
+    except (OSError, ValueError, KeyError):
+        return None
+    return None
+
+
+class JobProgress:
+    """
+    Прогресс задачи загрузки спинов: счетчики обновляются после каждого пакета или записи,
+    в payload задачи в очереди сохраняются не чаще раза в секунду и в конце задачи.
+    """
+
+    def __init__(self, job_id, payload, total):
+        self.job_id = job_id
+        self.payload = payload
+        self.lock = threading.Lock()
+        self.state = {'total': total, 'created': 0, 'failed': 0, 'started': time.time(), 'updated': time.time()}
+        self.saved = 0.0
+        self.save(force=True)
+
+    def __call__(self, chunk_index, created, failed):
+        with self.lock:
+            self.state['created'] += created
+            self.state['failed'] += failed
+            self.state['updated'] = time.time()
+        self.save()
+
+    def save(self, force=False, **extra):
+        with self.lock:
+            self.state.update(extra)
+            if not force and time.time() - self.saved < 1:
+                return
+            self.saved = time.time()
+            payload = {**self.payload, 'progress': dict(self.state)}
+        spins_queue.update_payload(self.job_id, payload)
+
+
+# Обработчик фоновой задачи: прогресс пишется в payload, по нему отвечает /getspins/<job_id>.
+# Если часть записей не создана, задача завершается ошибкой: очередь повторяет ее, и повтор по журналу
+# приза досылает только не созданные записи; после исчерпания попыток задачу можно поставить заново
+def run_spins_job(job_id, payload, blob):
+    scenario, args = payload['scenario'], payload['args']
+    logging.info(f"Задача {job_id}: сценарий {scenario}, приз {args.get('prize_id')}")
+    progress = JobProgress(job_id, payload, scenario_total(scenario, args))
+    result = SCENARIOS[scenario](**args, progress=progress)
+    extra = {}
+    if result:
+        extra['verified'] = result[2]
+    if scenario == 'promocodes' and result:
+        extra['result_file'] = result[3]
+    if result and result[1]:
+        progress.save(force=True, **extra)
+        raise RuntimeError(f"не созданы {result[1]} записей")
+    progress.save(force=True, finished=time.time(), **extra)
+
+
+# Идентификатор задачи: приз и хеш параметров. Повторный сигнал Bubble с теми же параметрами
+# возвращает уже существующую задачу вместо повторного создания спинов
+def spins_job_id(prize_id, scenario, args):
+    digest = hashlib.sha256(json.dumps([scenario, args], sort_keys=True, ensure_ascii=False).encode('utf-8')).hexdigest()
+    return f"{prize_id}-{digest[:16]}"
+
+
+spins_queue = DurableQueue(
+    SPINS_QUEUE_PATH, run_spins_job, workers=SPINS_JOB_WORKERS, max_pending=SPINS_JOB_LIMIT,
+    max_attempts=SPINS_JOB_ATTEMPTS, keep_done=SPINS_JOB_KEEP, name='spins'
+)
+spins_queue.start()
+metrics.Gauge('spins_queue_jobs', 'Задачи загрузки спинов', ['status'], function=lambda: {
+    (status,): count for status, count in spins_queue.stats().items() if status in ('queued', 'running', 'failed')
+})
+
+
+def submit_spins_job(scenario, args):
+    job_id = spins_queue.put({'scenario': scenario, 'args': args}, job_id=spins_job_id(args['prize_id'], scenario, args))
+    if job_id is None:
+        logging.error(f"Очередь задач загрузки спинов заполнена ({SPINS_JOB_LIMIT})")
+        return jsonify({'error': 'Too many jobs, retry later'}), 503
+    logging.info(f"Задача {job_id} принята: сценарий {scenario}, приз {args['prize_id']}")
+    return jsonify({'status': 'Signal received', 'job_id': job_id}), 200
 
 @app.route('/getspins', methods=['GET', 'POST'])
 def receive_signal():
@@ -240,29 +709,61 @@ def receive_signal():
                 logging.error('Отсутствуют необходимые поля для сценария 1')
                 return jsonify({'error': 'Missing required fields'}), 400
 
-            create_spins_bulk(amount, prize_id, sector, participate, prize_type, prize_name, photo_url)
+            return submit_spins_job('bulk', {
+                'amount': amount, 'prize_id': prize_id, 'sector': sector, 'participate': participate,
+                'prize_type': prize_type, 'prize_name': prize_name, 'photo_url': photo_url
+            })
 
         elif scenario == "3" and adding_type == "one_by_one" and not photo_url:
             # Обработка сценария 3, если photo_url пустой
             if None in (folder, prize_id, sector, participate):
                 logging.error('Отсутствуют необходимые поля для сценария 3')
                 return jsonify({'error': 'Missing required fields'}), 400
-            create_spins_one_by_one(folder, prize_id, sector, participate, prize_name, prize_type)
+            return submit_spins_job('images', {
+                'folder': folder, 'prize_id': prize_id, 'sector': sector, 'participate': participate,
+                'prize_name': prize_name, 'prize_type': prize_type
+            })
             
         elif scenario == "1" and adding_type == "one_by_one" and photo_url:
             # Обработка сценария 4, если photo_url не пустой
-            create_spins_one_by_one_with_csv(folder, prize_id, sector, participate, prize_type, prize_name, photo_url)
+            return submit_spins_job('promocodes', {
+                'folder': folder, 'prize_id': prize_id, 'sector': sector, 'participate': participate,
+                'prize_type': prize_type, 'prize_name': prize_name, 'photo_url': photo_url
+            })
 
         else:
             logging.error('Неверный сценарий или adding_type')
             return jsonify({'error': 'Invalid scenario or adding_type'}), 400
 
-        logging.info('Сигнал успешно обработан')
-        return jsonify({'status': 'Signal received'}), 200
-
     except Exception as e:
         logging.exception(f'Исключение в receive_signal: {e}')
         return jsonify({'error': str(e)}), 500
 
+@app.route('/getspins/<job_id>', methods=['GET'])
+def spins_job_status(job_id):
+    job = spins_queue.get(job_id)
+    if job is None:
+        return jsonify({'error': 'Job not found'}), 404
+    progress = job['payload'].get('progress', {})
+    total = progress.get('total')
+    created = progress.get('created', 0)
+    failed = progress.get('failed', 0)
+    elapsed = progress.get('updated', 0) - progress.get('started', 0)
+    return jsonify({
+        'job_id': job_id,
+        'status': job['status'],
+        'scenario': job['payload']['scenario'],
+        'prize_id': job['payload']['args'].get('prize_id'),
+        'total': total,
+        'created': created,
+        'failed': failed,
+        'remaining': max(total - created - failed, 0) if total is not None else None,
+        'throughput': round(created / elapsed, 1) if elapsed > 0 else 0,
+        'verified': progress.get('verified'),
+        'result_file': progress.get('result_file'),
+        'attempts': job['attempts'],
+        'error': job['error']
+    })
+
 if __name__ == "__main__":
     app.run(host='0.0.0.0', port=5050)
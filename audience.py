@@ -0,0 +1,170 @@
+import os
+import csv
+import asyncio
+import logging
+from array import array
+from itertools import islice
+from dotenv import load_dotenv
+
+load_dotenv(dotenv_path="./.env", override=True)
+
+# Источник аудитории рассылки: csv (CSV_FILE) или mysql (таблица users, которую ведет update_users.py)
+AUDIENCE_SOURCE = os.getenv('AUDIENCE_SOURCE', 'csv')
+# Число строк, которое читается из MySQL за один запрос
+AUDIENCE_DB_BATCH = int(os.getenv('AUDIENCE_DB_BATCH', '5000'))
+# Сколько пользователей передается рассылке за одно обращение к потоку чтения
+AUDIENCE_READ_BATCH = 500
+
+DB_HOST = os.getenv('DB_HOST')
+DB_USER = os.getenv('DB_USER')
+DB_PASSWORD = os.getenv('DB_PASSWORD')
+DB_NAME = os.getenv('DB_NAME')
+
+
+class IntSet:
+    """
+    Множество целых чисел (id пользователей Telegram) в одном массиве array('q') с открытой
+    адресацией: 8 байт на ячейку при заполнении до 2/3 вместо ~90 байт на элемент у set().
+    """
+    EMPTY = -2 ** 63
+    MULTIPLIER = 0x9E3779B97F4A7C15
+
+    def __init__(self, values=(), capacity_bits=16):
+        self.bits = capacity_bits
+        self.table = array('q', [self.EMPTY]) * (1 << capacity_bits)
+        self.count = 0
+        for value in values:
+            self.add(value)
+
+    def _slot(self, value):
+        mask = (1 << self.bits) - 1
+        index = ((value * self.MULTIPLIER) & 0xFFFFFFFFFFFFFFFF) >> (64 - self.bits)
+        table = self.table
+        while True:
+            current = table[index]
+            if current == value or current == self.EMPTY:
+                return index
+            index = (index + 1) & mask
+
+    def add(self, value):
+        # Возвращает True, если значения еще не было в множестве
+        index = self._slot(value)
+        if self.table[index] == value:
+            return False
+        self.table[index] = value
+        self.count += 1
+        if self.count * 3 > len(self.table) * 2:
+            self._grow()
+        return True
+
+    def _grow(self):
+        old_table = self.table
+        self.bits += 1
+        self.table = array('q', [self.EMPTY]) * (1 << self.bits)
+        for value in old_table:
+            if value != self.EMPTY:
+                self.table[self._slot(value)] = value
+
+    def __contains__(self, value):
+        return self.table[self._slot(value)] == value
+
+    def __len__(self):
+        return self.count
+
+
+def csv_users(file_path, user_id_col="user_id", username_col="username"):
+    # Строки исходного CSV с разделителем ; по одной, без загрузки файла в память
+    with open(file_path, mode="r", encoding="utf-8", newline="") as file:
+        for row in csv.DictReader(file, delimiter=";"):
+            yield (row.get(user_id_col) or "").strip(), (row.get(username_col) or "").strip()
+
+
+def mysql_users(batch_size=AUDIENCE_DB_BATCH):
+    """
+    Пользователи из таблицы users порциями по batch_size строк в порядке user_id.
+    Каждая порция читается небуферизованным курсором, а следующая запрашивается с последнего
+    прочитанного user_id: соединение не держит открытый результат, пока идет медленная рассылка.
+    """
+    import mysql.connector
+
+    conn = mysql.connector.connect(host=DB_HOST, user=DB_USER, password=DB_PASSWORD, database=DB_NAME)
+    try:
+        last_id = None
+        while True:
+            cursor = conn.cursor(buffered=False)
+            if last_id is None:
+                cursor.execute("SELECT user_id, username FROM users ORDER BY user_id LIMIT %s", (batch_size,))
+            else:
+                cursor.execute(
+                    "SELECT user_id, username FROM users WHERE user_id > %s ORDER BY user_id LIMIT %s",
+                    (last_id, batch_size)
+                )
+            rows = cursor.fetchall()
+            cursor.close()
+            for user_id, username in rows:
+                yield str(user_id or "").strip(), (username or "").strip()
+            if len(rows) < batch_size:
+                return
+            last_id = rows[-1][0]
+    finally:
+        conn.close()
+
+
+class Audience:
+    """
+    Поток уникальных пользователей рассылки: (user_id, username) выдаются по мере чтения источника,
+    повторы user_id и пользователи из skip (уже обработанные при --resume) пропускаются.
+    """
+
+    def __init__(self, rows, skip=None):
+        self.rows = rows
+        self.skip = skip
+        self.seen = IntSet()
+        self.read = 0
+        self.duplicates = 0
+        self.skipped = 0
+        self.invalid = 0
+
+    def __iter__(self):
+        for user_id, username in self.rows:
+            self.read += 1
+            try:
+                user_id = int(user_id)
+            except ValueError:
+                # Нет user_id или он не числовой — пропускаем
+                self.invalid += 1
+                continue
+            if not self.seen.add(user_id):
+                self.duplicates += 1
+                continue
+            if self.skip is not None and user_id in self.skip:
+                self.skipped += 1
+                continue
+            yield {"user_id": user_id, "username": username}
+
+    def summary(self):
+        return (
+            f"прочитано {self.read}, повторов {self.duplicates}, без user_id {self.invalid}, "
+            f"уже обработано ранее {self.skipped}"
+        )
+
+
+def open_audience(file_path=None, user_id_col="user_id", username_col="username", skip=None):
+    if AUDIENCE_SOURCE == 'mysql':
+        logging.info(f"Аудитория рассылки: таблица users базы {DB_NAME} на {DB_HOST}")
+        return Audience(mysql_users(), skip)
+    logging.info(f"Аудитория рассылки: файл {file_path}")
+    return Audience(csv_users(file_path, user_id_col, username_col), skip)
+
+
+async def read_batches(audience, size=AUDIENCE_READ_BATCH):
+    """
+    Пользователи аудитории порциями по size, прочитанные в отдельном потоке: запросы страниц MySQL
+    и чтение файла не останавливают цикл событий, пока воркеры отправляют сообщения.
+    """
+    users = iter(audience)
+    while True:
+        batch = await asyncio.to_thread(lambda: list(islice(users, size)))
+        if not batch:
+            return
+        yield batch
@@ -0,0 +1,81 @@
+import os
+import sys
+import time
+import shutil
+import asyncio
+import logging
+import tempfile
+import tracemalloc
+
+# Пробная рассылка distrib.py против локальной замены Bot API (fake_telegram.py) для подбора параметров:
+#   python bench_broadcast.py [число воркеров ...]
+# Для каждого числа воркеров выводится устойчивая скорость отправки, время на BENCH_USERS пользователей,
+# оценка времени на BENCH_ESTIMATE_USERS, число ответов 429 и пиковый объем памяти Python (tracemalloc).
+# Параметры замены задаются переменными FAKE_TG_*, скорость рассылки - BROADCAST_RATE
+
+BENCH_USERS = int(os.getenv('BENCH_USERS', '3000'))
+BENCH_ESTIMATE_USERS = int(os.getenv('BENCH_ESTIMATE_USERS', '100000'))
+
+
+def write_audience(path, count):
+    with open(path, 'w', encoding='utf-8', newline='') as csv_file:
+        csv_file.write('user_id;username\n')
+        for i in range(count):
+            user_id = 100000000 + i * 7919
+            csv_file.write(f'{user_id};user{i}\n')
+            if i % 50 == 0:
+                # Около 2% повторов, как в реальных выгрузках
+                csv_file.write(f'{user_id};user{i}\n')
+
+
+def main():
+    worker_counts = [int(value) for value in sys.argv[1:]] or [int(os.getenv('BROADCAST_WORKERS', '30'))]
+
+    # Логирование настраивается до импорта distrib, его файл лога не создается
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+    import audience
+    import distrib
+    import fake_telegram
+
+    # Файлы рассылки направляются во временный каталог поверх значений из .env
+    workdir = tempfile.mkdtemp(prefix='bench-broadcast-')
+    distrib.CSV_FILE = os.path.join(workdir, 'users.csv')
+    distrib.USER_ID_COLUMN = 'user_id'
+    distrib.AUDIENCE_SOURCE = audience.AUDIENCE_SOURCE = 'csv'
+    distrib.BROADCAST_JOURNAL_PATH = os.path.join(workdir, 'journal.sqlite3')
+    distrib.REPORT_FILE = os.path.join(workdir, 'report.csv')
+    write_audience(distrib.CSV_FILE, BENCH_USERS)
+
+    sys.argv[1:] = ['--dry-run']
+    results = []
+    try:
+        for workers in worker_counts:
+            distrib.BROADCAST_WORKERS = workers
+            distrib.bucket = distrib.TokenBucket(distrib.BROADCAST_RATE)
+            for key in fake_telegram.counters:
+                fake_telegram.counters[key] = 0
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            summary = asyncio.run(distrib.main())
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            processed = summary['sent'] + summary['failed']
+            rate = processed / summary['elapsed'] if summary['elapsed'] else 0
+            results.append(
+                f"воркеров {workers:>4}: {processed} пользователей за {elapsed:.1f} с, {rate:.1f} сообщ./с, "
+                f"на {BENCH_ESTIMATE_USERS} - {BENCH_ESTIMATE_USERS / rate / 60 if rate else 0:.0f} мин, "
+                f"ответов 429: {fake_telegram.counters['rate_limited']}, пик памяти {peak / 1024 / 1024:.1f} МБ"
+            )
+    finally:
+        shutil.rmtree(workdir, ignore_errors=True)
+
+    print(f"\nЗамена Bot API: {fake_telegram.config}, лимит рассылки {distrib.BROADCAST_RATE} сообщ./с")
+    for line in results:
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
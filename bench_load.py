@@ -0,0 +1,168 @@
+import os
+import sys
+import csv
+import time
+import shutil
+import logging
+import tempfile
+import tracemalloc
+
+import fake_bubble
+
+# Нагрузочный прогон сценариев создания спинов и обработки чеков против локальной замены Bubble (fake_bubble.py):
+#   python bench_load.py [bulk images promocodes receipts]
+# Для каждого сценария выводится число записей, пропускная способность, задержка запросов к Bubble
+# (для чеков - полное время обработки чека) по p50, p95, p99
+# и пиковый объем памяти Python (tracemalloc). Параметры замены задаются переменными FAKE_*,
+# параметры сервисов - их обычными переменными окружения (SPINS_*, BUBBLE_RATE_LIMIT, BILLS_WORKERS)
+
+BENCH_SPINS = int(os.getenv('BENCH_SPINS', '20000'))
+BENCH_IMAGES = int(os.getenv('BENCH_IMAGES', '60'))
+BENCH_PROMOCODES = int(os.getenv('BENCH_PROMOCODES', '20000'))
+BENCH_RECEIPTS = int(os.getenv('BENCH_RECEIPTS', '300'))
+
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(int(round(share * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+
+# Замер задержки каждого запроса через сессию сервиса: обертка ставится один раз,
+# замеры пишутся в список текущего сценария
+def record_latencies(session, latencies):
+    if not hasattr(session, 'bench_latencies'):
+        send = session.request
+
+        def timed_request(*args, **kwargs):
+            started = time.perf_counter()
+            try:
+                return send(*args, **kwargs)
+            finally:
+                session.bench_latencies.append((time.perf_counter() - started) * 1000)
+
+        session.request = timed_request
+    session.bench_latencies = latencies
+
+
+def bench_bulk(addspins, workdir, latencies):
+    created, _, _ = addspins.create_spins_bulk(BENCH_SPINS, f'bench-bulk-{time.time():.0f}', 1, True, 'bench')
+    return created
+
+
+def bench_images(addspins, workdir, latencies):
+    from PIL import Image
+    folder = os.path.join(workdir, 'images')
+    os.makedirs(folder, exist_ok=True)
+    for i in range(BENCH_IMAGES):
+        path = os.path.join(folder, f'prize_{i}.jpg')
+        if i % 5 == 4:
+            # Каждое пятое фото - копия предыдущего, как в реальных папках призов
+            shutil.copy(os.path.join(folder, f'prize_{i - 1}.jpg'), path)
+        else:
+            Image.effect_noise((2000, 1500), 40 + i % 30).convert('RGB').save(path, quality=92)
+    before = fake_bubble.spins_by_prize.get('bench-images', 0)
+    addspins.create_spins_one_by_one(folder, 'bench-images', 1, True, 'bench', 'bench')
+    return fake_bubble.spins_by_prize.get('bench-images', 0) - before
+
+
+def bench_promocodes(addspins, workdir, latencies):
+    csv_path = os.path.join(workdir, 'promocodes.csv')
+    with open(csv_path, 'w', newline='', encoding='utf-8') as csvfile:
+        writer = csv.writer(csvfile)
+        writer.writerow(['code'])
+        for i in range(BENCH_PROMOCODES):
+            # Около 1% повторов
+            writer.writerow([f'BENCH{(i if i % 100 else i - 1):07d}'])
+    result = addspins.create_spins_one_by_one_with_csv(f'{csv_path}?code', f'bench-codes-{time.time():.0f}', 1, True, 'bench')
+    return result[0] if result else 0
+
+
+def bench_receipts(bills3, workdir, latencies):
+    base = int(time.time())
+    job_ids = []
+    for i in range(BENCH_RECEIPTS):
+        qr = f"t=20240315T1530&s=3500.00&fn={9960440300000000 + base % 100000 * 1000 + i}&i={i + 1}&fp={1000000 + i}&n=1"
+        job_ids.append(bills3.receipt_queue.put({
+            'bill_id': f'bench-{base}-{i}', 'user_id': 'bench', 'photo_url': 'https://fake-bubble.local/receipt.jpg',
+            'cache_url': f'https://fake-bubble.local/{base}/{i}.jpg', 'digest': None, 'cached_qr': qr,
+            'negative_cached': False
+        }))
+    pending = set(job_ids)
+    while pending:
+        time.sleep(0.05)
+        for job_id in list(pending):
+            job = bills3.receipt_queue.get(job_id)
+            if job['status'] in ('done', 'failed'):
+                pending.discard(job_id)
+                latencies.append((job['updated'] - job['created']) * 1000)
+    return sum(1 for job_id in job_ids if bills3.receipt_queue.get(job_id)['status'] == 'done')
+
+
+SCENARIOS = {
+    'bulk': bench_bulk,
+    'images': bench_images,
+    'promocodes': bench_promocodes,
+    'receipts': bench_receipts,
+}
+
+
+def main():
+    names = sys.argv[1:] or list(SCENARIOS)
+    unknown = [name for name in names if name not in SCENARIOS]
+    if unknown:
+        print(f"Неизвестные сценарии: {', '.join(unknown)}. Доступны: {', '.join(SCENARIOS)}")
+        return
+
+    workdir = tempfile.mkdtemp(prefix='bench-load-')
+    server = fake_bubble.serve_in_thread()
+    base_url = f'http://127.0.0.1:{server.server_port}'
+    # Все внешние адреса и файлы состояния сервисов направляются на замену и во временный каталог
+    os.environ.update({
+        'BUBBLE_API_URL': f'{base_url}/obj/',
+        'BUBBLE_API_KEY': 'bench',
+        'BUBBLE_WORKFLOW_API_URL': f'{base_url}/wf/receipt',
+        'CHECK_API_URL': f'{base_url}/check',
+        'CHECK_API_TOKEN': 'bench',
+        'SPINS_QUEUE_PATH': os.path.join(workdir, 'spins_queue.sqlite3'),
+        'SPINS_JOURNAL_DIR': os.path.join(workdir, 'spin_journals'),
+        'BILLS_QUEUE_PATH': os.path.join(workdir, 'bills_queue.sqlite3'),
+        'FISCAL_INDEX_PATH': os.path.join(workdir, 'fiscal_index.bin'),
+    })
+    os.environ.pop('RECEIPT_CACHE_PATH', None)
+    # Логирование настраивается до импорта сервисов, их собственные файлы логов не создаются
+    logging.basicConfig(level=logging.WARNING, format='%(asctime)s %(levelname)s %(message)s')
+
+    print(f"Замена Bubble: {base_url}, параметры: {fake_bubble.config}")
+    try:
+        for name in names:
+            latencies = []
+            if name == 'receipts':
+                # Для чеков задержка - полное время обработки от постановки в очередь до завершения
+                import bills3 as service
+            else:
+                import addspins as service
+                record_latencies(service.bubble_session, latencies)
+
+            tracemalloc.start()
+            started = time.perf_counter()
+            count = SCENARIOS[name](service, workdir, latencies)
+            elapsed = time.perf_counter() - started
+            _, peak = tracemalloc.get_traced_memory()
+            tracemalloc.stop()
+
+            latency_text = (
+                f"p50 {percentile(latencies, 0.5):.0f} мс, p95 {percentile(latencies, 0.95):.0f} мс, "
+                f"p99 {percentile(latencies, 0.99):.0f} мс" if latencies else "нет запросов"
+            )
+            print(
+                f"{name:>10}: {count} за {elapsed:.1f} с ({count / elapsed if elapsed else 0:.1f}/с), "
+                f"замеров {len(latencies)}: {latency_text}, пик памяти {peak / 1024 / 1024:.1f} МБ"
+            )
+    finally:
+        server.shutdown()
+        shutil.rmtree(workdir, ignore_errors=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,61 @@
+import os
+import sys
+import time
+import statistics
+
+import receipt_qr
+
+# Сравнение режимов распознавания QR-кода на папке с фото чеков:
+#   python bench_qr.py /path/to/receipts [single ladder]
+# Для каждого режима выводится доля распознанных чеков и задержка (среднее, p50, p95, максимум) в мс
+
+IMAGE_EXTENSIONS = ('.jpg', '.jpeg', '.png', '.heic', '.heif', '.webp')
+
+def percentile(values, share):
+    ordered = sorted(values)
+    index = min(int(round(share * (len(ordered) - 1))), len(ordered) - 1)
+    return ordered[index]
+
+def run_mode(mode, images):
+    latencies = []
+    found = 0
+    for image_bytes in images:
+        timings = {}
+        started = time.perf_counter()
+        try:
+            qr_data, _ = receipt_qr.decode_receipt_image(image_bytes, timings, mode=mode)
+        except Exception as e:
+            print(f"  ошибка декодирования: {e}")
+            qr_data = None
+        latencies.append((time.perf_counter() - started) * 1000)
+        if qr_data:
+            found += 1
+    return found, latencies
+
+def main():
+    if len(sys.argv) < 2:
+        print("Использование: python bench_qr.py <папка с фото> [режимы...]")
+        return
+    folder = sys.argv[1]
+    modes = sys.argv[2:] or ['single', 'ladder']
+
+    images = []
+    for file_name in sorted(os.listdir(folder)):
+        if file_name.lower().endswith(IMAGE_EXTENSIONS):
+            with open(os.path.join(folder, file_name), 'rb') as image_file:
+                images.append(image_file.read())
+    if not images:
+        print(f"В папке {folder} нет изображений")
+        return
+    print(f"Изображений: {len(images)}")
+
+    for mode in modes:
+        found, latencies = run_mode(mode, images)
+        print(
+            f"{mode:>8}: найдено {found}/{len(images)} ({found / len(images):.1%}), "
+            f"среднее {statistics.mean(latencies):.0f} мс, p50 {percentile(latencies, 0.5):.0f} мс, "
+            f"p95 {percentile(latencies, 0.95):.0f} мс, макс {max(latencies):.0f} мс"
+        )
+
+if __name__ == '__main__':
+    main()
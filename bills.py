@@ -1,88 +1,172 @@
-from flask import Flask, request, jsonify
+from flask import Flask, Response, request, jsonify
 import os
 import logging
 import requests
-from PIL import Image
-from io import BytesIO
-import zxing
-from pyzbar.pyzbar import decode
-import tempfile
+from requests.adapters import HTTPAdapter
+import json
+import threading
+import time
+import uuid
+import multiprocessing
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor, as_completed
 from dotenv import load_dotenv
 
 load_dotenv()
 
-# Настройка логирования
-logging.basicConfig(filename='bills.log', level=logging.DEBUG, 
+from receipt_cache import ReceiptCache, normalize_url, content_hash
+from receipt_qr import stage, decode_receipt_image, decode_receipt_job, zxing_queue
+import metrics
+
+# Асинхронный режим /bills: включен по умолчанию или только по флагу async в запросе,
+# число процессов распознавания, предел задач в очереди и в работе, время хранения результата
+BILLS_ASYNC_MODE = os.getenv('BILLS_ASYNC_MODE', '0') == '1'
+BILLS_DECODE_PROCESSES = int(os.getenv('BILLS_DECODE_PROCESSES', str(os.cpu_count() or 2)))
+BILLS_JOB_LIMIT = int(os.getenv('BILLS_JOB_LIMIT', '200'))
+BILLS_JOB_TTL = int(os.getenv('BILLS_JOB_TTL', '3600'))
+BILLS_CALLBACK_TIMEOUT = float(os.getenv('BILLS_CALLBACK_TIMEOUT', '10'))
+# Скачивание фото: таймауты соединения и чтения, одновременные скачивания и предел фото в пакетном запросе
+DOWNLOAD_CONNECT_TIMEOUT = float(os.getenv('DOWNLOAD_CONNECT_TIMEOUT', '5'))
+DOWNLOAD_READ_TIMEOUT = float(os.getenv('DOWNLOAD_READ_TIMEOUT', '30'))
+BATCH_DOWNLOAD_CONCURRENCY = int(os.getenv('BATCH_DOWNLOAD_CONCURRENCY', '16'))
+BATCH_MAX_PHOTOS = int(os.getenv('BATCH_MAX_PHOTOS', '1000'))
+
+# Настройка логирования; DEBUG включается через LOG_LEVEL только для отладки
+logging.basicConfig(filename='bills.log', level=os.getenv('LOG_LEVEL', 'INFO').upper(),
                     format='%(asctime)s %(levelname)s %(message)s')
 
 app = Flask(__name__)
+metrics.install(app)
 
-# Функция для корректировки ориентации изображения
-def correct_image_orientation(image):
-    try:
-        exif = image._getexif()
-        if exif is not None:
-            orientation_key = 274  # Exif-тег 'Orientation'
-            if orientation_key in exif:
-                orientation = exif[orientation_key]
-                if orientation == 3:
-                    image = image.rotate(180, expand=True)
-                elif orientation == 6:
-                    image = image.rotate(270, expand=True)
-                elif orientation == 8:
-                    image = image.rotate(90, expand=True)
-        return image
-    except Exception as e:
-        logging.error(f"Ошибка при корректировке ориентации изображения: {str(e)}")
-        return image
+# Кеш результатов распознавания по URL и хешу изображения.
+# В дочерних процессах пула распознавания кеш не нужен и не должен трогать журнал на диске
+receipt_cache = ReceiptCache() if multiprocessing.parent_process() is None else None
+
+# Общая сессия скачивания с keep-alive: соединения к CDN Bubble переиспользуются между запросами
+download_session = requests.Session()
+download_adapter = HTTPAdapter(pool_connections=4, pool_maxsize=BATCH_DOWNLOAD_CONCURRENCY)
+download_session.mount('https://', download_adapter)
+download_session.mount('http://', download_adapter)
 
-# Функция для распознавания QR-кода с помощью pyzbar
-def detect_qr_code_pyzbar(image_content):
+# Пул процессов распознавания и пул потоков для скачивания, создаются при первой асинхронной задаче.
+# spawn вместо fork: в родителе уже могут работать потоки zxing, их блокировки нельзя копировать в дочерний процесс
+decode_pool = None
+job_executor = None
+jobs = {}
+jobs_lock = threading.Lock()
+jobs_queued = 0
+jobs_in_flight = 0
+
+# Глубина очередей читается при запросе /metrics
+metrics.Gauge('bills_jobs', 'Асинхронные задачи распознавания', ['state'],
+              function=lambda: {('queued',): jobs_queued, ('in_flight',): jobs_in_flight})
+metrics.Gauge('zxing_queue_depth', 'Изображения в очереди пула zxing', function=zxing_queue.qsize)
+
+def start_job_pools():
+    global decode_pool, job_executor
+    with jobs_lock:
+        if decode_pool is None:
+            decode_pool = ProcessPoolExecutor(
+                max_workers=BILLS_DECODE_PROCESSES,
+                mp_context=multiprocessing.get_context('spawn')
+            )
+            job_executor = ThreadPoolExecutor(max_workers=BILLS_DECODE_PROCESSES * 2, thread_name_prefix='bills-job')
+            logging.info(f"Запущен пул распознавания: процессов={BILLS_DECODE_PROCESSES}, предел задач={BILLS_JOB_LIMIT}")
+
+def decode_in_pool(image_bytes, timings):
+    qr_data, method, job_timings = decode_pool.submit(decode_receipt_job, image_bytes).result()
+    timings.update(job_timings)
+    return qr_data, method
+
+# Полный цикл обработки чека: кеш, скачивание, распознавание. Возвращает тело ответа и HTTP-код
+def recognize_receipt(photo_url, decoder=decode_receipt_image):
+    timings = {}
+    cache_url = normalize_url(photo_url)
+    cached = receipt_cache.get_by_url(cache_url)
+    if cached is None:
+        with stage(timings, 'download'):
+            receipt_response = download_session.get(
+                photo_url, timeout=(DOWNLOAD_CONNECT_TIMEOUT, DOWNLOAD_READ_TIMEOUT)
+            )
+        if receipt_response.status_code != 200:
+            logging.error("Не удалось загрузить файл чека по указанному URL")
+            return {'status': 'Error', 'error': 'Не удалось загрузить файл чека по указанному URL'}, 400
+        digest = content_hash(receipt_response.content)
+        cached = receipt_cache.get_by_hash(digest, url=cache_url)
+
+    if cached is not None:
+        qr_data, method = cached['qr'], cached['method']
+        metrics.QR_RESULTS.inc('cache')
+        logging.info(f"Результат распознавания взят из кеша: {cache_url}")
+    else:
+        qr_data, method = decoder(receipt_response.content, timings)
+        receipt_cache.put(cache_url, digest, qr_data, method)
+        metrics.QR_RESULTS.inc(method if qr_data else ('not_found' if method else 'not_decoded'))
+        logging.info(f"Тайминги этапов обработки чека, мс: {timings}")
+    metrics.observe_timings(timings)
+
+    if qr_data:
+        logging.info(f"QR-код обнаружен с помощью {method}: {qr_data}")
+        return {'status': 'Success', 'qr': True, 'data': qr_data}, 200
+    else:
+        logging.info("QR-код не найден")
+        return {'status': 'Error', 'qr': False, 'error': 'QR-код через обработку на сервере не найден'}, 200
+
+# Флаг из запроса: JSON-значение или строка из workflow Bubble ("true"/"false", "1"/"0", "yes"/"no")
+def parse_flag(value, default):
+    if value is None:
+        return default
+    if isinstance(value, str):
+        return value.strip().lower() in ('1', 'true', 'yes', 'on')
+    return bool(value)
+
+# Удаление завершенных задач старше BILLS_JOB_TTL (вызывается под jobs_lock)
+def prune_jobs():
+    expired_before = time.time() - BILLS_JOB_TTL
+    for job_id in [job_id for job_id, job in jobs.items() if job['finished'] and job['finished'] < expired_before]:
+        del jobs[job_id]
+
+def run_bill_job(job_id, photo_url, callback_url):
+    global jobs_queued, jobs_in_flight
+    with jobs_lock:
+        jobs_queued -= 1
+        jobs_in_flight += 1
+        jobs[job_id]['status'] = 'running'
     try:
-        image = Image.open(image_content)
-        image = correct_image_orientation(image)
-        decoded_objects = decode(image)
-        if decoded_objects:
-            qr_data = decoded_objects[0].data.decode('utf-8')
-            logging.info(f"QR-код распознан с помощью pyzbar: {qr_data}")
-            return qr_data, 'pyzbar'
-        else:
-            logging.info("QR-код не найден с помощью pyzbar")
-            return None, 'pyzbar'
+        result, code = recognize_receipt(photo_url, decoder=decode_in_pool)
     except Exception as e:
-        logging.error(f"Ошибка при распознавании QR-кода с помощью pyzbar: {str(e)}")
-        return None, 'pyzbar'
+        logging.error(f"Ошибка в задаче {job_id}: {str(e)}")
+        result, code = {'status': 'Error', 'error': str(e)}, 500
+    with jobs_lock:
+        jobs_in_flight -= 1
+        jobs[job_id].update({'status': 'done', 'code': code, 'result': result, 'finished': time.time()})
 
-# Функция для распознавания QR-кода с помощью zxing
-def detect_qr_code_zxing(image_content):
-    try:
-        image = Image.open(image_content)
-        image = correct_image_orientation(image)
-        with tempfile.NamedTemporaryFile(suffix='.png', delete=False) as tmp_file:
-            image.save(tmp_file, format='PNG')
-            tmp_file_path = tmp_file.name
+    if callback_url:
         try:
-            reader = zxing.BarCodeReader()
-            qr_result = reader.decode(tmp_file_path)
-            if qr_result:
-                qr_data = qr_result.parsed
-                logging.info(f"QR-код распознан с помощью zxing: {qr_data}")
-                return qr_data, 'zxing'
-            else:
-                logging.info("QR-код не найден с помощью zxing")
-                return None, 'zxing'
-        finally:
-            os.unlink(tmp_file_path)
-    except Exception as e:
-        logging.error(f"Ошибка при распознавании QR-кода с помощью zxing: {str(e)}")
-        return None, 'zxing'
+            callback_response = requests.post(
+                callback_url, json={'job_id': job_id, **result}, timeout=BILLS_CALLBACK_TIMEOUT
+            )
+            logging.info(f"Результат задачи {job_id} отправлен на callback: {callback_response.status_code}")
+        except Exception as e:
+            logging.error(f"Ошибка отправки результата задачи {job_id} на callback {callback_url}: {str(e)}")
+
+def submit_bill_job(photo_url, callback_url):
+    global jobs_queued
+    start_job_pools()
+    with jobs_lock:
+        prune_jobs()
+        if jobs_queued + jobs_in_flight >= BILLS_JOB_LIMIT:
+            return None
+        job_id = uuid.uuid4().hex
+        jobs[job_id] = {'status': 'queued', 'created': time.time(), 'finished': None}
+        jobs_queued += 1
+    job_executor.submit(run_bill_job, job_id, photo_url, callback_url)
+    return job_id
 
 @app.route('/bills', methods=['POST'])
 def process_receipt():
     try:
-        logging.debug(f"Получен запрос: headers={request.headers}, body={request.get_data(as_text=True)}, form_data={request.form}, files={request.files}")
-
         data = request.get_json()
+        logging.debug(f"Получен запрос: {data}")
         photo_url = data.get('photo')
         
         if not photo_url:
@@ -93,29 +177,78 @@ def process_receipt():
             photo_url = 'https:' + photo_url
         
         logging.debug(f"Проверенный URL файла чека: {photo_url}")
-        
-        receipt_response = requests.get(photo_url)
-        if receipt_response.status_code != 200:
-            logging.error("Не удалось загрузить файл чека по указанному URL")
-            return jsonify({'status': 'Error', 'error': 'Не удалось загрузить файл чека по указанному URL'}), 400
 
-        image_content = BytesIO(receipt_response.content)
-        
-        # Попытка распознать QR-код с помощью pyzbar
-        qr_data, method = detect_qr_code_pyzbar(image_content)
-        if not qr_data:
-            qr_data, method = detect_qr_code_zxing(image_content)
-        
-        if qr_data:
-            logging.info(f"QR-код обнаружен с помощью {method}: {qr_data}")
-            return jsonify({'status': 'Success', 'qr': True, 'data': qr_data})
-        else:
-            logging.info("QR-код не найден")
-            return jsonify({'status': 'Error', 'qr': False, 'error': 'QR-код через обработку на сервере не найден'})
+        # Асинхронный режим: сразу отвечаем 202 с идентификатором задачи
+        if parse_flag(data.get('async'), BILLS_ASYNC_MODE):
+            job_id = submit_bill_job(photo_url, data.get('callback_url'))
+            if job_id is None:
+                logging.warning(f"Очередь задач распознавания заполнена ({BILLS_JOB_LIMIT})")
+                return jsonify({'status': 'Error', 'error': 'Сервис перегружен, повторите позже'}), 503
+            return jsonify({'status': 'Accepted', 'job_id': job_id}), 202
+
+        result, code = recognize_receipt(photo_url)
+        return jsonify(result), code
 
     except Exception as e:
         logging.error(f"Ошибка: {str(e)}")
         return jsonify({'status': 'Error', 'error': str(e)})
 
+# Пакетная проверка: фото скачиваются параллельно через общую сессию, распознаются в пуле процессов,
+# результаты отдаются построчно в NDJSON по мере готовности (порядок строк не совпадает с порядком фото)
+@app.route('/bills/batch', methods=['POST'])
+def process_receipt_batch():
+    try:
+        data = request.get_json()
+        photos = data.get('photos') if data else None
+        if not isinstance(photos, list) or not photos or not all(isinstance(url, str) and url for url in photos):
+            logging.error("Отсутствует список photos в пакетном запросе")
+            return jsonify({'status': 'Error', 'error': 'Отсутствует список photos'}), 400
+        if len(photos) > BATCH_MAX_PHOTOS:
+            return jsonify({'status': 'Error', 'error': f'Не более {BATCH_MAX_PHOTOS} фото в одном запросе'}), 400
+
+        logging.info(f"Пакетная проверка: {len(photos)} фото")
+        start_job_pools()
+
+        def generate():
+            with ThreadPoolExecutor(max_workers=BATCH_DOWNLOAD_CONCURRENCY, thread_name_prefix='bills-batch') as executor:
+                futures = {}
+                for photo_url in photos:
+                    full_url = photo_url if photo_url.startswith('http') else 'https:' + photo_url
+                    futures[executor.submit(recognize_receipt, full_url, decode_in_pool)] = photo_url
+                for future in as_completed(futures):
+                    try:
+                        result, _ = future.result()
+                    except Exception as e:
+                        logging.error(f"Ошибка пакетной проверки {futures[future]}: {str(e)}")
+                        result = {'status': 'Error', 'error': str(e)}
+                    yield json.dumps({'photo': futures[future], **result}, ensure_ascii=False) + '\n'
+
+        return Response(generate(), mimetype='application/x-ndjson')
+
+    except Exception as e:
+        logging.error(f"Ошибка: {str(e)}")
+        return jsonify({'status': 'Error', 'error': str(e)})
+
+@app.route('/bills/stats', methods=['GET'])
+def bills_stats():
+    with jobs_lock:
+        return jsonify({
+            'queued': jobs_queued,
+            'in_flight': jobs_in_flight,
+            'job_limit': BILLS_JOB_LIMIT,
+            'decode_processes': BILLS_DECODE_PROCESSES,
+            'zxing_queue': zxing_queue.qsize()
+        })
+
+@app.route('/bills/<job_id>', methods=['GET'])
+def bill_job_status(job_id):
+    with jobs_lock:
+        job = jobs.get(job_id)
+        if job is None:
+            return jsonify({'status': 'Error', 'error': 'Задача не найдена'}), 404
+        if job['status'] != 'done':
+            return jsonify({'job_id': job_id, 'status': job['status']}), 202
+        return jsonify({'job_id': job_id, 'job_status': 'done', **job['result']}), job['code']
+
 if __name__ == "__main__":
-    app.run(debug=True, host='0.0.0.0', port=5060)
+    app.run(host='0.0.0.0', port=5060)
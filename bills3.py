@@ -1,33 +1,328 @@
 from flask import Flask, request, jsonify
 import os
 import logging
-import requests
-from PIL import Image
-from io import BytesIO
-import pytesseract
-import threading
+import multiprocessing
 from dotenv import load_dotenv
 import json
 
 load_dotenv()
 
+from receipt_cache import ReceiptCache, normalize_url, content_hash
+from job_queue import DurableQueue, RetryLater
+from http_client import Upstream, CircuitOpenError
+from fiscal_index import FiscalIndex, fiscal_key, fiscal_key_from_qr
+from receipt_qr import stage, decode_receipt_image
+from receipt_ocr import extract_receipt_fields_in_pool
+from receipt_rules import load_rules
+import metrics
+
 BUBBLE_API_BASE_URL = os.getenv('BUBBLE_API_BASE_URL')
 CHECK_API_URL = os.getenv('CHECK_API_URL')
 CHECK_API_TOKEN = os.getenv('CHECK_API_TOKEN')
 BUBBLE_WORKFLOW_API_URL = os.getenv('BUBBLE_WORKFLOW_API_URL')
 
-# Настройка логирования
-logging.basicConfig(filename='bills.log', level=logging.DEBUG, 
+# Очередь фоновой обработки: файл SQLite, число воркеров, предел ожидающих задач и число попыток
+BILLS_QUEUE_PATH = os.getenv('BILLS_QUEUE_PATH', 'bills_queue.sqlite3')
+BILLS_WORKERS = int(os.getenv('BILLS_WORKERS', '4'))
+BILLS_QUEUE_LIMIT = int(os.getenv('BILLS_QUEUE_LIMIT', '10000'))
+BILLS_MAX_ATTEMPTS = int(os.getenv('BILLS_MAX_ATTEMPTS', '5'))
+
+# Таймауты и повторы запросов к сервису проверки чеков и к Bubble
+HTTP_CONNECT_TIMEOUT = float(os.getenv('HTTP_CONNECT_TIMEOUT', '5'))
+CHECK_API_READ_TIMEOUT = float(os.getenv('CHECK_API_READ_TIMEOUT', '60'))
+BUBBLE_READ_TIMEOUT = float(os.getenv('BUBBLE_READ_TIMEOUT', '30'))
+PHOTO_READ_TIMEOUT = float(os.getenv('PHOTO_READ_TIMEOUT', '30'))
+HTTP_RETRIES = int(os.getenv('HTTP_RETRIES', '3'))
+
+# Индекс уже проверенных чеков (ФН, ФД, ФП) и необязательный workflow Bubble для уведомления о дубликатах;
+# если он не задан, дубликат отправляется в основной workflow с полем status = duplicate
+FISCAL_INDEX_PATH = os.getenv('FISCAL_INDEX_PATH', 'fiscal_index.bin')
+DUPLICATE_WORKFLOW_URL = os.getenv('DUPLICATE_WORKFLOW_URL')
+
+# Необязательный workflow Bubble для уведомления о чеках, не прошедших правила акции (receipt_rules.py);
+# если он не задан, отказ отправляется в основной workflow с полем status = rejected
+REJECTED_WORKFLOW_URL = os.getenv('REJECTED_WORKFLOW_URL')
+
+# Настройка логирования; DEBUG включается через LOG_LEVEL только для отладки
+logging.basicConfig(filename='bills.log', level=os.getenv('LOG_LEVEL', 'INFO').upper(),
                     format='%(asctime)s %(levelname)s %(message)s')
 
 app = Flask(__name__)
+metrics.install(app)
+
+# Исходы обработки чеков и коды ответа сервиса проверки
+RECEIPT_OUTCOMES = metrics.Counter('bills_receipts_total', 'Итог фоновой обработки чека', ['outcome'])
+CHECK_API_CODES = metrics.Counter('check_api_code_total', 'Коды ответа сервиса проверки чеков', ['mode', 'code'])
+
+# Дочерние процессы пула OCR повторно импортируют этот модуль: очередь, индекс и кеш
+# с файлами на диске создаются только в основном процессе
+IS_MAIN_PROCESS = multiprocessing.parent_process() is None
+
+# Клиенты внешних сервисов с пулом соединений, повторами и предохранителем
+check_api = Upstream('check_api', connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=CHECK_API_READ_TIMEOUT,
+                     retries=HTTP_RETRIES, pool_size=BILLS_WORKERS)
+bubble_api = Upstream('bubble_workflow', connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=BUBBLE_READ_TIMEOUT,
+                      retries=HTTP_RETRIES, pool_size=BILLS_WORKERS)
+photo_cdn = Upstream('receipt_photo', connect_timeout=HTTP_CONNECT_TIMEOUT, read_timeout=PHOTO_READ_TIMEOUT,
+                     retries=HTTP_RETRIES, pool_size=BILLS_WORKERS)
+
+# Индекс проверенных чеков для отсечения повторов до обращения к платному сервису проверки
+fiscal_index = FiscalIndex(FISCAL_INDEX_PATH) if IS_MAIN_PROCESS else None
+
+# Кеш результатов распознавания по URL и хешу изображения (общий формат с bills.py)
+receipt_cache = ReceiptCache() if IS_MAIN_PROCESS else None
+
+# Правила акции собираются один раз при запуске; чеки, не прошедшие их, в Bubble не отправляются
+receipt_rules = load_rules() if IS_MAIN_PROCESS else None
+
+# Строка QR-кода фискального чека, восстановленная из ответа сервиса проверки
+def qr_from_check_json(json_data):
+    check_time = str(json_data.get('dateTime', '')).replace('-', '').replace(':', '')[:13]
+    return (
+        f"t={check_time}&s={json_data.get('totalSum', 0) / 100:.2f}"
+        f"&fn={json_data.get('fiscalDriveNumber')}&i={json_data.get('fiscalDocumentNumber')}"
+        f"&fp={json_data.get('fiscalSign')}&n={json_data.get('operationType')}"
+    )
+
+# Результат завершенного шага сохраняется в payload задачи: повтор задачи после сбоя
+# не обращается снова к платному сервису проверки и не отправляет чек в Bubble второй раз
+def save_step(job_id, job, **values):
+    job.update(values)
+    receipt_queue.update_payload(job_id, job)
+
+# Отправка в workflow Bubble с отметкой в задаче об успешной доставке
+def post_to_bubble(job_id, job, url, payload):
+    response = bubble_api.post(url, json=payload)
+    if response.status_code == 200:
+        save_step(job_id, job, bubble_posted=True)
+    return response
+
+# Повторный чек: не проверяется повторно, в Bubble уходит только отметка о дубликате, чтобы чек
+# не остался без решения, а пользователь - без ответа
+def handle_duplicate(job_id, job, stage_name):
+    bill_id = job['bill_id']
+    user_id = job['user_id']
+    logging.warning(f"Чек {bill_id} пользователя {user_id} уже был проверен ранее ({stage_name}), повторная обработка пропущена")
+    RECEIPT_OUTCOMES.inc('duplicate')
+    duplicate_response = post_to_bubble(
+        job_id, job, DUPLICATE_WORKFLOW_URL or BUBBLE_WORKFLOW_API_URL,
+        {'bill_id': bill_id, 'user': user_id, 'duplicate': True, 'status': 'duplicate'}
+    )
+    if duplicate_response.status_code != 200:
+        logging.error(f"Ошибка при отправке отметки о дубликате в Bubble: {duplicate_response.status_code} - {duplicate_response.text}")
+
+# Чек не соответствует правилам акции: отклоняется локально, в Bubble уходит отказ с причинами
+def handle_rejected(job_id, job, reasons):
+    bill_id = job['bill_id']
+    user_id = job['user_id']
+    logging.warning(f"Чек {bill_id} пользователя {user_id} отклонен по правилам акции: {'; '.join(reasons)}")
+    RECEIPT_OUTCOMES.inc('rejected')
+    rejected_response = post_to_bubble(
+        job_id, job, REJECTED_WORKFLOW_URL or BUBBLE_WORKFLOW_API_URL,
+        {'bill_id': bill_id, 'user': user_id, 'reasons': reasons, 'status': 'rejected'}
+    )
+    if rejected_response.status_code != 200:
+        logging.error(f"Ошибка при отправке отказа в Bubble: {rejected_response.status_code} - {rejected_response.text}")
+
+# Отправка проверенного чека в Bubble; повторный чек (по ФН/ФД/ФП из ответа сервиса) не отправляется
+def deliver_check_result(job_id, job, response_data):
+    bill_id = job['bill_id']
+    user_id = job['user_id']
+    json_data = response_data['data']['json']
+    key = fiscal_key(
+        json_data.get('fiscalDriveNumber'), json_data.get('fiscalDocumentNumber'), json_data.get('fiscalSign')
+    )
+    if fiscal_index.contains(key):
+        handle_duplicate(job_id, job, 'по ответу сервиса проверки')
+        return
+    reasons = receipt_rules.check(json_data)
+    if reasons:
+        handle_rejected(job_id, job, reasons)
+        return
+    bubble_payload = {
+        'bill_id': bill_id,
+        'user': user_id,
+        'status': 'verified',
+        'fn': str(json_data.get('fiscalDriveNumber')),
+        'fd': str(json_data.get('fiscalDocumentNumber')),
+        'fp': str(json_data.get('fiscalSign')),
+        'check_time': json_data.get('dateTime'),
+        'type': json_data.get('operationType'),
+        'sum': json_data.get('totalSum') / 100,
+        'address': json_data.get('retailPlaceAddress'),  # Добавляем адрес
+        'api_json': json.dumps(response_data)  # Передаем полный ответ в параметре api_json как строку
+    }
+    workflow_url = f"{BUBBLE_WORKFLOW_API_URL}"
+    bubble_response = post_to_bubble(job_id, job, workflow_url, bubble_payload)
+    if bubble_response.status_code == 200:
+        # В индекс чек попадает только после доставки в Bubble, чтобы повтор задачи не счел его дубликатом
+        fiscal_index.add(key)
+        RECEIPT_OUTCOMES.inc('delivered')
+        logging.info(f"Данные успешно отправлены в Bubble: {bubble_response.text}")
+    else:
+        RECEIPT_OUTCOMES.inc('bubble_error')
+        logging.error(f"Ошибка при отправке данных в Bubble: {bubble_response.status_code} - {bubble_response.text}")
+
+# Ответ сервиса проверки как JSON; None, если сервис вернул 200 с телом, которое не разбирается
+def check_response_json(response, bill_id):
+    try:
+        return response.json()
+    except ValueError:
+        logging.error(f"Сервис проверки вернул не JSON для чека {bill_id}: {response.text[:500]}")
+        RECEIPT_OUTCOMES.inc('check_api_error')
+        return None
+
+# Фоновая обработка чека воркером очереди. Исключение (сетевая ошибка, таймаут) приводит к повтору задачи;
+# шаги, выполненные при прошлых попытках (ответы сервиса проверки, отправка в Bubble), берутся из payload
+def background_processing(job_id, job, receipt_content):
+    if job.get('bubble_posted'):
+        logging.info(f"Задача {job_id}: чек {job['bill_id']} уже отправлен в Bubble при предыдущей попытке")
+        return
+    bill_id = job['bill_id']
+    user_id = job['user_id']
+    trimmed_photo_url = job['photo_url']
+    cache_url = job['cache_url']
+    digest = job['digest']
+    cached_qr = job['cached_qr']
+    negative_cached = job.get('negative_cached', False)
+
+    # QR-код распознается локально теми же декодерами, что и в bills.py: сервису проверки уходит
+    # строка QR вместо URL фото, что избавляет его от повторного скачивания и распознавания
+    if not cached_qr and not negative_cached and not job.get('decoded') and receipt_content is not None:
+        timings = {}
+        try:
+            cached_qr, method = decode_receipt_image(receipt_content, timings)
+            receipt_cache.put(cache_url, digest, cached_qr, method)
+            save_step(job_id, job, cached_qr=cached_qr, decoded=method is not None)
+            metrics.QR_RESULTS.inc(method if cached_qr else ('not_found' if method else 'not_decoded'))
+            metrics.observe_timings(timings)
+            logging.info(f"Локальное распознавание QR чека {bill_id}: {'найден ' + method if cached_qr else 'не найден'}, тайминги, мс: {timings}")
+        except Exception as e:
+            logging.error(f"Ошибка локального распознавания QR чека {bill_id}: {str(e)}")
+
+    # Если QR-код уже известен, повтор определяется по ФН/ФД/ФП без обращения к сервису проверки
+    if fiscal_index.contains(fiscal_key_from_qr(cached_qr)):
+        handle_duplicate(job_id, job, 'по QR-коду')
+        return
+
+    # Сумма, дата и тип операции из QR-кода проверяются по правилам акции до платного запроса
+    reasons = receipt_rules.check_qr(cached_qr) if cached_qr else []
+    if reasons:
+        handle_rejected(job_id, job, reasons)
+        return
+
+    # Проверка чека через API: по строке QR-кода, а если она неизвестна - по URL фото
+    logging.info("Отправка чека на проверку через API")
+    if cached_qr:
+        check_payload = {
+            'qrraw': cached_qr,
+            'token': CHECK_API_TOKEN
+        }
+    else:
+        check_payload = {
+            'qrurl': trimmed_photo_url,
+            'token': CHECK_API_TOKEN
+        }
+    response_data = job.get('check_response')
+    if response_data is None:
+        check_response = check_api.post(CHECK_API_URL, data=check_payload)
+        if check_response.status_code == 200:
+            response_data = check_response_json(check_response, bill_id)
+            if response_data is None:
+                return
+            save_step(job_id, job, check_response=response_data)
+            logging.info(f"Ответ от сервиса проверки чеков: {response_data}")
+            CHECK_API_CODES.inc('qrraw' if cached_qr else 'qrurl', response_data.get('code'))
+    else:
+        logging.info(f"Задача {job_id}: ответ сервиса проверки взят из предыдущей попытки")
+    if response_data is not None:
+        # Если чек успешно распознан, отправляем данные в Bubble
+        if response_data['code'] == 1:
+            if digest and not cached_qr:
+                receipt_cache.put(cache_url, digest, qr_from_check_json(response_data['data']['json']), 'check_api')
+            deliver_check_result(job_id, job, response_data)
+            return
+        # QR-код прочитан, но чек отклонен сервисом: OCR тех же реквизитов ничего не изменит
+        if cached_qr:
+            return
+
+    # Если QR-код не распознан ни локально, ни сервисом, извлекаем реквизиты чека с помощью OCR
+    logging.info("QR-код не распознан, выполняется OCR обработка изображения")
+    if receipt_content is None:
+        photo_response = photo_cdn.get(trimmed_photo_url)
+        if photo_response.status_code != 200:
+            logging.error(f"Не удалось загрузить фото чека {bill_id} для OCR: {photo_response.status_code}")
+            RECEIPT_OUTCOMES.inc('download_error')
+            return
+        receipt_content = photo_response.content
+    fields = job.get('ocr_fields')
+    if fields is None:
+        timings = {}
+        with stage(timings, 'ocr'):
+            fields = extract_receipt_fields_in_pool(receipt_content)
+        metrics.observe_timings(timings)
+        save_step(job_id, job, ocr_fields=fields)
+        logging.info(f"Реквизиты чека {bill_id}, извлеченные OCR: {fields}")
+    if not all(fields.get(name) for name in ('fn', 'fd', 'fp')):
+        # Без ФН/ФД/ФП платный ручной запрос заведомо бесполезен
+        logging.error(f"OCR не нашел ФН/ФД/ФП в чеке {bill_id}, ручная проверка не выполняется")
+        RECEIPT_OUTCOMES.inc('not_recognized')
+        return
+    if fiscal_index.contains(fiscal_key(fields['fn'], fields['fd'], fields['fp'])):
+        handle_duplicate(job_id, job, 'по реквизитам OCR')
+        return
+
+    # Ручной запрос к сервису проверки по реквизитам чека
+    manual_payload = {
+        'fn': fields['fn'],
+        'fd': fields['fd'],
+        'fp': fields['fp'],
+        't': fields.get('check_time', ''),
+        'n': fields.get('type', 1),
+        's': fields.get('total', ''),
+        'qr': 0
+    }
+    check_manual_payload = {
+        **manual_payload,
+        'token': CHECK_API_TOKEN
+    }
+    response_data = job.get('manual_response')
+    if response_data is None:
+        manual_check_response = check_api.post(CHECK_API_URL, data=check_manual_payload)
+        if manual_check_response.status_code != 200:
+            logging.error(f"Ошибка при ручной проверке чека: {manual_check_response.status_code} - {manual_check_response.text}")
+            return
+        response_data = check_response_json(manual_check_response, bill_id)
+        if response_data is None:
+            return
+        save_step(job_id, job, manual_response=response_data)
+        logging.info(f"Ответ от сервиса проверки чеков (ручной запрос): {response_data}")
+        CHECK_API_CODES.inc('manual', response_data.get('code'))
+    if response_data.get('code') == 1:
+        deliver_check_result(job_id, job, response_data)
+
+# Пока предохранитель внешнего сервиса открыт, задача откладывается до его закрытия
+# без траты попытки: отказ сервиса на минуту не должен переводить очередь в failed
+def process_queued_receipt(job_id, job, receipt_content):
+    try:
+        background_processing(job_id, job, receipt_content)
+    except CircuitOpenError as e:
+        raise RetryLater(str(e), e.retry_at)
+
+# Персистентная очередь фоновой обработки с фиксированным пулом воркеров
+if IS_MAIN_PROCESS:
+    receipt_queue = DurableQueue(
+        BILLS_QUEUE_PATH, process_queued_receipt, workers=BILLS_WORKERS, max_pending=BILLS_QUEUE_LIMIT,
+        max_attempts=BILLS_MAX_ATTEMPTS, name='bills'
+    )
+    receipt_queue.start()
+    metrics.Gauge('bills_queue_jobs', 'Задачи очереди обработки чеков', ['status'], function=lambda: {
+        (status,): count for status, count in receipt_queue.stats().items() if status in ('queued', 'running', 'failed')
+    })
 
 @app.route('/bills', methods=['POST'])
 def process_receipt():
     try:
-        # Логирование самого запроса
-        logging.debug(f"Получен запрос: headers={request.headers}, body={request.get_data(as_text=True)}, form_data={request.form}, files={request.files}")
-
         # Проверка типа контента
         if request.content_type != 'application/json':
             logging.error("Неправильный Content-Type, требуется 'application/json'")
@@ -35,6 +330,7 @@ def process_receipt():
 
         # Получение данных из POST-запроса
         data = request.get_json()
+        logging.debug(f"Получен запрос: {data}")
         user_id = data.get('user_id')
         bill_id = data.get('bill_id')
         photo_url = data.get('photo')
@@ -50,88 +346,62 @@ def process_receipt():
         # Загрузка файла чека по URL и обрезка URL после разрешения файла
         trimmed_photo_url = photo_url.split('?')[0]
         logging.debug(f"Обрезанный URL файла чека: {trimmed_photo_url}")
-        receipt_response = requests.get(trimmed_photo_url)
-        if receipt_response.status_code != 200:
-            logging.error("Не удалось загрузить файл чека по указанному URL")
-            return jsonify({'error': 'Не удалось загрузить файл чека по указанному URL'}), 400
 
-        # Получение бинарных данных изображения
-        receipt_content = receipt_response.content
+        # Повторная отправка того же фото: кеш отвечает без скачивания
+        cache_url = normalize_url(photo_url)
+        cached = receipt_cache.get_by_url(cache_url)
+        receipt_content = None
+        digest = None
+        if cached is None:
+            timings = {}
+            with stage(timings, 'download'):
+                receipt_response = photo_cdn.get(trimmed_photo_url)
+            metrics.observe_timings(timings)
+            if receipt_response.status_code != 200:
+                logging.error("Не удалось загрузить файл чека по указанному URL")
+                return jsonify({'error': 'Не удалось загрузить файл чека по указанному URL'}), 400
+
+            # Получение бинарных данных изображения
+            receipt_content = receipt_response.content
+            digest = content_hash(receipt_content)
+            cached = receipt_cache.get_by_hash(digest, url=cache_url)
+        else:
+            logging.info(f"Фото чека найдено в кеше, скачивание пропущено: {cache_url}")
+
+        # Уже распознанный QR-код отправляется в сервис проверки как строка, без повторного распознавания
+        cached_qr = cached['qr'] if cached else None
+
+        # Задача сохраняется в очередь на диске, обработка продолжается в фоне воркерами
+        job_id = receipt_queue.put({
+            'bill_id': bill_id,
+            'user_id': user_id,
+            'photo_url': trimmed_photo_url,
+            'cache_url': cache_url,
+            'digest': digest,
+            'cached_qr': cached_qr,
+            'negative_cached': cached is not None and not cached_qr
+        }, blob=receipt_content)
+        if job_id is None:
+            logging.error(f"Очередь обработки чеков заполнена ({BILLS_QUEUE_LIMIT})")
+            return jsonify({'error': 'Сервис перегружен, повторите позже'}), 503
+        logging.info(f"Чек {bill_id} поставлен в очередь обработки: задача {job_id}")
 
         # Сразу возвращаем положительный ответ об успешной загрузке файла
         logging.info("Файл чека успешно загружен, продолжаем обработку в фоне")
-        bubble_response = jsonify({'status': 'Success'})
-
-        # Фоновая обработка чека
-        def background_processing():
-            try:
-                # Попытка отправить изображение на проверку через API
-                logging.info("Отправка изображения на проверку через API")
-                check_payload = {
-                    'qrurl': trimmed_photo_url,
-                    'token': CHECK_API_TOKEN
-                }
-                check_response = requests.post(CHECK_API_URL, data=check_payload)
-                if check_response.status_code == 200:
-                    response_data = check_response.json()
-                    logging.info(f"Ответ от сервиса проверки чеков: {response_data}")
-                    # Если чек успешно распознан, отправляем данные в Bubble
-                    if response_data['code'] == 1:
-                        json_data = response_data['data']['json']
-                        bubble_payload = {
-                            'bill_id': bill_id,
-                            'user': user_id,
-                            'fn': str(json_data.get('fiscalDriveNumber')),
-                            'fd': str(json_data.get('fiscalDocumentNumber')),
-                            'fp': str(json_data.get('fiscalSign')),
-                            'check_time': json_data.get('dateTime'),
-                            'type': json_data.get('operationType'),
-                            'sum': json_data.get('totalSum') / 100,
-                            'address': json_data.get('retailPlaceAddress'),  # Добавляем адрес
-                            'api_json': json.dumps(response_data)  # Передаем полный ответ в параметре api_json как строку
-                        }
-                        workflow_url = f"{BUBBLE_WORKFLOW_API_URL}"
-                        bubble_response = requests.post(workflow_url, json=bubble_payload)
-                        if bubble_response.status_code == 200:
-                            logging.info(f"Данные успешно отправлены в Bubble: {bubble_response.json()}")
-                        else:
-                            logging.error(f"Ошибка при отправке данных в Bubble: {bubble_response.status_code} - {bubble_response.text}")
-                    return
-
-                # Если QR-код не распознан, выполняем OCR для извлечения текста
-                logging.info("QR-код не распознан, выполняется OCR обработка изображения")
-                image = Image.open(BytesIO(receipt_content))
-                receipt_text = pytesseract.image_to_string(image, lang='rus')
-                logging.info(f"Извлеченный текст из чека: {receipt_text}")
-                # Дополнительная обработка текста для формирования запроса вручную
-                manual_payload = {
-                    'fn': '...',  # Здесь следует добавить логику для извлечения нужных данных
-                    'fd': '...',
-                    'fp': '...',
-                    'check_time': '...',
-                    'type': '...',
-                    'sum': '...'
-                }
-                check_manual_payload = {
-                    **manual_payload,
-                    'token': CHECK_API_TOKEN
-                }
-                manual_check_response = requests.post(CHECK_API_URL, data=check_manual_payload)
-                if manual_check_response.status_code == 200:
-                    logging.info(f"Ответ от сервиса проверки чеков (ручной запрос): {manual_check_response.json()}")
-                else:
-                    logging.error(f"Ошибка при ручной проверке чека: {manual_check_response.status_code} - {manual_check_response.text}")
-
-            except Exception as e:
-                logging.error(f"Ошибка в фоновом процессе: {str(e)}")
-
-        threading.Thread(target=background_processing).start()
-
-        return bubble_response
+        return jsonify({'status': 'Success'})
 
     except Exception as e:
         logging.error(f"Ошибка: {str(e)}")
         return jsonify({'error': str(e)}), 500
 
+@app.route('/bills/stats', methods=['GET'])
+def bills_stats():
+    return jsonify({
+        **receipt_queue.stats(),
+        'fiscal_index': fiscal_index.stats(),
+        'rejected_by_rules': receipt_rules.rejected,
+        'upstreams': {upstream.name: upstream.stats() for upstream in (check_api, bubble_api)}
+    })
+
 if __name__ == '__main__':
     app.run(host='0.0.0.0', port=5060)
@@ -0,0 +1,97 @@
+import os
+import re
+import json
+import time
+import logging
+import threading
+
+
+class BulkJournal:
+    """
+    Журнал пакетной загрузки спинов одного приза (JSON Lines). Первая строка - заголовок загрузки
+    (параметры и число спинов приза до начала), далее по строке на каждый отправленный пакет:
+    сколько записей создано и, если записи различимы, их ключи (например, промокоды).
+    Прерванная загрузка с теми же параметрами продолжается с места остановки; после успешного
+    завершения журнал удаляется.
+    """
+
+    def __init__(self, directory, prize_id, params):
+        os.makedirs(directory, exist_ok=True)
+        self.path = os.path.join(directory, re.sub(r'[^\w.-]', '_', str(prize_id)) + '.jsonl')
+        self.lock = threading.Lock()
+        self.header = None
+        self.created = 0
+        self.keys = set()
+
+        if os.path.exists(self.path):
+            records = self._read_records()
+            header = records[0] if records else {}
+            if header.get('params') == params:
+                self.header = header
+                for record in records[1:]:
+                    self.created += record.get('created', 0)
+                    self.keys.update(record.get('keys', ()))
+                logging.info(f"Журнал загрузки {self.path}: продолжение, уже создано {self.created}")
+            else:
+                # Журнал от загрузки с другими параметрами: начинаем заново, старый сохраняем для разбора
+                stale_path = f"{self.path}.{int(time.time())}.stale"
+                os.replace(self.path, stale_path)
+                logging.warning(f"Журнал загрузки с другими параметрами перенесен в {stale_path}")
+
+        self.params = params
+
+    def _read_records(self):
+        """
+        Записи журнала до первой неполной строки. Строка, оборванная остановкой процесса во время
+        record(), и все после нее отбрасываются, файл обрезается до последней целой записи,
+        чтобы следующие записи не дописывались к обрывку.
+        """
+        records = []
+        valid_size = 0
+        with open(self.path, 'rb') as journal_file:
+            for line in journal_file:
+                if line.strip():
+                    try:
+                        records.append(json.loads(line))
+                    except ValueError:
+                        break
+                    if not line.endswith(b'\n'):
+                        # Последняя строка разобралась, но без перевода строки: дописываем его
+                        with open(self.path, 'ab') as repair_file:
+                            repair_file.write(b'\n')
+                        line += b'\n'
+                valid_size += len(line)
+        if valid_size < os.path.getsize(self.path):
+            logging.warning(f"Журнал загрузки {self.path}: неполная запись в конце отброшена")
+            with open(self.path, 'r+b') as journal_file:
+                journal_file.truncate(valid_size)
+        return records
+
+    @property
+    def resumed(self):
+        return self.header is not None
+
+    @property
+    def baseline(self):
+        return self.header.get('baseline') if self.header else None
+
+    def start(self, baseline):
+        with self.lock:
+            self.header = {'params': self.params, 'baseline': baseline, 'started': time.time()}
+            with open(self.path, 'w', encoding='utf-8') as journal_file:
+                journal_file.write(json.dumps(self.header, ensure_ascii=False) + '\n')
+
+    def record(self, chunk_index, created, keys=()):
+        if not created:
+            return
+        keys = list(keys)
+        with self.lock:
+            self.created += created
+            self.keys.update(keys)
+            with open(self.path, 'a', encoding='utf-8') as journal_file:
+                journal_file.write(json.dumps({'chunk': chunk_index, 'created': created, 'keys': keys}, ensure_ascii=False) + '\n')
+
+    def finish(self):
+        with self.lock:
+            if os.path.exists(self.path):
+                os.remove(self.path)
@@ -1,10 +1,20 @@
 import csv
+import sys
+import time
+import random
 import asyncio
 import logging
 from aiogram import Bot, Dispatcher
+from aiogram.client.session.aiohttp import AiohttpSession
+from aiogram.client.telegram import TelegramAPIServer
+from aiogram.exceptions import (
+    TelegramRetryAfter, TelegramForbiddenError, TelegramBadRequest, TelegramNetworkError, TelegramServerError
+)
 from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from dotenv import load_dotenv
 import os
+from send_journal import SendJournal
+from audience import AUDIENCE_SOURCE, IntSet, open_audience, read_batches
 
 load_dotenv(dotenv_path="./.env", override=True)
 
@@ -13,6 +23,17 @@ BOT_TOKEN = os.getenv('BOT_TOKEN')
 CSV_FILE = os.getenv('CSV_FILE')           # Исходный CSV (users.csv)
 USER_ID_COLUMN = os.getenv('USER_ID_COLUMN')  # Например, "user_id"
 GAME_URL = os.getenv('GAME_URL')
+# Адрес сервера Bot API (например, локального telegram-bot-api); по умолчанию - api.telegram.org
+BOT_API_URL = os.getenv('BOT_API_URL')
+# Скорость рассылки (сообщений в секунду, лимит Telegram - около 30), число одновременных отправок
+# и число повторов при временных ошибках сети и сервера Telegram
+BROADCAST_RATE = float(os.getenv('BROADCAST_RATE', '28'))
+BROADCAST_WORKERS = int(os.getenv('BROADCAST_WORKERS', '30'))
+BROADCAST_RETRIES = int(os.getenv('BROADCAST_RETRIES', '3'))
+BROADCAST_REPORT_INTERVAL = float(os.getenv('BROADCAST_REPORT_INTERVAL', '5'))
+# Журнал результатов отправки (для продолжения рассылки: python distrib.py --resume) и файл отчета
+BROADCAST_JOURNAL_PATH = os.getenv('BROADCAST_JOURNAL_PATH', 'distribution_journal.sqlite3')
+REPORT_FILE = os.getenv('BROADCAST_REPORT_FILE', 'distribution_report.csv')
 MESSAGE_TEXT = (
     "Шопинг на полную катушку с Вики Шоу!\n\n"
     "С 14 по 29 марта в ТРЦ “Город Лефортово” — настоящая охота за призами! "
@@ -33,127 +54,271 @@ logging.basicConfig(
     format="%(asctime)s - %(levelname)s - %(message)s"
 )
 
-# Создаем бота и диспетчер
-bot = Bot(token=BOT_TOKEN)
+def create_bot(api_url=None, token=BOT_TOKEN):
+    if api_url:
+        return Bot(token=token, session=AiohttpSession(api=TelegramAPIServer.from_base(api_url)))
+    return Bot(token=token)
+
+# Создаем бота и диспетчер (для пробной рассылки бот создается в main)
+bot = create_bot(BOT_API_URL) if BOT_TOKEN else None
 dp = Dispatcher()
 
 # Счетчики успешных и неуспешных отправок
 success_count = 0
 failure_count = 0
 
-def read_users(file_path, user_id_col="user_id", username_col="username"):
+class TokenBucket:
     """
-    Считывает исходный CSV с разделителем ; и возвращает список словарей вида:
-    [{ "user_id": "...", "username": "..." }, ...].
-    Если username_col не найден, пишем пустую строку.
+    Общий для всех воркеров ограничитель скорости отправки. При TelegramRetryAfter вся рассылка
+    приостанавливается на retry_after секунд, а скорость снижается; после успешных отправок
+    она постепенно возвращается к заданной.
     """
-    users_data = []
-    try:
-        if not os.path.exists(file_path):
-            logging.error(f"Файл {file_path} не найден.")
-            print(f"Файл {file_path} не найден.")
-            return users_data
-
-        with open(file_path, mode="r", encoding="utf-8") as file:
-            reader = csv.DictReader(file, delimiter=";")
-            for row in reader:
-                if not row.get(user_id_col):
-                    # Нет user_id — пропускаем
+
+    def __init__(self, rate):
+        self.target_rate = rate
+        self.rate = rate
+        self.tokens = 1.0
+        self.updated = time.monotonic()
+        self.paused_until = 0.0
+        self.lock = asyncio.Lock()
+
+    async def acquire(self):
+        async with self.lock:
+            while True:
+                now = time.monotonic()
+                if now < self.paused_until:
+                    await asyncio.sleep(self.paused_until - now)
                     continue
-                users_data.append({
-                    "user_id": row.get(user_id_col, "").strip(),
-                    "username": row.get(username_col, "").strip()
-                })
+                self.tokens = min(1.0, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                await asyncio.sleep((1 - self.tokens) / self.rate)
+
+    def flood_wait(self, retry_after):
+        self.paused_until = max(self.paused_until, time.monotonic() + retry_after)
+        self.rate = max(1.0, self.rate * 0.8)
+        logging.warning(f"Flood control: пауза {retry_after} с, скорость снижена до {self.rate:.1f} сообщ./с")
+
+    def success(self):
+        if self.rate < self.target_rate:
+            self.rate = min(self.target_rate, self.rate + 0.05)
+
+# Ошибки Bad Request, относящиеся к самому получателю: повтор для него бесполезен.
+# Остальные (неверная кнопка, слишком длинный текст, разметка) означают ошибку в сообщении
+USER_BAD_REQUEST_ERRORS = ("chat not found", "user not found", "user is deactivated", "peer_id_invalid")
 
-        logging.info(f"Загружено {len(users_data)} строк (user_id, username).")
-        print(f"Загружено {len(users_data)} строк (user_id, username).")
-    except Exception as e:
-        logging.error(f"Ошибка при чтении файла {file_path}: {e}")
-        print(f"Ошибка при чтении файла {file_path}: {e}")
+class MessageRejected(Exception):
+    """Telegram отклонил само сообщение: рассылка останавливается, иначе ошибка повторится для всех."""
 
-    return users_data
+bucket = TokenBucket(BROADCAST_RATE)
+keyboard = InlineKeyboardMarkup(inline_keyboard=[
+    [InlineKeyboardButton(text="Вернуться в игру", url=GAME_URL)]
+])
 
 async def send_message(user_id):
     """
-    Отправляет сообщение пользователю, возвращает строку статуса.
-    Возвращаемое значение мы будем записывать в колонку status.
+    Отправляет сообщение пользователю, возвращает строку статуса и признак окончательного результата.
+    Строку статуса мы будем записывать в колонку status.
+    Flood control ожидается без ограничения числа попыток, временные ошибки повторяются
+    до BROADCAST_RETRIES раз, блокировка бота и несуществующий чат не повторяются.
     """
     global success_count, failure_count
-    keyboard = InlineKeyboardMarkup(inline_keyboard=[
-        [InlineKeyboardButton(text="Вернуться в игру", url=GAME_URL)]
-    ])
-    try:
-        await bot.send_message(chat_id=user_id, text=MESSAGE_TEXT, reply_markup=keyboard)
-        logging.info(f"Сообщение отправлено: {user_id}")
-        print(f"Сообщение отправлено: {user_id}")
-        success_count += 1
-        return "sent"  # или можно вернуть более развернутый текст
-    except Exception as e:
-        logging.error(f"Ошибка отправки для {user_id}: {e}")
-        print(f"Ошибка отправки для {user_id}: {e}")
+    attempt = 0
+    while True:
+        await bucket.acquire()
+        try:
+            await bot.send_message(chat_id=user_id, text=MESSAGE_TEXT, reply_markup=keyboard)
+            bucket.success()
+            logging.info(f"Сообщение отправлено: {user_id}")
+            success_count += 1
+            return "sent", True
+        except TelegramRetryAfter as e:
+            bucket.flood_wait(e.retry_after)
+            continue
+        except TelegramForbiddenError as e:
+            logging.error(f"Ошибка отправки для {user_id}: {e}")
+            failure_count += 1
+            return f"error: {e}", True
+        except TelegramBadRequest as e:
+            if not any(text in e.message.lower() for text in USER_BAD_REQUEST_ERRORS):
+                raise MessageRejected(str(e)) from e
+            logging.error(f"Ошибка отправки для {user_id}: {e}")
+            failure_count += 1
+            return f"error: {e}", True
+        except (TelegramNetworkError, TelegramServerError, asyncio.TimeoutError) as e:
+            if attempt < BROADCAST_RETRIES:
+                attempt += 1
+                logging.warning(f"Временная ошибка отправки для {user_id} ({e}), повтор {attempt}/{BROADCAST_RETRIES}")
+                await asyncio.sleep(min(2 ** attempt, 30) * random.uniform(0.5, 1.0))
+                continue
+            error = e
+        except Exception as e:
+            error = e
+        logging.error(f"Ошибка отправки для {user_id}: {error}")
         failure_count += 1
-        return f"error: {e}"
+        return f"error: {error}", False
+
+async def send_worker(queue, journal, report, stop):
+    while True:
+        item = await queue.get()
+        try:
+            if stop.is_set():
+                # Рассылка остановлена: пользователь не записывается и будет обработан при --resume
+                continue
+            try:
+                status, final = await send_message(item["user_id"])
+            except MessageRejected as e:
+                if not stop.is_set():
+                    stop.set()
+                    logging.critical(f"Telegram отклонил сообщение, рассылка остановлена: {e}")
+                    print(f"Telegram отклонил сообщение, рассылка остановлена: {e}")
+                continue
+            # Результат сразу фиксируется в журнале и дописывается в отчет
+            journal.record(item["user_id"], item["username"], status, final)
+            report.writerow({"user_id": item["user_id"], "username": item["username"], "status": status})
+        finally:
+            queue.task_done()
+
+REPORT_FIELDS = ["user_id", "username", "status"]
+
+def open_report(journal, resume, path):
+    """
+    Открывает отчет для построчной записи во время рассылки. При продолжении рассылки строки
+    дописываются в существующий отчет; если его нет, он восстанавливается из журнала.
+    """
+    append = resume and os.path.exists(path) and os.path.getsize(path) > 0
+    report_file = open(path, mode="a" if append else "w", encoding="utf-8", newline="", buffering=1)
+    writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS, delimiter=";")
+    if not append:
+        writer.writeheader()
+        if resume:
+            for user_id, username, status in journal.rows():
+                writer.writerow({"user_id": user_id, "username": username, "status": status})
+    return report_file, writer
+
+def write_final_report(journal, path):
+    """
+    Итоговый отчет из журнала: по одной строке на пользователя с последним статусом.
+    Дописанный при --resume отчет может содержать и прежнюю ошибку, и успешную повторную отправку.
+    """
+    temp_path = f"{path}.tmp"
+    with open(temp_path, mode="w", encoding="utf-8", newline="") as report_file:
+        writer = csv.DictWriter(report_file, fieldnames=REPORT_FIELDS, delimiter=";")
+        writer.writeheader()
+        for user_id, username, status in journal.rows():
+            writer.writerow({"user_id": user_id, "username": username, "status": status})
+    os.replace(temp_path, path)
+
+# Текущая скорость рассылки в консоль и лог каждые BROADCAST_REPORT_INTERVAL секунд
+async def report_progress(started, audience):
+    previous_done, previous_time = 0, started
+    while True:
+        await asyncio.sleep(BROADCAST_REPORT_INTERVAL)
+        now = time.monotonic()
+        done = success_count + failure_count
+        current_rate = (done - previous_done) / (now - previous_time)
+        line = (
+            f"Отправлено {done} (прочитано {audience.read}): успешно {success_count}, ошибок {failure_count}, "
+            f"{current_rate:.1f} сообщ./с (среднее {done / (now - started):.1f}), лимит {bucket.rate:.1f}"
+        )
+        print(line)
+        logging.info(line)
+        previous_done, previous_time = done, now
+
+# Файлы пробной рассылки лежат рядом с рабочими и не смешиваются с ними
+def dry_run_path(path):
+    directory, name = os.path.split(path)
+    return os.path.join(directory, f"dry_run_{name}")
 
 async def main():
-    global success_count, failure_count
+    """
+    Рассылка по аудитории. Аргументы командной строки: --resume - продолжить прерванную рассылку,
+    --dry-run - пробная рассылка через локальную замену Bot API (fake_telegram.py) без отправки
+    реальным пользователям. Возвращает итоговые счетчики.
+    """
+    global bot, success_count, failure_count
+    success_count = failure_count = 0
     print("Скрипт запущен")
     logging.info("Скрипт запущен")
     logging.info(f"Используемый файл: {CSV_FILE}")
 
     # Проверяем, существует ли файл
-    if not os.path.exists(CSV_FILE):
+    if AUDIENCE_SOURCE == "csv" and not os.path.exists(CSV_FILE):
         logging.error(f"Файл {CSV_FILE} не найден.")
         print(f"Файл {CSV_FILE} не найден.")
         return
 
-    # Считываем пользователей (user_id, username) из исходного файла
-    users_data = read_users(
-        file_path=CSV_FILE,
-        user_id_col=USER_ID_COLUMN,
-        username_col="username"   # <-- Если у вас иная колонка с username, поменяйте здесь
-    )
-
-    # Сюда будем собирать результаты рассылки
-    results = []
-
-    # Рассылаем сообщения и фиксируем результат
-    for item in users_data:
-        user_id = item["user_id"]
-        username = item["username"]
-
-        if not user_id:
-            # Пропускаем "пустые" строки
-            continue
+    journal_path, report_path = BROADCAST_JOURNAL_PATH, REPORT_FILE
+    fake_server = None
+    if "--dry-run" in sys.argv[1:]:
+        # Замена Bot API нужна только пробной рассылке
+        import fake_telegram
+        fake_server, api_url = await fake_telegram.start_server()
+        bot = create_bot(api_url, BOT_TOKEN or "0:dry-run")
+        journal_path, report_path = dry_run_path(journal_path), dry_run_path(report_path)
+        print(f"Пробная рассылка через замену Bot API {api_url}, параметры: {fake_telegram.config}")
+        logging.info(f"Пробная рассылка через замену Bot API {api_url}")
 
-        # Статус отправки
-        status = await send_message(user_id)
+    # Журнал отправок: при --resume пропускаем пользователей с окончательным результатом
+    resume = "--resume" in sys.argv[1:]
+    journal = SendJournal(journal_path, resume=resume)
+    done_ids = IntSet(journal.done_ids()) if resume else None
+    if resume:
+        print(f"Продолжение рассылки: уже обработано {len(done_ids)}")
+        logging.info(f"Продолжение рассылки: уже обработано {len(done_ids)}")
 
-        # Добавляем в список результатов
-        results.append({
-            "user_id": user_id,
-            "username": username,
-            "status": status
-        })
+    # Пользователи (user_id, username) читаются из источника по мере отправки, повторы отбрасываются
+    audience = open_audience(
+        file_path=CSV_FILE,
+        user_id_col=USER_ID_COLUMN or "user_id",
+        username_col="username",   # <-- Если у вас иная колонка с username, поменяйте здесь
+        skip=done_ids
+    )
+    report_file, report = open_report(journal, resume, report_path)
 
-    # Пишем отчет в новый CSV (не трогаем исходный файл)
-    output_file = "distribution_report.csv"
+    # Воркеры забирают пользователей из ограниченной очереди, скорость задает общий TokenBucket
+    queue = asyncio.Queue(maxsize=BROADCAST_WORKERS * 2)
+    stop = asyncio.Event()
+    workers = [asyncio.create_task(send_worker(queue, journal, report, stop)) for _ in range(BROADCAST_WORKERS)]
+    started = time.monotonic()
+    reporter = asyncio.create_task(report_progress(started, audience))
+    try:
+        async for batch in read_batches(audience):
+            if stop.is_set():
+                break
+            for item in batch:
+                await queue.put(item)
+        await queue.join()
+    finally:
+        for task in workers + [reporter]:
+            task.cancel()
+        report_file.close()
     try:
-        with open(output_file, mode="w", encoding="utf-8", newline="") as f:
-            fieldnames = ["user_id", "username", "status"]
-            writer = csv.DictWriter(f, fieldnames=fieldnames, delimiter=";")
-            writer.writeheader()
-            writer.writerows(results)
-        print(f"\nОтчет сформирован в файле: {output_file}")
-    except Exception as e:
-        logging.error(f"Ошибка при записи файла {output_file}: {e}")
-        print(f"Ошибка при записи файла {output_file}: {e}")
+        write_final_report(journal, report_path)
+    except OSError as e:
+        logging.error(f"Ошибка при записи файла {report_path}: {e}")
+        print(f"Ошибка при записи файла {report_path}: {e}")
+    finally:
+        journal.close()
+    elapsed = time.monotonic() - started
+    if stop.is_set():
+        print("Рассылка остановлена из-за ошибки в сообщении; после исправления продолжите ее с --resume")
+    print(f"\nОтчет сформирован в файле: {report_path}")
+    print(f"Аудитория: {audience.summary()}")
+    logging.info(f"Аудитория: {audience.summary()}")
 
     # Выводим итоговую статистику
     print(f"\nИтоговая статистика:")
     print(f"Успешных отправок: {success_count}")
     print(f"Неуспешных отправок: {failure_count}")
-    logging.info(f"Итоговая статистика: Успешных отправок - {success_count}, Неуспешных отправок - {failure_count}")
+    print(f"Время рассылки: {elapsed:.1f} с, {(success_count + failure_count) / elapsed if elapsed else 0:.1f} сообщ./с")
+    logging.info(f"Итоговая статистика: Успешных отправок - {success_count}, Неуспешных отправок - {failure_count}, время {elapsed:.1f} с")
     await bot.session.close()
+    if fake_server is not None:
+        await fake_server.cleanup()
+    return {"sent": success_count, "failed": failure_count, "elapsed": elapsed, "read": audience.read}
 
 if __name__ == "__main__":
     asyncio.run(main())
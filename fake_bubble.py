@@ -0,0 +1,195 @@
+import os
+import sys
+import json
+import time
+import random
+import logging
+import threading
+from collections import deque
+from urllib.parse import parse_qs
+from flask import Flask, Response, request, jsonify
+
+# Локальная замена Bubble Data API, workflow API и сервиса проверки чеков для нагрузочных тестов:
+#   python fake_bubble.py [порт]
+# BUBBLE_API_URL=http://127.0.0.1:<порт>/obj/, BUBBLE_WORKFLOW_API_URL=http://127.0.0.1:<порт>/wf/receipt,
+# CHECK_API_URL=http://127.0.0.1:<порт>/check
+# Задержка ответа (мс, среднее и разброс), доля ответов 500, предел запросов в секунду (сверх него - 429)
+# и доля строк spin/bulk, которые возвращаются с ошибкой
+FAKE_LATENCY_MS = float(os.getenv('FAKE_LATENCY_MS', '50'))
+FAKE_JITTER_MS = float(os.getenv('FAKE_JITTER_MS', '20'))
+FAKE_ERROR_RATE = float(os.getenv('FAKE_ERROR_RATE', '0'))
+FAKE_RATE_LIMIT = float(os.getenv('FAKE_RATE_LIMIT', '0'))
+FAKE_BULK_FAIL_RATE = float(os.getenv('FAKE_BULK_FAIL_RATE', '0'))
+# Задержка на каждую строку spin/bulk, мс: большие пакеты обрабатываются Bubble дольше
+FAKE_BULK_ROW_MS = float(os.getenv('FAKE_BULK_ROW_MS', '0.2'))
+
+app = Flask(__name__)
+
+config = {
+    'latency_ms': FAKE_LATENCY_MS,
+    'jitter_ms': FAKE_JITTER_MS,
+    'error_rate': FAKE_ERROR_RATE,
+    'rate_limit': FAKE_RATE_LIMIT,
+    'bulk_fail_rate': FAKE_BULK_FAIL_RATE,
+    'bulk_row_ms': FAKE_BULK_ROW_MS,
+}
+
+lock = threading.Lock()
+spins = {}
+spins_by_prize = {}
+prizes = {}
+workflow_calls = {}
+recent_requests = deque()
+counters = {'requests': 0, 'rate_limited': 0, 'errors': 0}
+
+
+def next_id():
+    return f"{int(time.time() * 1000)}x{random.getrandbits(60)}"
+
+
+# Задержка, ошибки и предел частоты, общие для всех маршрутов. Возвращает готовый ответ с ошибкой или None
+@app.before_request
+def simulate_conditions():
+    if request.path.startswith('/fake/'):
+        return None
+    now = time.monotonic()
+    with lock:
+        counters['requests'] += 1
+        if config['rate_limit'] > 0:
+            while recent_requests and recent_requests[0] < now - 1:
+                recent_requests.popleft()
+            if len(recent_requests) >= config['rate_limit']:
+                counters['rate_limited'] += 1
+                return Response('{"status": "error", "message": "Too many requests"}', status=429,
+                                headers={'Retry-After': '1'}, mimetype='application/json')
+            recent_requests.append(now)
+    delay = config['latency_ms'] + random.uniform(-1, 1) * config['jitter_ms']
+    time.sleep(max(delay, 0) / 1000)
+    if random.random() < config['error_rate']:
+        with lock:
+            counters['errors'] += 1
+        return Response('{"status": "error", "message": "Internal error"}', status=500, mimetype='application/json')
+    return None
+
+
+def create_spin(record):
+    spin_id = next_id()
+    prize_id = record.get('prize_id')
+    photo = record.get('photo')
+    if isinstance(photo, dict):
+        # Загруженный файл хранится как ссылка, содержимое не сохраняется
+        photo = f"//fake-bubble.local/{spin_id}/{photo.get('filename')}"
+    with lock:
+        spins[spin_id] = {'prize_id': prize_id, 'photo': photo, 'promocode': record.get('promocode')}
+        spins_by_prize[prize_id] = spins_by_prize.get(prize_id, 0) + 1
+    return spin_id
+
+
+@app.route('/obj/spin', methods=['POST'])
+def post_spin():
+    record = request.get_json(silent=True)
+    if not isinstance(record, dict):
+        return jsonify({'status': 'error', 'message': 'Invalid JSON'}), 400
+    return jsonify({'status': 'success', 'id': create_spin(record)})
+
+
+@app.route('/obj/spin/bulk', methods=['POST'])
+def post_spin_bulk():
+    lines = request.get_data(as_text=True).splitlines()
+    time.sleep(len(lines) * config['bulk_row_ms'] / 1000)
+    results = []
+    for line in lines:
+        try:
+            record = json.loads(line)
+        except ValueError:
+            results.append({'status': 'error', 'message': 'Invalid JSON'})
+            continue
+        if random.random() < config['bulk_fail_rate']:
+            results.append({'status': 'error', 'message': 'Simulated row failure'})
+        else:
+            results.append({'status': 'success', 'id': create_spin(record)})
+    return Response('\n'.join(json.dumps(result) for result in results), mimetype='text/plain')
+
+
+@app.route('/obj/spin', methods=['GET'])
+def list_spins():
+    # Поддерживается только ограничение prize_id equals: нужно для сверки количества спинов приза
+    constraints = json.loads(request.args.get('constraints', '[]'))
+    prize_id = next((c.get('value') for c in constraints if c.get('key') == 'prize_id'), None)
+    limit = int(request.args.get('limit', 100))
+    with lock:
+        total = spins_by_prize.get(prize_id, 0) if prize_id is not None else len(spins)
+    count = min(limit, total)
+    return jsonify({'response': {'cursor': 0, 'results': [], 'count': count, 'remaining': total - count}})
+
+
+@app.route('/obj/spin/<spin_id>', methods=['GET'])
+def get_spin(spin_id):
+    with lock:
+        spin = spins.get(spin_id)
+    if spin is None:
+        return jsonify({'status': 'error', 'message': 'Not found'}), 404
+    return jsonify({'response': {'_id': spin_id, **spin}})
+
+
+@app.route('/obj/prize/<prize_id>', methods=['PATCH'])
+def patch_prize(prize_id):
+    with lock:
+        prizes.setdefault(prize_id, {}).update(request.get_json(silent=True) or {})
+    return Response(status=204)
+
+
+@app.route('/wf/<name>', methods=['POST'])
+def workflow(name):
+    with lock:
+        workflow_calls[name] = workflow_calls.get(name, 0) + 1
+    return jsonify({'status': 'success', 'response': {}})
+
+
+# Сервис проверки чеков: для строки QR-кода возвращает успешный ответ с реквизитами из нее
+@app.route('/check', methods=['POST'])
+def check_receipt():
+    qr_raw = request.form.get('qrraw')
+    if not qr_raw:
+        return jsonify({'code': 3, 'data': 'Чек не найден'})
+    params = {key: values[0] for key, values in parse_qs(qr_raw).items()}
+    check_time = params.get('t', '20240101T1200')
+    return jsonify({'code': 1, 'data': {'json': {
+        'fiscalDriveNumber': params.get('fn'),
+        'fiscalDocumentNumber': int(params.get('i', 0)),
+        'fiscalSign': int(params.get('fp', 0)),
+        'dateTime': f"{check_time[:4]}-{check_time[4:6]}-{check_time[6:8]}T{check_time[9:11]}:{check_time[11:13]}:00",
+        'operationType': int(params.get('n', 1)),
+        'totalSum': int(round(float(params.get('s', 0)) * 100)),
+        'retailPlaceAddress': '111024, г.Москва, ш. Энтузиастов, д.12, к.2',
+        'user': 'ООО "ТЕСТ"',
+        'userInn': '7700000000',
+    }}})
+
+
+# Служебные маршруты: состояние и смена параметров без перезапуска
+@app.route('/fake/stats', methods=['GET'])
+def fake_stats():
+    with lock:
+        return jsonify({**counters, 'spins': len(spins), 'spins_by_prize': spins_by_prize,
+                        'prizes': prizes, 'workflow_calls': workflow_calls, 'config': config})
+
+
+@app.route('/fake/config', methods=['POST'])
+def fake_config():
+    with lock:
+        config.update({key: float(value) for key, value in (request.get_json(silent=True) or {}).items() if key in config})
+        return jsonify(config)
+
+
+# Запуск в фоновом потоке (для бенчмарков); возвращает сервер, адрес - server.server_port
+def serve_in_thread(port=0):
+    from werkzeug.serving import make_server
+    logging.getLogger('werkzeug').setLevel(logging.WARNING)
+    server = make_server('127.0.0.1', port, app, threaded=True)
+    threading.Thread(target=server.serve_forever, name='fake-bubble', daemon=True).start()
+    return server
+
+
+if __name__ == '__main__':
+    app.run(host='127.0.0.1', port=int(sys.argv[1]) if len(sys.argv) > 1 else 8090, threaded=True)
@@ -0,0 +1,113 @@
+import os
+import sys
+import time
+import random
+import asyncio
+import logging
+from collections import deque
+from aiohttp import web
+
+# Локальная замена Telegram Bot API для пробной рассылки (python distrib.py --dry-run) и bench_broadcast.py:
+#   python fake_telegram.py [порт]
+# Задержка ответа (мс, среднее и разброс), предел сообщений в секунду (сверх него - 429 с retry_after),
+# доли пользователей, заблокировавших бота (403) и с несуществующим чатом (400)
+FAKE_TG_LATENCY_MS = float(os.getenv('FAKE_TG_LATENCY_MS', '80'))
+FAKE_TG_JITTER_MS = float(os.getenv('FAKE_TG_JITTER_MS', '40'))
+FAKE_TG_RATE_LIMIT = float(os.getenv('FAKE_TG_RATE_LIMIT', '30'))
+FAKE_TG_RETRY_AFTER = int(os.getenv('FAKE_TG_RETRY_AFTER', '1'))
+FAKE_TG_BLOCKED_RATE = float(os.getenv('FAKE_TG_BLOCKED_RATE', '0.05'))
+FAKE_TG_NOT_FOUND_RATE = float(os.getenv('FAKE_TG_NOT_FOUND_RATE', '0.01'))
+
+config = {
+    'latency_ms': FAKE_TG_LATENCY_MS,
+    'jitter_ms': FAKE_TG_JITTER_MS,
+    'rate_limit': FAKE_TG_RATE_LIMIT,
+    'retry_after': FAKE_TG_RETRY_AFTER,
+    'blocked_rate': FAKE_TG_BLOCKED_RATE,
+    'not_found_rate': FAKE_TG_NOT_FOUND_RATE,
+}
+
+recent_requests = deque()
+counters = {'requests': 0, 'sent': 0, 'rate_limited': 0, 'blocked': 0, 'not_found': 0}
+
+
+def error_response(code, description, **parameters):
+    body = {'ok': False, 'error_code': code, 'description': description}
+    if parameters:
+        body['parameters'] = parameters
+    return web.json_response(body, status=code)
+
+
+def chat_state(chat_id):
+    # Состояние чата зависит только от его id: при повторной рассылке те же пользователи остаются заблокированными
+    value = random.Random(chat_id).random()
+    if value < config['blocked_rate']:
+        return 'blocked'
+    if value < config['blocked_rate'] + config['not_found_rate']:
+        return 'not_found'
+    return 'ok'
+
+
+async def bot_method(request):
+    counters['requests'] += 1
+    if config['rate_limit'] > 0:
+        now = time.monotonic()
+        while recent_requests and recent_requests[0] < now - 1:
+            recent_requests.popleft()
+        if len(recent_requests) >= config['rate_limit']:
+            counters['rate_limited'] += 1
+            return error_response(429, f"Too Many Requests: retry after {config['retry_after']}",
+                                  retry_after=config['retry_after'])
+        recent_requests.append(now)
+
+    delay = config['latency_ms'] + random.uniform(-1, 1) * config['jitter_ms']
+    await asyncio.sleep(max(delay, 0) / 1000)
+
+    method = request.match_info['method']
+    if method == 'getMe':
+        return web.json_response({'ok': True, 'result': {
+            'id': 1, 'is_bot': True, 'first_name': 'Fake', 'username': 'fake_bot'
+        }})
+    if method != 'sendMessage':
+        return web.json_response({'ok': True, 'result': True})
+
+    data = await request.post()
+    chat_id = int(data.get('chat_id', 0))
+    state = chat_state(chat_id)
+    if state == 'blocked':
+        counters['blocked'] += 1
+        return error_response(403, 'Forbidden: bot was blocked by the user')
+    if state == 'not_found':
+        counters['not_found'] += 1
+        return error_response(400, 'Bad Request: chat not found')
+    counters['sent'] += 1
+    return web.json_response({'ok': True, 'result': {
+        'message_id': counters['sent'], 'date': int(time.time()),
+        'chat': {'id': chat_id, 'type': 'private'}, 'text': data.get('text', '')
+    }})
+
+
+async def fake_stats(request):
+    return web.json_response({**counters, 'config': config})
+
+
+def create_app():
+    app = web.Application()
+    app.router.add_get('/fake/stats', fake_stats)
+    app.router.add_route('*', '/bot{token}/{method}', bot_method)
+    return app
+
+
+# Запуск в текущем цикле событий; возвращает runner (для остановки) и адрес сервера
+async def start_server(port=0):
+    runner = web.AppRunner(create_app(), access_log=None)
+    await runner.setup()
+    site = web.TCPSite(runner, '127.0.0.1', port)
+    await site.start()
+    port = runner.addresses[0][1]
+    logging.info(f"Замена Bot API запущена на порту {port}, параметры: {config}")
+    return runner, f'http://127.0.0.1:{port}'
+
+
+if __name__ == '__main__':
+    web.run_app(create_app(), host='127.0.0.1', port=int(sys.argv[1]) if len(sys.argv) > 1 else 8081)
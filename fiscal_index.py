@@ -0,0 +1,114 @@
+import os
+import sys
+import csv
+import json
+import struct
+import logging
+import threading
+from urllib.parse import parse_qs
+
+# Запись индекса: ФН (до 16 цифр) - 8 байт, ФД и ФП (32-битные числа) - по 4 байта
+RECORD = struct.Struct('<QII')
+
+
+# Ключ чека из номеров ФН, ФД, ФП; None, если значения не числовые или не помещаются в запись
+def fiscal_key(fn, fd, fp):
+    try:
+        return RECORD.pack(int(fn), int(fd), int(fp))
+    except (TypeError, ValueError, struct.error):
+        return None
+
+
+# Ключ чека из строки QR-кода вида t=...&s=...&fn=...&i=...&fp=...&n=...
+def fiscal_key_from_qr(qr_data):
+    params = parse_qs(qr_data or '')
+    return fiscal_key(
+        params.get('fn', [None])[0],
+        params.get('i', [None])[0],
+        params.get('fp', [None])[0]
+    )
+
+
+class FiscalIndex:
+    """
+    Индекс уже проверенных чеков по (ФН, ФД, ФП). В памяти - множество 16-байтных ключей
+    (проверка за O(1)), на диске - файл из тех же записей подряд, новые ключи дописываются в конец.
+    """
+
+    def __init__(self, path):
+        self.path = path
+        self.keys = set()
+        self.lock = threading.Lock()
+        self.duplicates = 0
+        if os.path.exists(path):
+            with open(path, 'rb') as index_file:
+                data = index_file.read()
+            usable = len(data) - len(data) % RECORD.size
+            self.keys.update(data[i:i + RECORD.size] for i in range(0, usable, RECORD.size))
+            logging.info(f"Индекс чеков загружен из {path}: {len(self.keys)} записей")
+
+    def __len__(self):
+        return len(self.keys)
+
+    def contains(self, key):
+        if key is None:
+            return False
+        with self.lock:
+            if key in self.keys:
+                self.duplicates += 1
+                return True
+            return False
+
+    def add(self, key):
+        # Возвращает True, если ключ новый и записан в индекс
+        if key is None:
+            return False
+        with self.lock:
+            if key in self.keys:
+                return False
+            self.keys.add(key)
+            with open(self.path, 'ab') as index_file:
+                index_file.write(key)
+            return True
+
+    def add_many(self, keys):
+        new_keys = []
+        with self.lock:
+            for key in keys:
+                if key is not None and key not in self.keys:
+                    self.keys.add(key)
+                    new_keys.append(key)
+            with open(self.path, 'ab') as index_file:
+                index_file.write(b''.join(new_keys))
+        return len(new_keys)
+
+    def stats(self):
+        with self.lock:
+            return {'size': len(self.keys), 'duplicates': self.duplicates}
+
+
+# Ключи из выгрузки прошлой акции: CSV с колонками fn, fd, fp или JSON Lines ответов сервиса проверки
+def read_export(file_path, delimiter=','):
+    if file_path.endswith(('.jsonl', '.ndjson')):
+        with open(file_path, encoding='utf-8') as export_file:
+            for line in export_file:
+                try:
+                    record = json.loads(line)
+                except ValueError:
+                    continue
+                data = record.get('data', {}).get('json', record)
+                yield fiscal_key(data.get('fiscalDriveNumber'), data.get('fiscalDocumentNumber'), data.get('fiscalSign'))
+    else:
+        with open(file_path, newline='', encoding='utf-8') as export_file:
+            for row in csv.DictReader(export_file, delimiter=delimiter):
+                yield fiscal_key(row.get('fn'), row.get('fd'), row.get('fp'))
+
+
+if __name__ == '__main__':
+    # Предзагрузка индекса: python fiscal_index.py <индекс> <выгрузка.csv|.jsonl> [разделитель CSV]
+    if len(sys.argv) < 3:
+        print("Использование: python fiscal_index.py <файл индекса> <выгрузка.csv|.jsonl> [разделитель]")
+        sys.exit(1)
+    index = FiscalIndex(sys.argv[1])
+    added = index.add_many(read_export(sys.argv[2], sys.argv[3] if len(sys.argv) > 3 else ','))
+    print(f"Добавлено записей: {added}, всего в индексе: {len(index)}")
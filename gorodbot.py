@@ -5,14 +5,29 @@ from aiogram.types import InlineKeyboardButton, InlineKeyboardMarkup
 from aiogram import F
 from aiogram.filters import Command
 from aiogram import Router
+from aiogram.webhook.aiohttp_server import SimpleRequestHandler, setup_application
+from aiohttp import web
 from dotenv import load_dotenv
 import asyncio
+import multiprocessing
 
 load_dotenv()
 
 API_TOKEN = os.getenv('BOT_TOKEN')
 GAME_URL = os.getenv('GAME_URL')
 support_email = os.getenv('SUPPORT_EMAIL')
+# Режим получения обновлений: polling (по умолчанию, для локальной разработки) или webhook
+BOT_MODE = os.getenv('BOT_MODE', 'polling')
+# Публичный адрес вебхука (https://домен/путь), секрет для заголовка X-Telegram-Bot-Api-Secret-Token,
+# адрес и порт, на которых слушают процессы-воркеры, и их число
+WEBHOOK_URL = os.getenv('WEBHOOK_URL')
+WEBHOOK_PATH = os.getenv('WEBHOOK_PATH', '/webhook')
+WEBHOOK_SECRET = os.getenv('WEBHOOK_SECRET')
+WEBHOOK_HOST = os.getenv('WEBHOOK_HOST', '0.0.0.0')
+WEBHOOK_PORT = int(os.getenv('WEBHOOK_PORT', '8080'))
+WEBHOOK_WORKERS = int(os.getenv('WEBHOOK_WORKERS', '4'))
+# Сколько одновременных соединений Telegram открывает к вебхуку (1-100)
+WEBHOOK_MAX_CONNECTIONS = int(os.getenv('WEBHOOK_MAX_CONNECTIONS', '100'))
 
 # Configure logging
 logging.basicConfig(level=logging.INFO)
@@ -28,13 +43,16 @@ dp.include_router(router)
 keyboard = InlineKeyboardMarkup(inline_keyboard=[
     [InlineKeyboardButton(text="Вход в мини-приложение", url=GAME_URL)]
 ])
+# Обработчики возвращают метод ответа, а не вызывают его: в режиме webhook ответ уходит
+# в теле ответа на запрос Telegram без отдельного запроса к Bot API, в режиме polling его выполняет диспетчер
+
 # Command handler for /start
 @router.message(Command(commands=['start']))
 
 
 async def send_welcome(message: types.Message):
     # Create inline button for entering the miniapp
-    await message.answer("Добро пожаловать в бот Города Лефортово!\n\nВы можете ознакомиться с правилами или войти в мини-приложение.", reply_markup=keyboard)
+    return message.answer("Добро пожаловать в бот Города Лефортово!\n\nВы можете ознакомиться с правилами или войти в мини-приложение.", reply_markup=keyboard)
 
 # Command handler for /rules
 @router.message(Command(commands=['rules']))
@@ -61,7 +79,7 @@ async def rules(message: types.Message):
         "Полные правила акции в мини-приложении."
     )
     
-    await message.answer(text, reply_markup=keyboard, disable_web_page_preview=True)
+    return message.answer(text, reply_markup=keyboard, disable_web_page_preview=True)
 
 # Command handler for /help
 @router.message(Command(commands=['help']))
@@ -71,11 +89,59 @@ async def help_command(message: types.Message):
         "вы можете обратиться в нашу службу поддержки по электронной почте: "
         f"{support_email}"
     )
-    await message.answer(text)
+    return message.answer(text)
 
 # Main function to start polling
 async def main():
+    # Активный вебхук мешает getUpdates: снимаем его, накопленные обновления сохраняются
+    await bot.delete_webhook(drop_pending_updates=False)
     await dp.start_polling(bot)
 
+async def set_webhook():
+    await bot.set_webhook(
+        url=WEBHOOK_URL,
+        secret_token=WEBHOOK_SECRET,
+        max_connections=WEBHOOK_MAX_CONNECTIONS,
+        allowed_updates=dp.resolve_used_update_types()
+    )
+    logging.info(f"Вебхук установлен: {WEBHOOK_URL}, воркеров {WEBHOOK_WORKERS}")
+    # Сессию закрываем до запуска воркеров: каждый процесс открывает свою
+    await bot.session.close()
+
+def run_webhook_worker():
+    """
+    Процесс-воркер вебхука. Все воркеры слушают один порт (SO_REUSEPORT), ядро распределяет
+    между ними входящие соединения. Запросы без верного секрета отклоняются с кодом 401.
+    Обновление обрабатывается до ответа Telegram, ответ бота передается в теле ответа.
+    """
+    app = web.Application()
+    SimpleRequestHandler(
+        dispatcher=dp, bot=bot, secret_token=WEBHOOK_SECRET, handle_in_background=False
+    ).register(app, path=WEBHOOK_PATH)
+    setup_application(app, dp, bot=bot)
+    web.run_app(app, host=WEBHOOK_HOST, port=WEBHOOK_PORT, reuse_port=True, access_log=None, print=None)
+
+def run_webhook():
+    if not WEBHOOK_URL or not WEBHOOK_SECRET:
+        logging.error("Для режима webhook нужны WEBHOOK_URL и WEBHOOK_SECRET")
+        return
+    asyncio.run(set_webhook())
+    workers = [
+        multiprocessing.Process(target=run_webhook_worker, name=f'webhook-{i}')
+        for i in range(WEBHOOK_WORKERS)
+    ]
+    for worker in workers:
+        worker.start()
+    logging.info(f"Вебхук слушает {WEBHOOK_HOST}:{WEBHOOK_PORT}{WEBHOOK_PATH}")
+    try:
+        for worker in workers:
+            worker.join()
+    except KeyboardInterrupt:
+        for worker in workers:
+            worker.join()
+
 if __name__ == '__main__':
-    asyncio.run(main())
+    if BOT_MODE == 'webhook':
+        run_webhook()
+    else:
+        asyncio.run(main())
@@ -0,0 +1,183 @@
+import time
+import random
+import logging
+import threading
+import requests
+from requests.adapters import HTTPAdapter
+
+from metrics import UPSTREAM_SECONDS, UPSTREAM_RESPONSES
+
+# Коды ответа, при которых запрос повторяется
+RETRY_STATUSES = {429, 500, 502, 503, 504}
+# Методы, которые можно повторить после ответа 5xx или обрыва соединения: сервис мог уже выполнить
+# запрос, и для POST/PATCH (платная проверка чека, workflow Bubble) повтор означал бы второе выполнение
+IDEMPOTENT_METHODS = {'GET', 'HEAD', 'OPTIONS', 'PUT', 'DELETE'}
+
+
+class CircuitOpenError(requests.exceptions.RequestException):
+    """Запрос не отправлен: сервис помечен недоступным после серии ошибок до retry_at (time.time())."""
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+class Upstream:
+    """
+    HTTP-клиент одного внешнего сервиса: своя сессия с keep-alive пулом соединений,
+    таймауты соединения и чтения, повторы при 429/5xx и ошибках соединения с экспоненциальной
+    задержкой и разбросом, предохранитель (circuit breaker). Неидемпотентные запросы (POST, PATCH)
+    повторяются только тогда, когда сервис их точно не получил или не выполнил: 429 и таймаут
+    соединения; idempotent=True в вызове разрешает им все повторы. После breaker_threshold подряд
+    неудачных вызовов запросы breaker_reset секунд отклоняются сразу с CircuitOpenError,
+    затем пропускается один пробный запрос. Ведутся счетчики задержек и ошибок.
+    """
+
+    def __init__(self, name, connect_timeout=5, read_timeout=30, retries=3, backoff_base=0.5,
+                 backoff_max=10, breaker_threshold=5, breaker_reset=30, pool_size=10):
+        self.name = name
+        self.timeout = (connect_timeout, read_timeout)
+        self.retries = retries
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.breaker_threshold = breaker_threshold
+        self.breaker_reset = breaker_reset
+
+        self.session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=pool_size)
+        self.session.mount('https://', adapter)
+        self.session.mount('http://', adapter)
+
+        self.lock = threading.Lock()
+        self.consecutive_failures = 0
+        self.open_until = 0.0
+        self.half_open_trial = False
+        self.counters = {
+            'requests': 0, 'errors': 0, 'retries': 0, 'rejected': 0,
+            'latency_sum': 0.0, 'latency_max': 0.0, 'statuses': {}
+        }
+
+    def _allow(self):
+        with self.lock:
+            if self.consecutive_failures < self.breaker_threshold:
+                return True
+            if time.time() < self.open_until or self.half_open_trial:
+                self.counters['rejected'] += 1
+                return False
+            # Время блокировки вышло: пропускаем один пробный запрос
+            self.half_open_trial = True
+            return True
+
+    def _record(self, latency, status=None, failed=False):
+        with self.lock:
+            self.counters['requests'] += 1
+            self.counters['latency_sum'] += latency
+            self.counters['latency_max'] = max(self.counters['latency_max'], latency)
+            if status is not None:
+                self.counters['statuses'][status] = self.counters['statuses'].get(status, 0) + 1
+            if failed:
+                self.counters['errors'] += 1
+        UPSTREAM_SECONDS.observe(latency, self.name)
+        UPSTREAM_RESPONSES.inc(self.name, status if status is not None else 'error')
+
+    def _finish(self, failed):
+        with self.lock:
+            self.half_open_trial = False
+            if not failed:
+                self.consecutive_failures = 0
+                return
+            self.consecutive_failures += 1
+            if self.consecutive_failures >= self.breaker_threshold:
+                self.open_until = time.time() + self.breaker_reset
+                logging.error(f"Сервис {self.name} недоступен: {self.consecutive_failures} ошибок подряд, запросы отклоняются {self.breaker_reset} с")
+
+    def _delay(self, attempt, response=None):
+        retry_after = response.headers.get('Retry-After') if response is not None else None
+        if retry_after and retry_after.isdigit():
+            return min(float(retry_after), self.backoff_max)
+        return min(self.backoff_base * 2 ** attempt, self.backoff_max) * random.uniform(0.5, 1.0)
+
+    def request(self, method, url, idempotent=None, **kwargs):
+        if idempotent is None:
+            idempotent = method.upper() in IDEMPOTENT_METHODS
+        if not self._allow():
+            # Пока идет пробный запрос, open_until уже в прошлом: повтор не раньше чем через секунду
+            raise CircuitOpenError(f"Сервис {self.name} временно недоступен",
+                                   retry_at=max(self.open_until, time.time() + 1))
+        kwargs.setdefault('timeout', self.timeout)
+        attempt = 0
+        while True:
+            response = None
+            started = time.perf_counter()
+            try:
+                response = self.session.request(method, url, **kwargs)
+            except requests.exceptions.ConnectionError as e:
+                self._record(time.perf_counter() - started, failed=True)
+                if attempt >= self.retries or not (idempotent or isinstance(e, requests.exceptions.ConnectTimeout)):
+                    self._finish(failed=True)
+                    raise
+                logging.warning(f"{self.name}: ошибка соединения ({e}), повтор {attempt + 1}/{self.retries}")
+            except requests.exceptions.RequestException:
+                self._record(time.perf_counter() - started, failed=True)
+                self._finish(failed=True)
+                raise
+            else:
+                failed = response.status_code in RETRY_STATUSES
+                self._record(time.perf_counter() - started, response.status_code, failed)
+                retryable = failed and (idempotent or response.status_code == 429)
+                if not retryable or attempt >= self.retries:
+                    self._finish(failed)
+                    return response
+                logging.warning(f"{self.name}: ответ {response.status_code}, повтор {attempt + 1}/{self.retries}")
+            with self.lock:
+                self.counters['retries'] += 1
+            time.sleep(self._delay(attempt, response))
+            attempt += 1
+
+    def get(self, url, **kwargs):
+        return self.request('GET', url, **kwargs)
+
+    def post(self, url, **kwargs):
+        return self.request('POST', url, **kwargs)
+
+    def patch(self, url, **kwargs):
+        return self.request('PATCH', url, **kwargs)
+
+    def stats(self):
+        with self.lock:
+            counters = dict(self.counters, statuses=dict(self.counters['statuses']))
+            requests_count = counters['requests']
+            counters['latency_avg'] = round(counters['latency_sum'] / requests_count, 4) if requests_count else 0
+            counters['circuit_open'] = (
+                self.consecutive_failures >= self.breaker_threshold and time.time() < self.open_until
+            )
+            counters['consecutive_failures'] = self.consecutive_failures
+            return counters
+
+
+class RateLimiter:
+    """
+    Ограничение частоты запросов (token bucket), общее для всех потоков: не больше rate запросов
+    в секунду в среднем и не больше burst подряд. acquire() ждет, пока появится свободный токен.
+    """
+
+    def __init__(self, rate, burst=1):
+        self.rate = rate
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+        self.lock = threading.Lock()
+
+    def acquire(self):
+        if self.rate <= 0:
+            return
+        while True:
+            with self.lock:
+                now = time.monotonic()
+                self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+                self.updated = now
+                if self.tokens >= 1:
+                    self.tokens -= 1
+                    return
+                wait = (1 - self.tokens) / self.rate
+            time.sleep(wait)
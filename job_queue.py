@@ -0,0 +1,265 @@
+import os
+import json
+import time
+import random
+import sqlite3
+import logging
+import threading
+
+
+class RetryLater(Exception):
+    """
+    Обработчик не может выполнить задачу до момента retry_at (time.time()), например пока внешний
+    сервис помечен недоступным. Задача откладывается без траты попытки.
+    """
+
+    def __init__(self, message, retry_at):
+        super().__init__(message)
+        self.retry_at = retry_at
+
+
+def process_alive(pid):
+    try:
+        os.kill(pid, 0)
+    except ProcessLookupError:
+        return False
+    except PermissionError:
+        # Процесс есть, но принадлежит другому пользователю
+        return True
+    return True
+
+
+class DurableQueue:
+    """
+    Персистентная очередь задач на SQLite (WAL) с фиксированным пулом потоков-воркеров.
+    Задача сохраняется на диск до ответа клиенту, поэтому перезапуск сервиса ее не теряет:
+    при старте задачи, которые были в работе, возвращаются в очередь. Ошибка обработчика
+    приводит к повтору с экспоненциальной задержкой и случайным разбросом, после max_attempts
+    задача помечается как failed и остается в базе для разбора.
+    Файл базы могут использовать несколько процессов одного сервера (воркеры gunicorn): задача
+    захватывается атомарно и помечается pid процесса, а при старте в очередь возвращаются только
+    задачи, процессы-владельцы которых уже завершились.
+    """
+
+    def __init__(self, path, handler, workers=4, max_pending=10000, max_attempts=5,
+                 backoff_base=2.0, backoff_max=300.0, keep_done=86400, name='jobs'):
+        self.path = path
+        self.handler = handler
+        self.workers = workers
+        self.max_pending = max_pending
+        self.max_attempts = max_attempts
+        self.backoff_base = backoff_base
+        self.backoff_max = backoff_max
+        self.keep_done = keep_done
+        self.name = name
+        self.lock = threading.Lock()
+        self.wakeup = threading.Condition(self.lock)
+        self.threads = []
+        self.processed = 0
+        self.retried = 0
+        self.failed = 0
+        self.postponed = 0
+
+        self.conn = sqlite3.connect(path, check_same_thread=False, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS jobs (
+                id TEXT PRIMARY KEY,
+                status TEXT NOT NULL,
+                payload TEXT NOT NULL,
+                blob BLOB,
+                attempts INTEGER NOT NULL DEFAULT 0,
+                run_at REAL NOT NULL,
+                created REAL NOT NULL,
+                updated REAL NOT NULL,
+                error TEXT,
+                owner INTEGER
+            )
+        """)
+        columns = [row[1] for row in self.conn.execute('PRAGMA table_info(jobs)')]
+        if 'owner' not in columns:
+            # База, созданная до появления владельца задачи
+            self.conn.execute('ALTER TABLE jobs ADD COLUMN owner INTEGER')
+        self.conn.execute('CREATE INDEX IF NOT EXISTS jobs_status_run_at ON jobs (status, run_at)')
+
+        now = time.time()
+        recovered = 0
+        owners = [row[0] for row in self.conn.execute("SELECT DISTINCT owner FROM jobs WHERE status = 'running'")]
+        for owner in owners:
+            # Задачи работающих процессов не трогаются: их выполняют воркеры этих процессов
+            if owner is not None and owner != os.getpid() and process_alive(owner):
+                continue
+            recovered += self.conn.execute(
+                "UPDATE jobs SET status = 'queued', run_at = ?, updated = ? WHERE status = 'running' AND owner IS ?",
+                (now, now, owner)
+            ).rowcount
+        pruned = self.conn.execute(
+            "DELETE FROM jobs WHERE status = 'done' AND updated < ?", (now - self.keep_done,)
+        ).rowcount
+        self.pruned_at = now
+        pending = self.conn.execute("SELECT COUNT(*) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        logging.info(f"Очередь {self.name} ({self.path}): в очереди {pending}, возвращено после сбоя {recovered}, удалено старых {pruned}")
+
+    def start(self):
+        with self.lock:
+            if self.threads:
+                return
+            for i in range(self.workers):
+                thread = threading.Thread(target=self._worker, name=f'{self.name}-{i}', daemon=True)
+                thread.start()
+                self.threads.append(thread)
+
+    def put(self, payload, blob=None, job_id=None):
+        """
+        Ставит задачу в очередь и возвращает ее id. Если задача с таким job_id уже есть в очереди,
+        в работе или выполнена (в течение keep_done), возвращает существующий id без повторной
+        постановки; задача в статусе failed ставится заново с обнуленными попытками.
+        None - очередь заполнена.
+        """
+        now = time.time()
+        job_id = job_id or f"{now:.6f}-{random.getrandbits(32):08x}"
+        with self.wakeup:
+            self._prune(now)
+            existing = self.conn.execute('SELECT status FROM jobs WHERE id = ?', (job_id,)).fetchone()
+            if existing and existing[0] != 'failed':
+                return job_id
+            pending = self.conn.execute(
+                "SELECT COUNT(*) FROM jobs WHERE status IN ('queued', 'running')"
+            ).fetchone()[0]
+            if pending >= self.max_pending:
+                return None
+            if existing:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'queued', payload = ?, blob = ?, attempts = 0, run_at = ?, created = ?, "
+                    "updated = ?, error = NULL WHERE id = ?",
+                    (json.dumps(payload, ensure_ascii=False), blob, now, now, now, job_id)
+                )
+                logging.info(f"Задача {job_id} очереди {self.name} после неудачи поставлена заново")
+            else:
+                self.conn.execute(
+                    "INSERT INTO jobs (id, status, payload, blob, run_at, created, updated) VALUES (?, 'queued', ?, ?, ?, ?, ?)",
+                    (job_id, json.dumps(payload, ensure_ascii=False), blob, now, now, now)
+                )
+            self.wakeup.notify()
+        return job_id
+
+    def _prune(self, now):
+        # Выполненные задачи старше keep_done удаляются не чаще раза в минуту (вызывается под блокировкой)
+        if now - self.pruned_at < 60:
+            return
+        self.pruned_at = now
+        self.conn.execute("DELETE FROM jobs WHERE status = 'done' AND updated < ?", (now - self.keep_done,))
+
+    def get(self, job_id):
+        with self.lock:
+            row = self.conn.execute(
+                'SELECT status, payload, attempts, created, updated, error FROM jobs WHERE id = ?', (job_id,)
+            ).fetchone()
+        if row is None:
+            return None
+        status, payload, attempts, created, updated, error = row
+        return {'id': job_id, 'status': status, 'payload': json.loads(payload), 'attempts': attempts,
+                'created': created, 'updated': updated, 'error': error}
+
+    def update_payload(self, job_id, payload):
+        # Обработчик может сохранять прогресс задачи в ее payload
+        with self.lock:
+            self.conn.execute(
+                'UPDATE jobs SET payload = ?, updated = ? WHERE id = ?',
+                (json.dumps(payload, ensure_ascii=False), time.time(), job_id)
+            )
+
+    def stats(self):
+        with self.lock:
+            counts = dict(self.conn.execute('SELECT status, COUNT(*) FROM jobs GROUP BY status').fetchall())
+            oldest = self.conn.execute("SELECT MIN(created) FROM jobs WHERE status = 'queued'").fetchone()[0]
+            return {
+                'queued': counts.get('queued', 0),
+                'running': counts.get('running', 0),
+                'done': counts.get('done', 0),
+                'failed': counts.get('failed', 0),
+                'workers': self.workers,
+                'max_pending': self.max_pending,
+                'oldest_queued_age': round(time.time() - oldest, 1) if oldest else 0,
+                'processed_total': self.processed,
+                'retried_total': self.retried,
+                'failed_total': self.failed,
+                'postponed_total': self.postponed,
+            }
+
+    def _claim(self):
+        now = time.time()
+        while True:
+            row = self.conn.execute(
+                "SELECT id, payload, blob, attempts FROM jobs WHERE status = 'queued' AND run_at <= ? ORDER BY run_at LIMIT 1",
+                (now,)
+            ).fetchone()
+            if row is None:
+                return None
+            # Задачу мог раньше захватить другой процесс: тогда берется следующая
+            claimed = self.conn.execute(
+                "UPDATE jobs SET status = 'running', owner = ?, updated = ? WHERE id = ? AND status = 'queued'",
+                (os.getpid(), now, row[0])
+            ).rowcount
+            if claimed:
+                return row
+
+    def _idle_timeout(self):
+        next_run = self.conn.execute("SELECT MIN(run_at) FROM jobs WHERE status = 'queued'").fetchone()[0]
+        if next_run is None:
+            return 5.0
+        return min(max(next_run - time.time(), 0.05), 5.0)
+
+    def _worker(self):
+        while True:
+            with self.wakeup:
+                job = self._claim()
+                while job is None:
+                    self.wakeup.wait(timeout=self._idle_timeout())
+                    job = self._claim()
+            job_id, payload, blob, attempts = job
+            try:
+                self.handler(job_id, json.loads(payload), blob)
+            except RetryLater as e:
+                self._postpone(job_id, e)
+            except Exception as e:
+                self._fail(job_id, attempts + 1, e)
+            else:
+                with self.lock:
+                    self.conn.execute(
+                        "UPDATE jobs SET status = 'done', blob = NULL, attempts = ?, updated = ?, error = NULL WHERE id = ?",
+                        (attempts + 1, time.time(), job_id)
+                    )
+                    self.processed += 1
+
+    def _postpone(self, job_id, error):
+        now = time.time()
+        # Разброс, чтобы отложенные задачи не пришли к сервису одновременно
+        run_at = max(error.retry_at, now) + random.uniform(0, 5)
+        with self.lock:
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued', run_at = ?, updated = ?, error = ? WHERE id = ?",
+                (run_at, now, str(error), job_id)
+            )
+            self.postponed += 1
+        logging.info(f"Задача {job_id} очереди {self.name} отложена на {run_at - now:.1f} с: {error}")
+
+    def _fail(self, job_id, attempts, error):
+        now = time.time()
+        with self.lock:
+            if attempts >= self.max_attempts:
+                self.conn.execute(
+                    "UPDATE jobs SET status = 'failed', attempts = ?, updated = ?, error = ? WHERE id = ?",
+                    (attempts, now, str(error), job_id)
+                )
+                self.failed += 1
+                logging.error(f"Задача {job_id} очереди {self.name} не выполнена после {attempts} попыток: {error}")
+                return
+            delay = min(self.backoff_base ** attempts, self.backoff_max) * random.uniform(0.5, 1.0)
+            self.conn.execute(
+                "UPDATE jobs SET status = 'queued', attempts = ?, run_at = ?, updated = ?, error = ? WHERE id = ?",
+                (attempts, now + delay, now, str(error), job_id)
+            )
+            self.retried += 1
+        logging.warning(f"Задача {job_id} очереди {self.name}: попытка {attempts} неудачна ({error}), повтор через {delay:.1f} с")
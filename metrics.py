@@ -0,0 +1,164 @@
+import time
+import threading
+from bisect import bisect_left
+from flask import Response, request, g
+
+# Метрики сервисов в текстовом формате Prometheus (GET /metrics).
+# Запись значения - одно обращение к словарю под блокировкой метрики, текст собирается только при чтении
+
+CONTENT_TYPE = 'text/plain; version=0.0.4; charset=utf-8'
+
+# Границы корзин гистограмм задержки, секунды: от 5 мс до 2 минут (распознавание, сервис проверки, Bubble)
+LATENCY_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1, 2.5, 5, 10, 30, 60, 120)
+
+registry = []
+
+
+def escape(value):
+    return str(value).replace('\\', '\\\\').replace('"', '\\"').replace('\n', '\\n')
+
+
+def format_labels(names, values, extra=''):
+    pairs = [f'{name}="{escape(value)}"' for name, value in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return '{' + ','.join(pairs) + '}' if pairs else ''
+
+
+class Metric:
+    kind = 'untyped'
+
+    def __init__(self, name, documentation, labelnames=()):
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.lock = threading.Lock()
+        self.values = {}
+        registry.append(self)
+
+    def header(self):
+        return [f'# HELP {self.name} {self.documentation}', f'# TYPE {self.name} {self.kind}']
+
+    def samples(self):
+        with self.lock:
+            items = list(self.values.items())
+        return [f'{self.name}{format_labels(self.labelnames, labels)} {value}' for labels, value in items]
+
+
+class Counter(Metric):
+    kind = 'counter'
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+
+class Gauge(Metric):
+    """
+    Текущее значение. Если задана function, значение читается при каждом запросе /metrics:
+    функция возвращает число или словарь {кортеж меток: число} (глубина очередей, задачи в работе).
+    """
+    kind = 'gauge'
+
+    def __init__(self, name, documentation, labelnames=(), function=None):
+        super().__init__(name, documentation, labelnames)
+        self.function = function
+
+    def set(self, value, *labels):
+        with self.lock:
+            self.values[labels] = value
+
+    def inc(self, *labels, amount=1):
+        with self.lock:
+            self.values[labels] = self.values.get(labels, 0) + amount
+
+    def dec(self, *labels, amount=1):
+        self.inc(*labels, amount=-amount)
+
+    def samples(self):
+        if self.function is not None:
+            value = self.function()
+            values = value if isinstance(value, dict) else {(): value}
+            return [f'{self.name}{format_labels(self.labelnames, labels)} {v}' for labels, v in values.items()]
+        return super().samples()
+
+
+class Histogram(Metric):
+    kind = 'histogram'
+
+    def __init__(self, name, documentation, labelnames=(), buckets=LATENCY_BUCKETS):
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(buckets)
+
+    def observe(self, value, *labels):
+        # Храним попадания в каждую корзину отдельно, накопительные суммы считаются при выводе
+        index = bisect_left(self.buckets, value)
+        with self.lock:
+            state = self.values.get(labels)
+            if state is None:
+                state = self.values[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+            state[0][index] += 1
+            state[1] += value
+
+    def samples(self):
+        with self.lock:
+            items = [(labels, list(counts), total) for labels, (counts, total) in self.values.items()]
+        lines = []
+        for labels, counts, total in items:
+            cumulative = 0
+            for bound, count in zip((*self.buckets, '+Inf'), counts):
+                cumulative += count
+                bucket_labels = format_labels(self.labelnames, labels, 'le="%s"' % bound)
+                lines.append(f'{self.name}_bucket{bucket_labels} {cumulative}')
+            lines.append(f'{self.name}_sum{format_labels(self.labelnames, labels)} {round(total, 6)}')
+            lines.append(f'{self.name}_count{format_labels(self.labelnames, labels)} {cumulative}')
+        return lines
+
+
+# Общие метрики конвейера чеков и внешних вызовов
+STAGE_SECONDS = Histogram('receipt_stage_seconds', 'Длительность этапа обработки чека', ['stage'])
+QR_RESULTS = Counter('receipt_qr_total', 'Результаты распознавания QR-кода', ['result'])
+UPSTREAM_SECONDS = Histogram('upstream_request_seconds', 'Длительность запроса к внешнему сервису', ['upstream'])
+UPSTREAM_RESPONSES = Counter('upstream_responses_total', 'Ответы внешних сервисов по кодам', ['upstream', 'status'])
+HTTP_SECONDS = Histogram('http_request_seconds', 'Длительность обработки HTTP-запроса', ['endpoint', 'status'])
+HTTP_IN_FLIGHT = Gauge('http_requests_in_flight', 'HTTP-запросы в обработке', ['endpoint'])
+
+
+# Тайминги этапов из stage() (миллисекунды) в гистограмму этапов
+def observe_timings(timings):
+    for name, milliseconds in timings.items():
+        STAGE_SECONDS.observe(milliseconds / 1000, name)
+
+
+def render():
+    lines = []
+    for metric in registry:
+        lines.extend(metric.header())
+        lines.extend(metric.samples())
+    return '\n'.join(lines) + '\n'
+
+
+# Замер длительности и числа одновременных запросов приложения и маршрут GET /metrics
+def install(app):
+    @app.before_request
+    def metrics_request_started():
+        g.metrics_started = time.perf_counter()
+        HTTP_IN_FLIGHT.inc(request.endpoint or 'unknown')
+
+    @app.teardown_request
+    def metrics_request_finished(error=None):
+        started = g.pop('metrics_started', None)
+        if started is None:
+            return
+        endpoint = request.endpoint or 'unknown'
+        HTTP_IN_FLIGHT.dec(endpoint)
+        HTTP_SECONDS.observe(time.perf_counter() - started, endpoint, g.pop('metrics_status', 500 if error else 200))
+
+    @app.after_request
+    def metrics_response_status(response):
+        g.metrics_status = response.status_code
+        return response
+
+    @app.route('/metrics', methods=['GET'])
+    def metrics_endpoint():
+        return Response(render(), content_type=CONTENT_TYPE)
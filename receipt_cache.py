@@ -0,0 +1,153 @@
+import os
+import json
+import time
+import hashlib
+import logging
+import threading
+from collections import OrderedDict
+from urllib.parse import urlsplit, urlunsplit
+
+# Настройки кеша результатов распознавания чеков
+RECEIPT_CACHE_SIZE = int(os.getenv('RECEIPT_CACHE_SIZE', '5000'))
+RECEIPT_CACHE_TTL = int(os.getenv('RECEIPT_CACHE_TTL', '86400'))
+RECEIPT_CACHE_NEGATIVE_TTL = int(os.getenv('RECEIPT_CACHE_NEGATIVE_TTL', '600'))
+RECEIPT_CACHE_PATH = os.getenv('RECEIPT_CACHE_PATH')  # Журнал на диске; если не задан, кеш живет только в памяти
+
+
+# Приведение URL фото к единому виду: https, хост в нижнем регистре, без query и фрагмента
+def normalize_url(url):
+    if not url.startswith('http'):
+        url = 'https:' + url
+    parts = urlsplit(url)
+    return urlunsplit(('https', parts.netloc.lower(), parts.path, '', ''))
+
+
+# Хеш содержимого изображения
+def content_hash(image_bytes):
+    return hashlib.sha256(image_bytes).hexdigest()
+
+
+class ReceiptCache:
+    """
+    LRU-кеш результатов распознавания, адресуемый по содержимому.
+    Результат хранится по хешу байтов изображения, отдельный индекс связывает
+    нормализованный URL с хешем, чтобы повторная отправка того же URL не требовала
+    даже скачивания. Отрицательный результат ("QR нет") живет меньше положительного.
+    При заданном path каждая запись дописывается в журнал JSON Lines, который
+    перечитывается и сжимается при старте.
+    """
+
+    def __init__(self, max_size=RECEIPT_CACHE_SIZE, ttl=RECEIPT_CACHE_TTL,
+                 negative_ttl=RECEIPT_CACHE_NEGATIVE_TTL, path=RECEIPT_CACHE_PATH):
+        self.max_size = max_size
+        self.ttl = ttl
+        self.negative_ttl = negative_ttl
+        self.path = path
+        self.entries = OrderedDict()  # хеш -> {'qr', 'method', 'expires'}
+        self.urls = OrderedDict()     # нормализованный URL -> хеш
+        self.lock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.journal_lines = 0
+        if self.path:
+            self.load()
+
+    def _get(self, digest):
+        entry = self.entries.get(digest)
+        if entry is None:
+            return None
+        if entry['expires'] < time.time():
+            del self.entries[digest]
+            return None
+        self.entries.move_to_end(digest)
+        return entry
+
+    def _link_url(self, url, digest):
+        self.urls[url] = digest
+        self.urls.move_to_end(url)
+        while len(self.urls) > self.max_size:
+            self.urls.popitem(last=False)
+
+    def get_by_url(self, url):
+        with self.lock:
+            digest = self.urls.get(url)
+            entry = self._get(digest) if digest else None
+            if entry is None:
+                self.urls.pop(url, None)
+                return None
+            self.urls.move_to_end(url)
+            self.hits += 1
+            return entry
+
+    def get_by_hash(self, digest, url=None):
+        with self.lock:
+            entry = self._get(digest)
+            if entry is None:
+                self.misses += 1
+                return None
+            if url:
+                self._link_url(url, digest)
+            self.hits += 1
+            return entry
+
+    def put(self, url, digest, qr_data, method):
+        if method is None:
+            # Распознавание не завершилось (перегрузка, таймаут): это не "QR-кода нет", повтор должен распознавать заново
+            return
+        ttl = self.ttl if qr_data else self.negative_ttl
+        entry = {'qr': qr_data, 'method': method, 'expires': time.time() + ttl}
+        with self.lock:
+            self._store(url, digest, entry)
+            if self.path:
+                self._append(url, digest, entry)
+
+    def _store(self, url, digest, entry):
+        self.entries[digest] = entry
+        self.entries.move_to_end(digest)
+        while len(self.entries) > self.max_size:
+            self.entries.popitem(last=False)
+        if url:
+            self._link_url(url, digest)
+
+    def _append(self, url, digest, entry):
+        try:
+            with open(self.path, 'a', encoding='utf-8') as journal:
+                journal.write(json.dumps({'url': url, 'hash': digest, **entry}, ensure_ascii=False) + '\n')
+            self.journal_lines += 1
+            if self.journal_lines > 2 * self.max_size:
+                self.compact()
+        except OSError as e:
+            logging.error(f"Не удалось записать кеш чеков в {self.path}: {str(e)}")
+
+    def load(self):
+        if not os.path.exists(self.path):
+            return
+        now = time.time()
+        loaded = 0
+        try:
+            with open(self.path, encoding='utf-8') as journal:
+                for line in journal:
+                    try:
+                        record = json.loads(line)
+                    except ValueError:
+                        continue
+                    if record.get('expires', 0) < now:
+                        continue
+                    entry = {'qr': record.get('qr'), 'method': record.get('method'), 'expires': record['expires']}
+                    self._store(record.get('url'), record['hash'], entry)
+                    loaded += 1
+            self.compact()
+            logging.info(f"Кеш чеков загружен из {self.path}: {len(self.entries)} записей ({loaded} строк журнала)")
+        except OSError as e:
+            logging.error(f"Не удалось прочитать кеш чеков из {self.path}: {str(e)}")
+
+    def compact(self):
+        # Перезаписываем журнал только актуальными записями
+        url_by_digest = {digest: url for url, digest in self.urls.items()}
+        tmp_path = f"{self.path}.tmp"
+        with open(tmp_path, 'w', encoding='utf-8') as journal:
+            for digest, entry in self.entries.items():
+                record = {'url': url_by_digest.get(digest), 'hash': digest, **entry}
+                journal.write(json.dumps(record, ensure_ascii=False) + '\n')
+        os.replace(tmp_path, self.path)
+        self.journal_lines = len(self.entries)
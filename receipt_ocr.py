@@ -0,0 +1,220 @@
+import os
+import re
+import time
+import logging
+import threading
+import multiprocessing
+from io import BytesIO
+from concurrent.futures import ProcessPoolExecutor, TimeoutError as FutureTimeoutError
+from PIL import Image, ImageOps
+import pytesseract
+from pillow_heif import register_heif_opener
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Процессы OCR, бюджет времени на одно изображение, размер рабочего кадра и доля нижней части чека,
+# где ищутся фискальные реквизиты и итог
+OCR_PROCESSES = int(os.getenv('OCR_PROCESSES', '2'))
+OCR_TIME_BUDGET = float(os.getenv('OCR_TIME_BUDGET', '20'))
+OCR_MAX_SIDE = int(os.getenv('OCR_MAX_SIDE', '2400'))
+OCR_BOTTOM_SHARE = float(os.getenv('OCR_BOTTOM_SHARE', '0.6'))
+# Диапазон и шаг поиска угла наклона, градусы
+OCR_DESKEW_RANGE = float(os.getenv('OCR_DESKEW_RANGE', '5'))
+OCR_DESKEW_STEP = float(os.getenv('OCR_DESKEW_STEP', '0.5'))
+
+DIGITS_CONFIG = '--psm 7 -c tessedit_char_whitelist=0123456789.,:'
+LABELS_CONFIG = '--psm 6'
+
+register_heif_opener(thumbnails=False)
+
+# Метки строк чека и шаблоны значений в тексте
+LABEL_PATTERNS = {
+    'fn': re.compile(r'ФН\D{0,4}(\d{16})'),
+    'fd': re.compile(r'ФД\D{0,4}(\d{1,10})'),
+    'fp': re.compile(r'ФП[ДН]?\D{0,4}(\d{1,10})'),
+    'total': re.compile(r'ИТОГ\D{0,6}(\d[\d ]*[.,]\d{2})'),
+}
+LABEL_ORDER = re.compile(r'ФН|ФД|ФП|ИТОГ')
+THOUSANDS_PATTERN = re.compile(r'(?<![\d.,])\d{1,3}(?: \d{3})+[.,]\d{2}')
+DATE_PATTERN = re.compile(r'(\d{2})[.\-/](\d{2})[.\-/](\d{2}|\d{4})\D{0,3}(\d{2}):(\d{2})')
+OPERATION_TYPES = (
+    ('ВОЗВРАТ ПРИХОДА', 2),
+    ('ВОЗВРАТ РАСХОДА', 4),
+    ('ПРИХОД', 1),
+    ('РАСХОД', 3),
+)
+LABEL_FIELDS = {'ФН': 'fn', 'ФД': 'fd', 'ФП': 'fp', 'ИТОГ': 'total'}
+
+
+# Порог бинаризации по методу Оцу
+def otsu_threshold(image):
+    histogram = image.histogram()[:256]
+    total = sum(histogram)
+    sum_all = sum(i * count for i, count in enumerate(histogram))
+    sum_background = weight_background = 0
+    best_threshold, best_variance = 127, 0.0
+    for threshold, count in enumerate(histogram):
+        weight_background += count
+        if weight_background == 0:
+            continue
+        weight_foreground = total - weight_background
+        if weight_foreground == 0:
+            break
+        sum_background += threshold * count
+        mean_background = sum_background / weight_background
+        mean_foreground = (sum_all - sum_background) / weight_foreground
+        variance = weight_background * weight_foreground * (mean_background - mean_foreground) ** 2
+        if variance > best_variance:
+            best_threshold, best_variance = threshold, variance
+    return best_threshold
+
+
+# Черные пиксели по строкам бинарного кадра (текст - 0, фон - 255)
+def row_ink(image):
+    width, height = image.size
+    data = image.tobytes()
+    return [width - data[row * width:(row + 1) * width].count(255) for row in range(height)]
+
+
+# Угол наклона: при правильном повороте строки текста дают самый "контрастный" горизонтальный профиль
+def estimate_skew(binary):
+    small = binary.copy()
+    small.thumbnail((600, 600))
+    best_angle, best_score = 0.0, -1.0
+    steps = int(OCR_DESKEW_RANGE / OCR_DESKEW_STEP)
+    for step in range(-steps, steps + 1):
+        angle = step * OCR_DESKEW_STEP
+        rotated = small.rotate(angle, fillcolor=255)
+        profile = row_ink(rotated.point(lambda value: 255 if value > 127 else 0))
+        score = sum((profile[i + 1] - profile[i]) ** 2 for i in range(len(profile) - 1))
+        if score > best_score:
+            best_angle, best_score = angle, score
+    return best_angle
+
+
+# Подготовка кадра: оттенки серого, ограничение размера, автоконтраст, бинаризация, выравнивание наклона
+def preprocess(image):
+    image = ImageOps.exif_transpose(image).convert('L')
+    image.thumbnail((OCR_MAX_SIDE, OCR_MAX_SIDE))
+    image = ImageOps.autocontrast(image)
+    threshold = otsu_threshold(image)
+    binary = image.point(lambda value: 255 if value > threshold else 0)
+    angle = estimate_skew(binary)
+    if angle:
+        binary = binary.rotate(angle, fillcolor=255, expand=True)
+    return binary
+
+
+def remaining(deadline):
+    left = deadline - time.monotonic()
+    if left <= 0:
+        raise TimeoutError('Исчерпан бюджет времени OCR')
+    return left
+
+
+# Разбор реквизитов из текста строки и цифрового прохода по той же строке
+def parse_line(label_text, digits_text, fields):
+    text = label_text.upper()
+    from_labels = {}
+    for name, pattern in LABEL_PATTERNS.items():
+        match = pattern.search(text)
+        if match and name not in fields:
+            fields[name] = from_labels[name] = match.group(1).replace(' ', '').replace(',', '.')
+
+    # Цифровой проход точнее: числа строки сопоставляются меткам в порядке их появления.
+    # Суммы печатаются с пробелом между разрядами (3 500.00), такие группы склеиваются
+    labels = [LABEL_FIELDS[label] for label in LABEL_ORDER.findall(text)]
+    digits_text = THOUSANDS_PATTERN.sub(lambda match: match.group(0).replace(' ', ''), digits_text or '')
+    numbers = re.findall(r'\d[\d.,:]*', digits_text)
+    if labels and len(numbers) >= len(labels):
+        for name, number in zip(labels, numbers[-len(labels):]):
+            # Значение короче найденного по метке - обрывок числа, а не уточнение
+            if name in from_labels and len(number) < len(from_labels[name]):
+                continue
+            if name == 'total':
+                if re.fullmatch(r'\d+[.,]\d{2}', number):
+                    fields[name] = number.replace(',', '.')
+            elif name == 'fn':
+                if len(number) == 16 and number.isdigit():
+                    fields[name] = number
+            elif number.isdigit():
+                fields[name] = number
+
+    if 'check_time' not in fields:
+        match = DATE_PATTERN.search(text) or DATE_PATTERN.search(digits_text or '')
+        if match:
+            day, month, year, hour, minute = match.groups()
+            year = year if len(year) == 4 else '20' + year
+            fields['check_time'] = f"{year}{month}{day}T{hour}{minute}"
+
+    if 'type' not in fields:
+        for marker, operation_type in OPERATION_TYPES:
+            if marker in text:
+                fields['type'] = operation_type
+                break
+
+
+# Строки текста области: один проход tesseract, слова группируются по строкам, (текст, рамка строки)
+def ocr_lines(region, deadline):
+    data = pytesseract.image_to_data(
+        region, lang='rus', config=LABELS_CONFIG, output_type=pytesseract.Output.DICT, timeout=remaining(deadline)
+    )
+    lines = {}
+    for i, word in enumerate(data['text']):
+        if not word.strip():
+            continue
+        left, top = data['left'][i], data['top'][i]
+        right, bottom = left + data['width'][i], top + data['height'][i]
+        key = (data['block_num'][i], data['par_num'][i], data['line_num'][i])
+        if key not in lines:
+            lines[key] = {'words': [], 'box': [left, top, right, bottom]}
+        line = lines[key]
+        line['words'].append(word)
+        line['box'] = [min(line['box'][0], left), min(line['box'][1], top),
+                       max(line['box'][2], right), max(line['box'][3], bottom)]
+    return [(' '.join(line['words']), line['box']) for line in lines.values()]
+
+
+# Извлечение ФН, ФД, ФП, даты/времени, типа операции и итога из изображения чека.
+# Текст распознается только в нижней части чека, цифровой проход с белым списком - только по строкам с метками
+def extract_receipt_fields(image_bytes, time_budget=OCR_TIME_BUDGET):
+    deadline = time.monotonic() + time_budget
+    binary = preprocess(Image.open(BytesIO(image_bytes)))
+    width, height = binary.size
+    region = binary.crop((0, int(height * (1 - OCR_BOTTOM_SHARE)), width, height))
+    fields = {}
+    for label_text, (left, top, right, bottom) in ocr_lines(region, deadline):
+        upper = label_text.upper()
+        relevant = (
+            LABEL_ORDER.search(upper) or DATE_PATTERN.search(upper)
+            or any(marker in upper for marker, _ in OPERATION_TYPES)
+        )
+        if not relevant:
+            continue
+        line = region.crop((max(left - 4, 0), max(top - 4, 0), min(right + 4, width), min(bottom + 4, region.size[1])))
+        digits_text = pytesseract.image_to_string(line, config=DIGITS_CONFIG, timeout=remaining(deadline))
+        parse_line(label_text, digits_text, fields)
+        if all(name in fields for name in ('fn', 'fd', 'fp', 'check_time', 'type', 'total')):
+            break
+    return fields
+
+
+# Пул процессов OCR создается при первом обращении. spawn: в родителе уже работают потоки
+ocr_pool = None
+ocr_pool_lock = threading.Lock()
+
+
+def extract_receipt_fields_in_pool(image_bytes):
+    global ocr_pool
+    with ocr_pool_lock:
+        if ocr_pool is None:
+            ocr_pool = ProcessPoolExecutor(max_workers=OCR_PROCESSES, mp_context=multiprocessing.get_context('spawn'))
+    future = ocr_pool.submit(extract_receipt_fields, image_bytes, OCR_TIME_BUDGET)
+    try:
+        # Небольшой запас сверх бюджета на передачу изображения и подготовку кадра
+        return future.result(timeout=OCR_TIME_BUDGET + 10)
+    except (FutureTimeoutError, TimeoutError, RuntimeError) as e:
+        future.cancel()
+        logging.warning(f"OCR чека не уложился в бюджет {OCR_TIME_BUDGET} с: {str(e)}")
+        return {}
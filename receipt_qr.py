@@ -0,0 +1,258 @@
+import os
+import logging
+import queue
+import threading
+import time
+from io import BytesIO
+from contextlib import contextmanager
+from concurrent.futures import Future, TimeoutError as FutureTimeoutError
+from PIL import Image, ImageFilter, ImageStat
+import zxing
+from pyzbar.pyzbar import decode
+from pillow_heif import register_heif_opener
+from dotenv import load_dotenv
+
+load_dotenv()
+
+# Пул воркеров zxing: количество воркеров, предел очереди, размер пачки на один запуск JVM и таймаут ожидания
+ZXING_POOL_SIZE = int(os.getenv('ZXING_POOL_SIZE', '2'))
+ZXING_QUEUE_LIMIT = int(os.getenv('ZXING_QUEUE_LIMIT', '32'))
+ZXING_BATCH_SIZE = int(os.getenv('ZXING_BATCH_SIZE', '8'))
+ZXING_TIMEOUT = float(os.getenv('ZXING_TIMEOUT', '20'))
+# Максимальная сторона нормализованного кадра, который получают все декодеры
+MAX_IMAGE_SIDE = int(os.getenv('MAX_IMAGE_SIDE', '2048'))
+# Режим распознавания: single - один нормализованный кадр, ladder - лестница масштабов для больших фото
+QR_DETECTION_MODE = os.getenv('QR_DETECTION_MODE', 'single')
+# Пороги лестницы: с какого размера фото она включается, сторона уменьшенного кадра, размер и число фрагментов
+LADDER_MIN_MEGAPIXELS = float(os.getenv('LADDER_MIN_MEGAPIXELS', '6'))
+LADDER_DRAFT_SIDE = int(os.getenv('LADDER_DRAFT_SIDE', '1024'))
+LADDER_TILE_SIDE = int(os.getenv('LADDER_TILE_SIDE', '1200'))
+LADDER_MAX_TILES = int(os.getenv('LADDER_MAX_TILES', '6'))
+# Количество потоков libheif при декодировании HEIC/HEIF
+HEIF_DECODE_THREADS = int(os.getenv('HEIF_DECODE_THREADS', '4'))
+
+# Поддержка HEIC/HEIF (фото с iPhone) в Image.open; списки миниатюр не читаем - pillow_heif 0.21 не умеет их декодировать
+register_heif_opener(thumbnails=False, decode_threads=HEIF_DECODE_THREADS)
+
+# Замер длительности этапа обработки в миллисекундах
+@contextmanager
+def stage(timings, name):
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        timings[name] = round((time.perf_counter() - started) * 1000, 1)
+
+# Функция для корректировки ориентации изображения
+def correct_image_orientation(image):
+    try:
+        exif = image.getexif()
+        if exif is not None:
+            orientation_key = 274  # Exif-тег 'Orientation'
+            if orientation_key in exif:
+                orientation = exif[orientation_key]
+                if orientation == 3:
+                    image = image.rotate(180, expand=True)
+                elif orientation == 6:
+                    image = image.rotate(270, expand=True)
+                elif orientation == 8:
+                    image = image.rotate(90, expand=True)
+        return image
+    except Exception as e:
+        logging.error(f"Ошибка при корректировке ориентации изображения: {str(e)}")
+        return image
+
+# Однократное декодирование изображения: EXIF-ориентация, оттенки серого и ограничение размера
+def prepare_image(image_bytes, timings, max_side=MAX_IMAGE_SIDE):
+    with stage(timings, 'decode'):
+        image = Image.open(BytesIO(image_bytes))
+        image.load()
+    with stage(timings, 'orientation'):
+        image = correct_image_orientation(image)
+    with stage(timings, 'normalize'):
+        image = image.convert('L')
+        if max_side:
+            image.thumbnail((max_side, max_side))
+    return image
+
+# Быстрое уменьшенное декодирование: для JPEG draft-режим Pillow масштабирует прямо в декодере
+def prepare_draft_image(image, side, timings):
+    with stage(timings, 'draft_decode'):
+        image.draft('L', (side, side))
+        image.load()
+        image = correct_image_orientation(image)
+        image = image.convert('L')
+        image.thumbnail((side, side))
+    return image
+
+# Позиции фрагментов с перекрытием в половину фрагмента, последний прижат к краю
+def tile_positions(length, tile):
+    if length <= tile:
+        return [0]
+    step = max(tile // 2, 1)
+    positions = list(range(0, length - tile, step))
+    positions.append(length - tile)
+    return positions
+
+# Фрагменты полноразмерного кадра, где вероятнее всего находится QR-код (по плотности границ на уменьшенном кадре)
+def likely_qr_boxes(small_image, full_size):
+    scale = full_size[0] / small_image.size[0]
+    tile = max(int(LADDER_TILE_SIDE / scale), 1)
+    edges = small_image.filter(ImageFilter.FIND_EDGES)
+    width, height = small_image.size
+    candidates = []
+    for top in tile_positions(height, tile):
+        for left in tile_positions(width, tile):
+            box = (left, top, min(left + tile, width), min(top + tile, height))
+            energy = ImageStat.Stat(edges.crop(box)).mean[0]
+            candidates.append((energy, box))
+    candidates.sort(key=lambda candidate: candidate[0], reverse=True)
+    return [
+        tuple(min(int(coord * scale), limit) for coord, limit in zip(box, (*full_size, *full_size)))
+        for _, box in candidates[:LADDER_MAX_TILES]
+    ]
+
+# Функция для распознавания QR-кода с помощью pyzbar
+def detect_qr_code_pyzbar(image):
+    try:
+        decoded_objects = decode(image)
+        if decoded_objects:
+            qr_data = decoded_objects[0].data.decode('utf-8')
+            logging.info(f"QR-код распознан с помощью pyzbar: {qr_data}")
+            return qr_data, 'pyzbar'
+        else:
+            logging.info("QR-код не найден с помощью pyzbar")
+            return None, 'pyzbar'
+    except Exception as e:
+        logging.error(f"Ошибка при распознавании QR-кода с помощью pyzbar: {str(e)}")
+        return None, 'pyzbar'
+
+# Очередь изображений для пула zxing и состояние запуска воркеров
+zxing_queue = queue.Queue(maxsize=ZXING_QUEUE_LIMIT)
+zxing_workers = []
+zxing_workers_lock = threading.Lock()
+
+def zxing_worker():
+    # BarCodeReader создается один раз на воркер и переиспользуется для всех изображений
+    reader = zxing.BarCodeReader()
+    while True:
+        batch = [zxing_queue.get()]
+        # Забираем из очереди все, что накопилось, чтобы распознать пачку за один запуск JVM
+        while len(batch) < ZXING_BATCH_SIZE:
+            try:
+                batch.append(zxing_queue.get_nowait())
+            except queue.Empty:
+                break
+        try:
+            results = reader.decode([image for image, _ in batch])
+            for (_, future), qr_result in zip(batch, results):
+                future.set_result(qr_result.parsed if qr_result else None)
+        except Exception as e:
+            if len(batch) == 1:
+                batch[0][1].set_exception(e)
+            else:
+                # Одно битое изображение не должно ронять всю пачку: повторяем поштучно
+                logging.warning(f"Ошибка пакетного распознавания zxing ({len(batch)} изобр.), повтор поштучно: {str(e)}")
+                for image, future in batch:
+                    try:
+                        qr_result = reader.decode(image)
+                        future.set_result(qr_result.parsed if qr_result else None)
+                    except Exception as item_error:
+                        future.set_exception(item_error)
+        finally:
+            for _ in batch:
+                zxing_queue.task_done()
+
+def start_zxing_pool():
+    # Воркеры запускаются лениво при первом обращении, чтобы не плодить потоки при импорте
+    with zxing_workers_lock:
+        if zxing_workers:
+            return
+        for i in range(ZXING_POOL_SIZE):
+            worker = threading.Thread(target=zxing_worker, name=f'zxing-{i}', daemon=True)
+            worker.start()
+            zxing_workers.append(worker)
+        logging.info(f"Запущен пул zxing: воркеров={ZXING_POOL_SIZE}, очередь={ZXING_QUEUE_LIMIT}, пачка={ZXING_BATCH_SIZE}")
+
+# Функция для распознавания QR-кода с помощью zxing. Метод None - изображение не распознавалось
+# (очередь переполнена, таймаут, ошибка): такой результат не означает, что QR-кода на фото нет
+def detect_qr_code_zxing(image):
+    try:
+        start_zxing_pool()
+        future = Future()
+        try:
+            zxing_queue.put_nowait((image, future))
+        except queue.Full:
+            logging.warning(f"Очередь zxing переполнена ({ZXING_QUEUE_LIMIT}), распознавание пропущено")
+            return None, None
+        qr_data = future.result(timeout=ZXING_TIMEOUT)
+        if qr_data:
+            logging.info(f"QR-код распознан с помощью zxing: {qr_data}")
+            return qr_data, 'zxing'
+        else:
+            logging.info("QR-код не найден с помощью zxing")
+            return None, 'zxing'
+    except FutureTimeoutError:
+        logging.error(f"Превышено время ожидания распознавания zxing ({ZXING_TIMEOUT} с)")
+        return None, None
+    except Exception as e:
+        logging.error(f"Ошибка при распознавании QR-кода с помощью zxing: {str(e)}")
+        return None, None
+
+# Лестница масштабов: уменьшенный кадр, затем вероятные фрагменты, затем полное разрешение.
+# Останавливается на первом успешном распознавании
+def decode_receipt_ladder(image_bytes, timings):
+    image = Image.open(BytesIO(image_bytes))
+    if image.format == 'JPEG':
+        small_image = prepare_draft_image(image, LADDER_DRAFT_SIDE, timings)
+        image = None
+    else:
+        # Для HEIF и других форматов уменьшенного декодирования нет: полный кадр декодируется
+        # один раз, уменьшенный получается из него, а полный переиспользуется на следующих ступенях
+        image = prepare_image(image_bytes, timings, max_side=None)
+        with stage(timings, 'reduce'):
+            small_image = image.copy()
+            small_image.thumbnail((LADDER_DRAFT_SIDE, LADDER_DRAFT_SIDE))
+    with stage(timings, 'ladder_small'):
+        qr_data, method = detect_qr_code_pyzbar(small_image)
+    if qr_data:
+        return qr_data, method
+
+    if image is None:
+        image = prepare_image(image_bytes, timings, max_side=None)
+    with stage(timings, 'ladder_tiles'):
+        for box in likely_qr_boxes(small_image, image.size):
+            qr_data, method = detect_qr_code_pyzbar(image.crop(box))
+            if qr_data:
+                return qr_data, method
+
+    with stage(timings, 'ladder_full'):
+        qr_data, method = detect_qr_code_pyzbar(image)
+    if not qr_data:
+        image.thumbnail((MAX_IMAGE_SIDE, MAX_IMAGE_SIDE))
+        with stage(timings, 'zxing'):
+            qr_data, method = detect_qr_code_zxing(image)
+    return qr_data, method
+
+# Распознавание QR-кода: кадр готовится один раз и передается всем декодерам по очереди
+# HEIF всегда идет по лестнице: полный кадр для сканирования нужен, только если уменьшенный не помог
+def decode_receipt_image(image_bytes, timings, mode=None):
+    probe = Image.open(BytesIO(image_bytes))
+    width, height = probe.size
+    if probe.format == 'HEIF' or (mode or QR_DETECTION_MODE) == 'ladder':
+        if width * height >= LADDER_MIN_MEGAPIXELS * 1_000_000:
+            return decode_receipt_ladder(image_bytes, timings)
+
+    image = prepare_image(image_bytes, timings)
+    with stage(timings, 'pyzbar'):
+        qr_data, method = detect_qr_code_pyzbar(image)
+    if not qr_data:
+        with stage(timings, 'zxing'):
+            qr_data, method = detect_qr_code_zxing(image)
+    return qr_data, method
+
+# Распознавание в отдельном процессе: тайминги возвращаются вместе с результатом
+def decode_receipt_job(image_bytes):
+    timings = {}
+    qr_data, method = decode_receipt_image(image_bytes, timings)
+    return qr_data, method, timings
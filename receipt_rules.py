@@ -0,0 +1,158 @@
+import os
+import re
+import json
+import logging
+import threading
+from datetime import datetime, timedelta
+from urllib.parse import parse_qs
+
+# Правила акции по умолчанию (см. /rules в gorodbot.py): покупка от 3 000 ₽, только приход,
+# без банков, банкоматов, вендинговых автоматов и терминалов оплаты сотовой связи.
+# Адрес ТЦ по умолчанию не проверяется: правило включается шаблонами address_patterns
+# (RULE_ADDRESS_PATTERNS), а require_address (RULE_REQUIRE_ADDRESS=1) запрещает запуск без них
+DEFAULT_RULES = {
+    'min_total': 3000,
+    'start': None,
+    'end': None,
+    'operation_types': [1],
+    'address_patterns': [],
+    'require_address': False,
+    'inn_allow': [],
+    'inn_deny': [],
+    'seller_deny_patterns': ['сбербанк', 'юнистрим', 'банкомат', 'вендинг', 'терминал оплаты'],
+}
+
+
+def split_list(value, separator):
+    return [item.strip() for item in value.split(separator) if item.strip()] if value else None
+
+
+# Правила из JSON-файла RECEIPT_RULES_PATH или переменных окружения RULE_*
+def rules_config():
+    config = dict(DEFAULT_RULES)
+    rules_path = os.getenv('RECEIPT_RULES_PATH')
+    if rules_path:
+        with open(rules_path, encoding='utf-8') as rules_file:
+            config.update(json.load(rules_file))
+        return config
+    env_values = {
+        'min_total': os.getenv('RULE_MIN_TOTAL'),
+        'start': os.getenv('RULE_START'),
+        'end': os.getenv('RULE_END'),
+        'operation_types': split_list(os.getenv('RULE_OPERATION_TYPES'), ','),
+        'address_patterns': split_list(os.getenv('RULE_ADDRESS_PATTERNS'), ';'),
+        'require_address': os.getenv('RULE_REQUIRE_ADDRESS') == '1' if os.getenv('RULE_REQUIRE_ADDRESS') else None,
+        'inn_allow': split_list(os.getenv('RULE_INN_ALLOW'), ','),
+        'inn_deny': split_list(os.getenv('RULE_INN_DENY'), ','),
+        'seller_deny_patterns': split_list(os.getenv('RULE_SELLER_DENY'), ';'),
+    }
+    config.update({key: value for key, value in env_values.items() if value is not None})
+    return config
+
+
+def parse_time(value):
+    # dateTime из ответа сервиса ("2024-03-15T15:30:00") или t из QR-кода ("20240315T1530")
+    value = str(value)
+    for time_format in ('%Y-%m-%dT%H:%M:%S', '%Y-%m-%dT%H:%M', '%Y%m%dT%H%M', '%Y%m%dT%H%M%S', '%Y-%m-%d', '%Y%m%d'):
+        try:
+            return datetime.strptime(value, time_format)
+        except ValueError:
+            continue
+    return None
+
+
+def parse_end_time(value):
+    # Окончание акции без времени ("2024-12-31") включает весь этот день
+    end = parse_time(value)
+    if end is not None and re.fullmatch(r'\d{4}-?\d{2}-?\d{2}', str(value).strip()):
+        end += timedelta(days=1) - timedelta(microseconds=1)
+    return end
+
+
+class ReceiptRules:
+    """
+    Предварительная проверка соответствия чека правилам акции. Все шаблоны и множества
+    собираются один раз при создании; check_qr проверяет то, что известно из QR-кода
+    (сумма, дата, тип операции) до платного запроса к сервису проверки, check - полный
+    ответ сервиса, включая адрес и ИНН. Оба метода возвращают список причин отказа.
+    """
+
+    def __init__(self, config):
+        self.min_total = float(config['min_total']) if config.get('min_total') is not None else None
+        self.start = parse_time(config['start']) if config.get('start') else None
+        self.end = parse_end_time(config['end']) if config.get('end') else None
+        self.operation_types = {int(value) for value in config.get('operation_types') or []}
+        patterns = config.get('address_patterns') or []
+        if config.get('require_address') and not patterns:
+            raise ValueError('Правило адреса включено (require_address), но шаблоны address_patterns не заданы')
+        self.address_pattern = re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE) if patterns else None
+        self.inn_allow = {str(inn).strip() for inn in config.get('inn_allow') or []}
+        self.inn_deny = {str(inn).strip() for inn in config.get('inn_deny') or []}
+        patterns = config.get('seller_deny_patterns') or []
+        self.seller_deny = re.compile('|'.join(f'(?:{p})' for p in patterns), re.IGNORECASE) if patterns else None
+        self.rejected = 0
+        self.lock = threading.Lock()
+
+    def _count(self, reasons):
+        if reasons:
+            with self.lock:
+                self.rejected += 1
+
+    def _common(self, total, check_time, operation_type):
+        reasons = []
+        if self.min_total is not None and (total is None or total < self.min_total):
+            reasons.append(f'сумма {total} меньше {self.min_total:g}')
+        if self.start or self.end:
+            if check_time is None:
+                reasons.append('не удалось определить дату чека')
+            elif self.start and check_time < self.start:
+                reasons.append(f'чек от {check_time} выдан до начала акции')
+            elif self.end and check_time > self.end:
+                reasons.append(f'чек от {check_time} выдан после окончания акции')
+        if self.operation_types and operation_type not in self.operation_types:
+            reasons.append(f'тип операции {operation_type} не участвует')
+        return reasons
+
+    def check_qr(self, qr_data):
+        params = parse_qs(qr_data or '')
+        try:
+            total = float(params['s'][0])
+            operation_type = int(params['n'][0])
+        except (KeyError, ValueError):
+            return []  # Неполный QR-код: решение откладывается до ответа сервиса проверки
+        reasons = self._common(total, parse_time(params.get('t', [''])[0]), operation_type)
+        self._count(reasons)
+        return reasons
+
+    def check(self, json_data):
+        total_sum = json_data.get('totalSum')
+        reasons = self._common(
+            total_sum / 100 if total_sum is not None else None,
+            parse_time(json_data.get('dateTime', '')),
+            json_data.get('operationType')
+        )
+        address = json_data.get('retailPlaceAddress') or ''
+        if self.address_pattern and not self.address_pattern.search(address):
+            reasons.append(f'адрес "{address}" не относится к ТЦ')
+        inn = str(json_data.get('userInn') or '').strip()
+        if self.inn_allow and inn not in self.inn_allow:
+            reasons.append(f'ИНН {inn} не входит в список арендаторов')
+        if inn in self.inn_deny:
+            reasons.append(f'ИНН {inn} исключен из акции')
+        seller = f"{json_data.get('user') or ''} {json_data.get('retailPlace') or ''}"
+        if self.seller_deny and self.seller_deny.search(seller):
+            reasons.append(f'продавец "{seller.strip()}" исключен из акции')
+        self._count(reasons)
+        return reasons
+
+
+def load_rules():
+    rules = ReceiptRules(rules_config())
+    if rules.address_pattern is None:
+        logging.warning("Правило адреса ТЦ не действует: шаблоны address_patterns (RULE_ADDRESS_PATTERNS) не заданы")
+    logging.info(
+        f"Правила акции: сумма от {rules.min_total}, период {rules.start} - {rules.end}, "
+        f"типы операций {sorted(rules.operation_types)}, шаблонов адреса {'есть' if rules.address_pattern else 'нет'}, "
+        f"ИНН разрешено {len(rules.inn_allow)}, запрещено {len(rules.inn_deny)}"
+    )
+    return rules
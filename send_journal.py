@@ -0,0 +1,55 @@
+import os
+import time
+import sqlite3
+import logging
+
+
+class SendJournal:
+    """
+    Журнал рассылки на SQLite (WAL): результат каждой отправки записывается сразу после нее,
+    поэтому после падения или остановки скрипта известно, кому сообщение уже ушло.
+    final = 1 - окончательный результат (отправлено, бот заблокирован, чат не найден),
+    такие пользователи при продолжении рассылки пропускаются; временные ошибки, исчерпавшие
+    повторы, записываются с final = 0 и при продолжении отправляются снова.
+    """
+
+    def __init__(self, path, resume=False):
+        self.path = path
+        if not resume and os.path.exists(path):
+            # Новая рассылка: журнал предыдущей сохраняется рядом для разбора
+            old_path = f"{path}.{int(time.time())}.old"
+            os.replace(path, old_path)
+            for suffix in ('-wal', '-shm'):
+                if os.path.exists(path + suffix):
+                    os.replace(path + suffix, old_path + suffix)
+            logging.info(f"Журнал предыдущей рассылки перенесен в {old_path}")
+
+        self.conn = sqlite3.connect(path, isolation_level=None)
+        self.conn.execute('PRAGMA journal_mode=WAL')
+        self.conn.execute('PRAGMA synchronous=NORMAL')
+        self.conn.execute("""
+            CREATE TABLE IF NOT EXISTS sends (
+                user_id INTEGER PRIMARY KEY,
+                username TEXT,
+                status TEXT NOT NULL,
+                final INTEGER NOT NULL,
+                updated REAL NOT NULL
+            )
+        """)
+
+    def done_ids(self):
+        # Пользователи с окончательным результатом, построчно из базы
+        for (user_id,) in self.conn.execute('SELECT user_id FROM sends WHERE final = 1'):
+            yield user_id
+
+    def record(self, user_id, username, status, final):
+        self.conn.execute(
+            'INSERT OR REPLACE INTO sends (user_id, username, status, final, updated) VALUES (?, ?, ?, ?, ?)',
+            (int(user_id), username, status, int(final), time.time())
+        )
+
+    def rows(self):
+        yield from self.conn.execute('SELECT user_id, username, status FROM sends ORDER BY updated')
+
+    def close(self):
+        self.conn.close()
@@ -0,0 +1,42 @@
+import asyncio
+
+from audience import Audience, IntSet, csv_users, read_batches
+
+
+def test_intset_grows_and_keeps_negative_ids():
+    values = [-1001234567890 - i * 7919 for i in range(100)] + list(range(0, 2000, 3)) + [2 ** 62, -2 ** 62]
+    numbers = IntSet(capacity_bits=2)
+
+    assert all(numbers.add(value) for value in values)
+    assert not numbers.add(values[0])
+    assert len(numbers) == len(values)
+    assert numbers.bits > 2
+    assert all(value in numbers for value in values)
+    assert 1 not in numbers
+    assert -1001234567891 not in numbers
+
+
+def test_audience_drops_duplicates_invalid_and_skipped_ids():
+    rows = [('1', 'a'), ('2', 'b'), ('1', 'a again'), ('', 'no id'), ('x', 'bad id'), ('3', 'c'), ('-100', 'group')]
+    audience = Audience(iter(rows), skip=IntSet([2]))
+
+    assert [user['user_id'] for user in audience] == [1, 3, -100]
+    assert (audience.read, audience.duplicates, audience.invalid, audience.skipped) == (7, 1, 2, 1)
+
+
+def test_csv_users_reads_semicolon_file(tmp_path):
+    path = tmp_path / 'users.csv'
+    path.write_text('id;name\n 10 ; anna \n11;\n', encoding='utf-8')
+
+    assert list(csv_users(str(path), 'id', 'name')) == [('10', 'anna'), ('11', '')]
+
+
+def test_read_batches_streams_all_users():
+    audience = Audience(iter([(str(i), f'user{i}') for i in range(7)]))
+
+    async def collect():
+        return [batch async for batch in read_batches(audience, size=3)]
+
+    batches = asyncio.run(collect())
+    assert [len(batch) for batch in batches] == [3, 3, 1]
+    assert batches[-1] == [{'user_id': 6, 'username': 'user6'}]
@@ -0,0 +1,82 @@
+import os
+
+from bulk_journal import BulkJournal
+
+PARAMS = {'scenario': 'promocodes', 'file': '/data/codes.csv', 'column': 'code'}
+
+
+def journal_dir(tmp_path):
+    return str(tmp_path / 'journals')
+
+
+def test_interrupted_load_resumes_with_created_keys(tmp_path):
+    journal = BulkJournal(journal_dir(tmp_path), 'prize/1', PARAMS)
+    assert not journal.resumed
+    journal.start(baseline=10)
+    journal.record(0, 2, ['A', 'B'])
+    journal.record(1, 1, ['C'])
+
+    resumed = BulkJournal(journal_dir(tmp_path), 'prize/1', PARAMS)
+    assert resumed.resumed
+    assert resumed.baseline == 10
+    assert resumed.created == 3
+    assert resumed.keys == {'A', 'B', 'C'}
+
+
+def test_other_params_start_a_new_load(tmp_path):
+    journal = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    journal.start(baseline=0)
+    journal.record(0, 5)
+
+    other = BulkJournal(journal_dir(tmp_path), 'p1', {**PARAMS, 'column': 'promo'})
+    assert not other.resumed
+    assert other.created == 0
+    assert any(name.endswith('.stale') for name in os.listdir(journal_dir(tmp_path)))
+
+
+def test_truncated_last_line_is_dropped_and_file_repaired(tmp_path):
+    journal = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    journal.start(baseline=0)
+    journal.record(0, 2, ['A', 'B'])
+    with open(journal.path, 'a', encoding='utf-8') as journal_file:
+        journal_file.write('{"chunk": 1, "created": 2, "keys": ["C"')
+
+    resumed = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    assert resumed.created == 2
+    assert resumed.keys == {'A', 'B'}
+
+    # Новая запись не дописывается к обрывку и читается при следующем продолжении
+    resumed.record(1, 1, ['C'])
+    again = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    assert again.created == 3
+    assert again.keys == {'A', 'B', 'C'}
+
+
+def test_last_line_without_newline_is_kept(tmp_path):
+    journal = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    journal.start(baseline=0)
+    journal.record(0, 1, ['A'])
+    with open(journal.path, 'rb+') as journal_file:
+        journal_file.truncate(os.path.getsize(journal.path) - 1)
+
+    resumed = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    resumed.record(1, 1, ['B'])
+    assert BulkJournal(journal_dir(tmp_path), 'p1', PARAMS).keys == {'A', 'B'}
+
+
+def test_truncated_header_starts_over(tmp_path):
+    journal = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    with open(journal.path, 'w', encoding='utf-8') as journal_file:
+        journal_file.write('{"params": {"scen')
+
+    assert not BulkJournal(journal_dir(tmp_path), 'p1', PARAMS).resumed
+
+
+def test_finish_removes_the_journal(tmp_path):
+    journal = BulkJournal(journal_dir(tmp_path), 'p1', PARAMS)
+    journal.start(baseline=0)
+    journal.record(0, 1)
+    journal.finish()
+
+    assert not os.path.exists(journal.path)
+    assert not BulkJournal(journal_dir(tmp_path), 'p1', PARAMS).resumed
@@ -0,0 +1,49 @@
+import json
+
+from fiscal_index import FiscalIndex, fiscal_key, fiscal_key_from_qr, read_export
+
+
+def test_key_from_qr_matches_key_from_fields():
+    qr = 't=20240315T1530&s=3500.00&fn=9960440300000001&i=12345&fp=3298712345&n=1'
+    assert fiscal_key_from_qr(qr) == fiscal_key('9960440300000001', '12345', '3298712345')
+
+
+def test_invalid_fields_give_no_key():
+    assert fiscal_key(None, 1, 2) is None
+    assert fiscal_key('abc', 1, 2) is None
+    assert fiscal_key(1, 2, 2 ** 32) is None
+    assert fiscal_key_from_qr('t=20240315T1530&s=3500.00') is None
+
+
+def test_added_keys_survive_restart(tmp_path):
+    path = str(tmp_path / 'index.bin')
+    index = FiscalIndex(path)
+    key = fiscal_key(1, 2, 3)
+
+    assert index.add(key)
+    assert not index.add(key)
+    assert FiscalIndex(path).contains(key)
+
+
+def test_truncated_record_is_ignored(tmp_path):
+    path = tmp_path / 'index.bin'
+    path.write_bytes(fiscal_key(1, 2, 3) + b'\x01\x02')
+
+    index = FiscalIndex(str(path))
+    assert len(index) == 1
+    assert index.contains(fiscal_key(1, 2, 3))
+
+
+def test_export_keys_from_csv_and_jsonl(tmp_path):
+    csv_path = tmp_path / 'export.csv'
+    csv_path.write_text('fn;fd;fp\n1;2;3\n4;5;6\n', encoding='utf-8')
+    jsonl_path = tmp_path / 'export.jsonl'
+    jsonl_path.write_text(
+        json.dumps({'data': {'json': {'fiscalDriveNumber': 7, 'fiscalDocumentNumber': 8, 'fiscalSign': 9}}}) + '\nnot json\n',
+        encoding='utf-8'
+    )
+
+    index = FiscalIndex(str(tmp_path / 'index.bin'))
+    assert index.add_many(read_export(str(csv_path), ';')) == 2
+    assert index.add_many(read_export(str(jsonl_path))) == 1
+    assert index.contains(fiscal_key(7, 8, 9))
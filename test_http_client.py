@@ -0,0 +1,92 @@
+import threading
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+import pytest
+
+from http_client import Upstream, CircuitOpenError
+
+
+class FakeService(BaseHTTPRequestHandler):
+    # Ответы по очереди из statuses сервера; когда список кончается, отвечает 200
+    def respond(self):
+        self.server.hits += 1
+        status = self.server.statuses.pop(0) if self.server.statuses else 200
+        self.send_response(status)
+        self.send_header('Content-Length', '0')
+        self.end_headers()
+
+    do_GET = do_POST = respond
+
+    def log_message(self, *args):
+        pass
+
+
+@pytest.fixture
+def service():
+    server = ThreadingHTTPServer(('127.0.0.1', 0), FakeService)
+    server.hits = 0
+    server.statuses = []
+    server.url = f'http://127.0.0.1:{server.server_port}/'
+    thread = threading.Thread(target=server.serve_forever, daemon=True)
+    thread.start()
+    yield server
+    server.shutdown()
+
+
+def make_upstream(**kwargs):
+    return Upstream('test', retries=2, backoff_base=0.001, **kwargs)
+
+
+def test_get_is_retried_after_5xx(service):
+    service.statuses = [502, 503]
+    response = make_upstream().get(service.url)
+
+    assert response.status_code == 200
+    assert service.hits == 3
+
+
+def test_post_is_not_retried_after_5xx(service):
+    service.statuses = [502]
+    response = make_upstream().post(service.url)
+
+    assert response.status_code == 502
+    assert service.hits == 1
+
+
+def test_post_is_retried_after_429(service):
+    service.statuses = [429]
+    response = make_upstream().post(service.url)
+
+    assert response.status_code == 200
+    assert service.hits == 2
+
+
+def test_idempotent_post_is_retried(service):
+    service.statuses = [500]
+    response = make_upstream().post(service.url, idempotent=True)
+
+    assert response.status_code == 200
+    assert service.hits == 2
+
+
+def test_breaker_opens_after_consecutive_failures(service):
+    service.statuses = [500] * 3
+    upstream = make_upstream(breaker_threshold=3, breaker_reset=60)
+    for _ in range(3):
+        upstream.post(service.url)
+
+    with pytest.raises(CircuitOpenError) as error:
+        upstream.post(service.url)
+    assert error.value.retry_at > upstream.open_until - 1
+    assert service.hits == 3
+    assert upstream.stats()['circuit_open']
+
+
+def test_breaker_lets_one_trial_through_after_reset(service):
+    service.statuses = [500] * 2
+    upstream = make_upstream(breaker_threshold=2, breaker_reset=0)
+    upstream.post(service.url)
+    upstream.post(service.url)
+
+    assert upstream.post(service.url).status_code == 200
+    assert upstream.stats()['consecutive_failures'] == 0
@@ -0,0 +1,147 @@
+import time
+import threading
+
+import pytest
+
+from job_queue import DurableQueue, RetryLater
+
+
+def wait_for(queue, job_id, statuses=('done', 'failed'), timeout=10):
+    deadline = time.time() + timeout
+    while time.time() < deadline:
+        job = queue.get(job_id)
+        if job['status'] in statuses:
+            return job
+        time.sleep(0.02)
+    raise AssertionError(f"задача {job_id} не завершилась: {queue.get(job_id)}")
+
+
+@pytest.fixture
+def make_queue(tmp_path):
+    def make(handler, **kwargs):
+        kwargs.setdefault('backoff_base', 0.01)
+        return DurableQueue(str(tmp_path / 'jobs.sqlite3'), handler, workers=1, **kwargs)
+    return make
+
+
+def test_job_is_processed_with_payload_and_blob(make_queue):
+    seen = []
+    queue = make_queue(lambda job_id, payload, blob: seen.append((payload, blob)))
+    queue.start()
+    job_id = queue.put({'bill_id': 'b1'}, blob=b'photo')
+
+    job = wait_for(queue, job_id)
+    assert job['status'] == 'done'
+    assert job['attempts'] == 1
+    assert seen == [({'bill_id': 'b1'}, b'photo')]
+
+
+def test_same_job_id_is_not_queued_twice(make_queue):
+    queue = make_queue(lambda *args: None)
+    first = queue.put({'n': 1}, job_id='prize-1')
+    second = queue.put({'n': 2}, job_id='prize-1')
+
+    assert first == second == 'prize-1'
+    assert queue.get('prize-1')['payload'] == {'n': 1}
+    assert queue.stats()['queued'] == 1
+
+
+def test_failed_job_is_queued_again_with_new_payload(make_queue):
+    queue = make_queue(lambda *args: None)
+    queue.put({'n': 1}, job_id='prize-1')
+    queue.conn.execute("UPDATE jobs SET status = 'failed', attempts = 3, error = 'boom' WHERE id = 'prize-1'")
+
+    queue.put({'n': 2}, job_id='prize-1')
+    job = queue.get('prize-1')
+    assert (job['status'], job['attempts'], job['error'], job['payload']) == ('queued', 0, None, {'n': 2})
+
+
+def test_full_queue_rejects_new_jobs(make_queue):
+    queue = make_queue(lambda *args: None, max_pending=1)
+    assert queue.put({'n': 1}) is not None
+    assert queue.put({'n': 2}) is None
+
+
+def test_error_is_retried_until_max_attempts(make_queue):
+    calls = []
+
+    def handler(job_id, payload, blob):
+        calls.append(job_id)
+        raise RuntimeError('недоступен')
+
+    queue = make_queue(handler, max_attempts=3)
+    queue.start()
+    job = wait_for(queue, queue.put({}))
+
+    assert job['status'] == 'failed'
+    assert job['attempts'] == 3
+    assert job['error'] == 'недоступен'
+    assert len(calls) == 3
+
+
+def test_retry_later_does_not_spend_attempts(make_queue, monkeypatch):
+    # Без случайного разброса отложенная задача возвращается сразу
+    monkeypatch.setattr('job_queue.random.uniform', lambda low, high: 0)
+    calls = []
+
+    def handler(job_id, payload, blob):
+        calls.append(job_id)
+        if len(calls) < 3:
+            raise RetryLater('сервис закрыт', time.time())
+
+    queue = make_queue(handler, max_attempts=1)
+    queue.start()
+    job = wait_for(queue, queue.put({}))
+
+    assert job['status'] == 'done'
+    assert job['attempts'] == 1
+    assert queue.stats()['postponed_total'] == 2
+
+
+def test_update_payload_is_seen_by_the_retry(make_queue):
+    payloads = []
+
+    def handler(job_id, payload, blob):
+        payloads.append(dict(payload))
+        if 'step' not in payload:
+            queue.update_payload(job_id, {**payload, 'step': 'checked'})
+            raise RuntimeError('сбой после шага')
+
+    queue = make_queue(handler)
+    queue.start()
+    wait_for(queue, queue.put({'bill_id': 'b1'}))
+
+    assert payloads == [{'bill_id': 'b1'}, {'bill_id': 'b1', 'step': 'checked'}]
+
+
+def test_startup_recovers_only_jobs_of_exited_processes(make_queue):
+    queue = make_queue(lambda *args: None)
+    for job_id in ('alive', 'exited', 'legacy'):
+        queue.put({}, job_id=job_id)
+    # pid 1 есть всегда, 2**22 + 1 больше предела pid в Linux
+    queue.conn.execute("UPDATE jobs SET status = 'running', owner = 1 WHERE id = 'alive'")
+    queue.conn.execute("UPDATE jobs SET status = 'running', owner = ? WHERE id = 'exited'", (2 ** 22 + 1,))
+    queue.conn.execute("UPDATE jobs SET status = 'running', owner = NULL WHERE id = 'legacy'")
+
+    restarted = make_queue(lambda *args: None)
+    assert restarted.get('alive')['status'] == 'running'
+    assert restarted.get('exited')['status'] == 'queued'
+    assert restarted.get('legacy')['status'] == 'queued'
+
+
+def test_job_is_claimed_by_one_worker_only(make_queue):
+    calls = []
+    lock = threading.Lock()
+
+    def handler(job_id, payload, blob):
+        with lock:
+            calls.append(job_id)
+
+    queue = make_queue(handler)
+    queue.workers = 4
+    job_ids = [queue.put({'n': i}) for i in range(20)]
+    queue.start()
+    for job_id in job_ids:
+        wait_for(queue, job_id)
+
+    assert sorted(calls) == sorted(job_ids)
@@ -0,0 +1,57 @@
+from flask import Flask
+
+import metrics
+
+
+def test_counter_samples_with_labels():
+    counter = metrics.Counter('test_counter_total', 'Счетчик', ['mode'])
+    counter.inc('bulk')
+    counter.inc('bulk', amount=4)
+    counter.inc('say "hi"\n')
+
+    assert counter.samples() == [
+        'test_counter_total{mode="bulk"} 5',
+        'test_counter_total{mode="say \\"hi\\"\\n"} 1',
+    ]
+
+
+def test_histogram_buckets_are_cumulative():
+    histogram = metrics.Histogram('test_seconds', 'Гистограмма', ['stage'], buckets=(0.1, 1))
+    for value in (0.05, 0.5, 0.5, 5):
+        histogram.observe(value, 'ocr')
+
+    assert histogram.samples() == [
+        'test_seconds_bucket{stage="ocr",le="0.1"} 1',
+        'test_seconds_bucket{stage="ocr",le="1"} 3',
+        'test_seconds_bucket{stage="ocr",le="+Inf"} 4',
+        'test_seconds_sum{stage="ocr"} 6.05',
+        'test_seconds_count{stage="ocr"} 4',
+    ]
+
+
+def test_gauge_function_is_read_on_render():
+    depth = {'queued': 3}
+    gauge = metrics.Gauge('test_queue_jobs', 'Очередь', ['status'],
+                          function=lambda: {(status,): count for status, count in depth.items()})
+    depth['queued'] = 7
+
+    assert gauge.samples() == ['test_queue_jobs{status="queued"} 7']
+
+
+def test_metrics_endpoint_records_requests():
+    app = Flask(__name__)
+    metrics.install(app)
+
+    @app.route('/ping')
+    def ping():
+        return 'pong'
+
+    client = app.test_client()
+    client.get('/ping')
+    response = client.get('/metrics')
+    text = response.get_data(as_text=True)
+
+    assert response.status_code == 200
+    assert response.content_type == metrics.CONTENT_TYPE
+    assert '# TYPE http_request_seconds histogram' in text
+    assert 'http_request_seconds_count{endpoint="ping",status="200"} 1' in text
@@ -0,0 +1,57 @@
+import time
+
+from receipt_cache import ReceiptCache, normalize_url, content_hash
+
+
+def test_normalize_url_drops_query_and_scheme_differences():
+    assert normalize_url('//CDN.Bubble.io/f/receipt.jpg?w=100') == 'https://cdn.bubble.io/f/receipt.jpg'
+    assert normalize_url('http://cdn.bubble.io/f/receipt.jpg#x') == 'https://cdn.bubble.io/f/receipt.jpg'
+
+
+def test_result_is_found_by_url_and_by_hash():
+    cache = ReceiptCache(path=None)
+    digest = content_hash(b'photo')
+    cache.put('https://cdn/a.jpg', digest, 't=1&fn=2', 'pyzbar')
+
+    assert cache.get_by_url('https://cdn/a.jpg')['qr'] == 't=1&fn=2'
+    # Тот же файл по другому URL находится по хешу и привязывается к новому URL
+    assert cache.get_by_hash(digest, url='https://cdn/b.jpg')['method'] == 'pyzbar'
+    assert cache.get_by_url('https://cdn/b.jpg')['qr'] == 't=1&fn=2'
+
+
+def test_negative_result_expires_before_positive():
+    cache = ReceiptCache(ttl=60, negative_ttl=0.01, path=None)
+    cache.put('https://cdn/found.jpg', 'h1', 't=1', 'zxing')
+    cache.put('https://cdn/missing.jpg', 'h2', None, 'zxing')
+    time.sleep(0.02)
+
+    assert cache.get_by_url('https://cdn/found.jpg') is not None
+    assert cache.get_by_url('https://cdn/missing.jpg') is None
+
+
+def test_incomplete_decode_is_not_cached():
+    cache = ReceiptCache(path=None)
+    cache.put('https://cdn/a.jpg', 'h', None, None)
+
+    assert cache.get_by_url('https://cdn/a.jpg') is None
+    assert cache.get_by_hash('h') is None
+
+
+def test_least_recently_used_entry_is_evicted():
+    cache = ReceiptCache(max_size=2, path=None)
+    cache.put(None, 'h1', 'q1', 'pyzbar')
+    cache.put(None, 'h2', 'q2', 'pyzbar')
+    cache.get_by_hash('h1')
+    cache.put(None, 'h3', 'q3', 'pyzbar')
+
+    assert cache.get_by_hash('h1') is not None
+    assert cache.get_by_hash('h2') is None
+
+
+def test_journal_is_reloaded(tmp_path):
+    path = str(tmp_path / 'cache.jsonl')
+    cache = ReceiptCache(path=path)
+    cache.put('https://cdn/a.jpg', 'h', 't=1', 'pyzbar')
+
+    reloaded = ReceiptCache(path=path)
+    assert reloaded.get_by_url('https://cdn/a.jpg')['qr'] == 't=1'
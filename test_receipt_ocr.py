@@ -0,0 +1,52 @@
+from PIL import Image
+
+from receipt_ocr import parse_line, otsu_threshold
+
+
+def parse(label_text, digits_text='', fields=None):
+    fields = {} if fields is None else fields
+    parse_line(label_text, digits_text, fields)
+    return fields
+
+
+def test_total_with_thousands_separator():
+    assert parse('ИТОГ =3 500.00') == {'total': '3500.00'}
+    assert parse('ИТОГ =3 500.00', '=3 500.00') == {'total': '3500.00'}
+    assert parse('ИТОГ 1 234 567,89', '1 234 567,89') == {'total': '1234567.89'}
+
+
+def test_shorter_digits_value_does_not_replace_label_match():
+    assert parse('ИТОГ =3 500.00', '500.00') == {'total': '3500.00'}
+
+
+def test_digits_pass_corrects_misread_label_text():
+    # В тексте строки O вместо нулей, цифровой проход читает число верно
+    assert parse('ИТОГ =35OO.00', '3500.00') == {'total': '3500.00'}
+
+
+def test_fiscal_fields_are_taken_in_label_order():
+    fields = parse('ФД: 12345 ФП: 3298712345', '12345 3298712345')
+    assert fields == {'fd': '12345', 'fp': '3298712345'}
+
+
+def test_fn_requires_sixteen_digits():
+    assert parse('ФН: 9960440300000001', '9960440300000001') == {'fn': '9960440300000001'}
+    assert 'fn' not in parse('ФН: 99604403', '99604403')
+
+
+def test_date_and_operation_type():
+    fields = parse('15.03.24 15:30 ПРИХОД')
+    assert fields == {'check_time': '20240315T1530', 'type': 1}
+    assert parse('ВОЗВРАТ ПРИХОДА')['type'] == 2
+
+
+def test_fields_found_earlier_are_kept():
+    fields = parse('ФД: 111', '111')
+    parse('ФД: 222', '', fields)
+    assert fields['fd'] == '111'
+
+
+def test_otsu_threshold_splits_two_levels():
+    image = Image.new('L', (10, 10), 30)
+    image.paste(220, (0, 0, 10, 5))
+    assert 30 <= otsu_threshold(image) < 220
@@ -0,0 +1,66 @@
+import pytest
+
+from receipt_rules import DEFAULT_RULES, ReceiptRules
+
+
+def make_rules(**overrides):
+    return ReceiptRules({**DEFAULT_RULES, **overrides})
+
+
+def check_json(total=350000, date_time='2024-12-31T23:59:00', operation_type=1, **extra):
+    return {'totalSum': total, 'dateTime': date_time, 'operationType': operation_type, **extra}
+
+
+def test_date_only_end_covers_the_whole_day():
+    rules = make_rules(start='2024-12-01', end='2024-12-31')
+
+    assert rules.check(check_json(date_time='2024-12-31T23:59:00')) == []
+    assert rules.check(check_json(date_time='2025-01-01T00:01:00'))
+    assert rules.check(check_json(date_time='2024-11-30T23:59:00'))
+
+
+def test_end_with_time_is_exact():
+    rules = make_rules(end='2024-12-31T12:00')
+    assert rules.check(check_json(date_time='2024-12-31T12:30:00'))
+
+
+def test_qr_window_uses_the_same_rules():
+    rules = make_rules(start='20241201', end='20241231')
+
+    assert rules.check_qr('t=20241231T2359&s=3500.00&fn=1&i=2&fp=3&n=1') == []
+    assert rules.check_qr('t=20250101T0001&s=3500.00&fn=1&i=2&fp=3&n=1')
+
+
+def test_unknown_date_is_rejected_only_with_a_window():
+    assert make_rules().check(check_json(date_time='')) == []
+    assert make_rules(end='2024-12-31').check(check_json(date_time=''))
+
+
+def test_total_and_operation_type():
+    rules = make_rules()
+
+    assert rules.check(check_json(total=299999))
+    assert rules.check(check_json(operation_type=2))
+    assert rules.check(check_json()) == []
+
+
+def test_incomplete_qr_defers_the_decision():
+    assert make_rules().check_qr('t=20241231T2359&fn=1') == []
+
+
+def test_seller_and_inn_lists():
+    rules = make_rules(inn_deny=['7707083893'])
+
+    assert rules.check(check_json(user='ПАО СБЕРБАНК'))
+    assert rules.check(check_json(userInn='7707083893 '))
+    assert rules.rejected == 2
+
+
+def test_address_rule_is_off_without_patterns():
+    assert make_rules().check(check_json(retailPlaceAddress='где угодно')) == []
+    assert make_rules(address_patterns=['мира,? 1']).check(check_json(retailPlaceAddress='ул. Ленина, 5'))
+
+
+def test_required_address_rule_without_patterns_fails():
+    with pytest.raises(ValueError):
+        make_rules(require_address=True)
@@ -0,0 +1,35 @@
+import os
+
+from send_journal import SendJournal
+
+
+def test_resume_skips_only_final_results(tmp_path):
+    path = str(tmp_path / 'journal.sqlite3')
+    journal = SendJournal(path)
+    journal.record(1, 'sent_user', 'sent', final=True)
+    journal.record(2, 'blocked_user', 'blocked', final=True)
+    journal.record(3, 'flaky_user', 'timeout', final=False)
+    journal.close()
+
+    resumed = SendJournal(path, resume=True)
+    assert sorted(resumed.done_ids()) == [1, 2]
+
+
+def test_later_result_replaces_earlier_one(tmp_path):
+    journal = SendJournal(str(tmp_path / 'journal.sqlite3'))
+    journal.record(3, 'flaky_user', 'timeout', final=False)
+    journal.record(3, 'flaky_user', 'sent', final=True)
+
+    assert list(journal.rows()) == [(3, 'flaky_user', 'sent')]
+    assert list(journal.done_ids()) == [3]
+
+
+def test_new_broadcast_moves_the_old_journal_aside(tmp_path):
+    path = str(tmp_path / 'journal.sqlite3')
+    journal = SendJournal(path)
+    journal.record(1, 'user', 'sent', final=True)
+    journal.close()
+
+    fresh = SendJournal(path)
+    assert list(fresh.done_ids()) == []
+    assert any(name.endswith('.old') for name in os.listdir(tmp_path))